@@ -0,0 +1,107 @@
+# benchmarks/bench_fleet_forecast.py
+"""
+Report the wall-clock time of the fleet forecast job for each number of
+worker processes, on a scratch database filled with synthetic hourly rollups.
+
+Speedup only reflects core scaling for worker counts up to the number of
+CPUs; rows beyond it are marked, since they measure pool overhead on
+oversubscribed cores rather than parallel speedup.
+
+Usage: python -m benchmarks.bench_fleet_forecast [--devices 2000] [--workers 0,1,2,4]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import database
+from benchmarks.bench_metrics_ingest import create_scratch_db
+from database import HISTORY_METRICS, ROLLUP_RESOLUTIONS, read_connection, write_connection
+from models.holt_winters import holt_winters_forecast
+from utils.fleet_forecast import (
+    FLEET_FORECAST_HISTORY_HOURS, SERIES_TABLE, SERIES_STEP_SECONDS, run_fleet_forecast
+)
+
+NOW = 1700000000
+
+
+def fill_hourly_rollups(device_count, hours, seed=0):
+    """Write `hours` of daily-seasonal hourly rollups for every device."""
+    rng = np.random.default_rng(seed)
+    end = NOW // SERIES_STEP_SECONDS * SERIES_STEP_SECONDS
+    buckets = end - SERIES_STEP_SECONDS * np.arange(hours, 0, -1)
+    daily = np.sin(2 * np.pi * (buckets // SERIES_STEP_SECONDS % 24) / 24)
+    columns = ', '.join(f'{m}_min, {m}_max, {m}_mean' for m in HISTORY_METRICS)
+    placeholders = ', '.join('?' * (3 + 3 * len(HISTORY_METRICS)))
+    for device_id in range(1, device_count + 1):
+        base = rng.uniform(10, 60, len(HISTORY_METRICS))
+        growth = rng.uniform(0, 0.02, len(HISTORY_METRICS))
+        means = (base + np.outer(np.arange(hours), growth)
+                 + 10 * daily[:, None] + rng.normal(0, 2, (hours, len(HISTORY_METRICS))))
+        with write_connection() as conn:
+            conn.executemany(f'''
+                INSERT INTO {SERIES_TABLE} (device_id, bucket_start, sample_count, {columns})
+                VALUES ({placeholders})
+            ''', [
+                (device_id, int(bucket), 360, *[v for value in row for v in (value, value, value)])
+                for bucket, row in zip(buckets, means.tolist())
+            ])
+
+
+def check_forecast(device_id, metric):
+    """Compare a stored forecast with holt_winters_forecast at its fitted parameters."""
+    columns = ', '.join(f'{m}_mean' for m in HISTORY_METRICS)
+    with read_connection() as conn:
+        stored = conn.execute('''
+            SELECT * FROM device_forecasts WHERE device_id = ? AND metric = ?
+        ''', (device_id, metric)).fetchone()
+        rows = conn.execute(f'''
+            SELECT {columns} FROM {SERIES_TABLE} WHERE device_id = ? ORDER BY bucket_start
+        ''', (device_id,)).fetchall()
+    series = [row[HISTORY_METRICS.index(metric)] for row in rows]
+    forecast = json.loads(stored['forecast'])
+    expected = holt_winters_forecast(
+        series, stored['alpha'], stored['beta'], stored['gamma'],
+        stored['season_length'], len(forecast)
+    )
+    assert np.allclose(forecast, expected, atol=1e-3), (device_id, metric)
+
+
+def run(device_count, worker_counts, hours):
+    assert ROLLUP_RESOLUTIONS[1][2] == SERIES_TABLE
+    with tempfile.TemporaryDirectory() as tmp:
+        create_scratch_db(os.path.join(tmp, 'bench.db'), device_count)
+        fill_hourly_rollups(device_count, hours)
+
+        cpus = os.cpu_count() or 1
+        print(f'devices: {device_count}, series: {device_count * len(HISTORY_METRICS)}, '
+              f'hours: {hours}, cpus: {cpus}')
+        print(f'{"workers":>8} {"seconds":>9} {"series/s":>10} {"speedup":>8} {"efficiency":>10}')
+        baseline = None
+        for workers in worker_counts:
+            summary = run_fleet_forecast(workers=workers, hours=hours, now=NOW)
+            seconds = summary['seconds']
+            baseline = baseline or seconds
+            efficiency = baseline / seconds / max(workers, 1)
+            print(f'{workers:>8} {seconds:>9.2f} {summary["series"] / seconds:>10.0f} '
+                  f'{baseline / seconds:>7.2f}x {efficiency:>9.0%}'
+                  f'{"  (more workers than cpus)" if workers > cpus else ""}')
+
+        check_forecast(1, 'cpu_usage')
+        check_forecast(device_count, 'temperature')
+        print(f'grid size: {summary["grid_size"]} parameter sets per series; '
+              f'stored forecasts match holt_winters_forecast')
+        database.reset_connection_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--workers', default='0,1,2,4',
+                        help='comma-separated worker counts; 0 runs in-process')
+    parser.add_argument('--hours', type=int, default=FLEET_FORECAST_HISTORY_HOURS)
+    args = parser.parse_args()
+    run(args.devices, [int(w) for w in args.workers.split(',')], args.hours)
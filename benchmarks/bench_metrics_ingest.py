@@ -0,0 +1,84 @@
+# benchmarks/bench_metrics_ingest.py
+"""
+Compare the per-device PUT /api/device_metrics/<id> path (queued for the
+background writer, timed until the queue drains) with the batched
+POST /api/device_metrics/batch path on a scratch database.
+
+Usage: python -m benchmarks.bench_metrics_ingest [--devices 2000] [--batch-size 500]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from flask import Flask
+
+import database
+import routes.device_management_DBroutes as dm_routes
+
+
+def create_scratch_db(path, device_count):
+    """Initialize the schema in `path` and add `device_count` devices."""
+    database.DATABASE_NAME = path
+    database.reset_connection_pool()
+    database.init_db()
+    with database.write_connection() as conn:
+        conn.executemany(
+            'INSERT INTO devices (id, name, type, x, y) VALUES (?, ?, ?, 0, 0)',
+            [(i, f'device-{i}', 'server') for i in range(1, device_count + 1)]
+        )
+
+
+def random_sample(device_id):
+    return {
+        'device_id': device_id,
+        'cpu': random.randint(0, 100),
+        'memory': random.randint(0, 100),
+        'disk': random.randint(0, 100),
+        'vulnerability': random.randint(0, 100),
+        'network': random.uniform(0, 500),
+        'temperature': random.uniform(30, 80)
+    }
+
+
+def run(device_count, batch_size):
+    app = Flask(__name__)
+    app.register_blueprint(dm_routes.device_management_db_bp, url_prefix='/api')
+    client = app.test_client()
+    device_ids = list(range(1, device_count + 1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        create_scratch_db(os.path.join(tmp, 'bench.db'), device_count)
+
+        started = time.perf_counter()
+        for device_id in device_ids:
+            client.put(f'/api/device_metrics/{device_id}', json=random_sample(device_id))
+        # PUTs are queued for the background writer; include the drain time
+        dm_routes.get_metrics_writer().flush()
+        single_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for start in range(0, device_count, batch_size):
+            chunk = device_ids[start:start + batch_size]
+            client.post('/api/device_metrics/batch',
+                        json={'samples': [random_sample(i) for i in chunk]})
+        batch_seconds = time.perf_counter() - started
+
+        dm_routes.get_metrics_writer().stop()
+        dm_routes.get_analysis_pipeline().stop()
+        database.reset_connection_pool()
+
+    print(f'devices: {device_count}, batch size: {batch_size}')
+    print(f'queued PUT     : {device_count / single_seconds:10.0f} samples/s ({single_seconds:.2f}s)')
+    print(f'batched POST   : {device_count / batch_seconds:10.0f} samples/s ({batch_seconds:.2f}s)')
+    print(f'speedup        : {single_seconds / batch_seconds:10.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    run(args.devices, args.batch_size)
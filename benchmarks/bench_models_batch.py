@@ -0,0 +1,146 @@
+# benchmarks/bench_models_batch.py
+"""
+Compare the scalar models with their NumPy batch versions over a synthetic
+fleet. Every batch result is first checked against the scalar function on a
+sample of devices, then both are timed and reported as cost per device.
+
+Usage: python -m benchmarks.bench_models_batch [--devices 100000] [--scalar-devices 10000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from models.composite_risk_score import (
+    calculate_composite_risk_score, calculate_composite_risk_score_batch
+)
+from models.ema import calculate_ema, calculate_ema_batch
+from models.sigmoid_modified import sigmoid_modified, sigmoid_modified_batch
+from models.state_transition_adjusted import (
+    state_transition_adjusted, state_transition_adjusted_batch
+)
+from models.time_decay import calculate_time_decay, calculate_time_decay_batch
+from models.time_decay_multiple import (
+    calculate_time_decay_multiple, calculate_time_decay_multiple_batch
+)
+from models.user_risk_score import calculate_user_risk_score, calculate_user_risk_score_batch
+from models.weighted_score import calculate_weighted_score, calculate_weighted_score_batch
+from models.wma import calculate_wma, calculate_wma_batch
+from models.zscore import calculate_zscore, calculate_zscore_batch
+
+FACTORS = ['cpu', 'memory', 'disk', 'vulnerability']
+WEIGHTS = {'cpu': 0.3, 'memory': 0.2, 'disk': 0.2, 'vulnerability': 0.3}
+DECAY_RATES = {'cpu': 0.1, 'memory': 0.2, 'disk': 0.05, 'vulnerability': 0.01}
+WMA_WEIGHTS = [1, 2, 3, 4, 5]
+STATES = np.array(['normal', 'warning', 'critical'])
+ACTIONS = np.array(['none', 'mitigated'])
+THRESHOLDS = {'warning': 0.7, 'critical': 0.9}
+
+
+def make_fleet(device_count, seed=0):
+    """Random normalized factors and model inputs for `device_count` devices."""
+    rng = np.random.default_rng(seed)
+    factors = np.zeros(device_count, dtype=[(f, float) for f in FACTORS])
+    for f in FACTORS:
+        factors[f] = rng.random(device_count)
+    stds = dict(zip(FACTORS, [0.1, 0.2, 0.0, 0.3]))
+    return {
+        'factors': factors,
+        'previous': rng.random((device_count, len(FACTORS))),
+        'means': dict(zip(FACTORS, [0.5, 0.4, 0.6, 0.3])),
+        'stds': stds,
+        'elapsed': rng.random(device_count) * 10,
+        'windows': rng.random((device_count, len(WMA_WEIGHTS))) * 100,
+        'states': rng.choice(STATES, device_count),
+        'actions': rng.choice(ACTIONS, device_count),
+        'risk': np.column_stack([rng.random(device_count) * 0.6, rng.random(device_count) * 0.5])
+    }
+
+
+def scalar_models(fleet, n):
+    """Scalar model outputs for the first `n` devices, one device at a time."""
+    factors, previous = fleet['factors'], fleet['previous']
+    means, stds = fleet['means'], fleet['stds']
+    out = {name: [] for name in (
+        'ema', 'zscore', 'sigmoid', 'weighted', 'composite', 'user_risk',
+        'decay', 'decay_multiple', 'wma', 'state'
+    )}
+    for i in range(n):
+        row = {f: float(factors[f][i]) for f in FACTORS}
+        out['ema'].append([calculate_ema(row[f], previous[i, k]) for k, f in enumerate(FACTORS)])
+        out['zscore'].append(calculate_zscore(row['cpu'], means['cpu'], stds['cpu']))
+        out['sigmoid'].append(sigmoid_modified(row, WEIGHTS))
+        out['weighted'].append(calculate_weighted_score(row, WEIGHTS))
+        out['composite'].append(calculate_composite_risk_score(row, WEIGHTS))
+        out['user_risk'].append(calculate_user_risk_score(row, means, stds, WEIGHTS))
+        out['decay'].append(calculate_time_decay(row['cpu'], DECAY_RATES['cpu'], fleet['elapsed'][i]))
+        decayed = calculate_time_decay_multiple(row, DECAY_RATES, fleet['elapsed'][i])
+        out['decay_multiple'].append([decayed[f] for f in FACTORS])
+        out['wma'].append(calculate_wma(list(fleet['windows'][i]), WMA_WEIGHTS))
+        out['state'].append(state_transition_adjusted(
+            fleet['states'][i], fleet['actions'][i],
+            {'a': fleet['risk'][i, 0], 'b': fleet['risk'][i, 1]}, THRESHOLDS
+        ))
+    return out
+
+
+def batch_models(fleet, n):
+    """Batch model outputs for the first `n` devices."""
+    factors = fleet['factors'][:n]
+    elapsed = fleet['elapsed'][:n]
+    return {
+        'ema': calculate_ema_batch(factors.view((float, len(FACTORS))), fleet['previous'][:n]),
+        'zscore': calculate_zscore_batch(factors['cpu'], fleet['means']['cpu'], fleet['stds']['cpu']),
+        'sigmoid': sigmoid_modified_batch(factors, WEIGHTS),
+        'weighted': calculate_weighted_score_batch(factors, WEIGHTS),
+        'composite': calculate_composite_risk_score_batch(factors, WEIGHTS),
+        'user_risk': calculate_user_risk_score_batch(factors, fleet['means'], fleet['stds'], WEIGHTS),
+        'decay': calculate_time_decay_batch(factors['cpu'], DECAY_RATES['cpu'], elapsed),
+        'decay_multiple': calculate_time_decay_multiple_batch(factors, DECAY_RATES, elapsed),
+        'wma': calculate_wma_batch(fleet['windows'][:n], WMA_WEIGHTS),
+        'state': state_transition_adjusted_batch(
+            fleet['states'][:n], fleet['actions'][:n], fleet['risk'][:n], THRESHOLDS
+        )
+    }
+
+
+def check(fleet, n):
+    """Raise AssertionError if any batch model disagrees with its scalar version."""
+    scalar = scalar_models(fleet, n)
+    batch = batch_models(fleet, n)
+    for name, expected in scalar.items():
+        if name == 'state':
+            assert list(batch[name]) == expected, name
+        else:
+            assert np.allclose(batch[name], np.array(expected)), name
+
+
+def run(device_count, scalar_count):
+    fleet = make_fleet(device_count)
+    scalar_count = min(scalar_count, device_count)
+    check(fleet, min(1000, device_count))
+
+    started = time.perf_counter()
+    scalar_models(fleet, scalar_count)
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch_models(fleet, device_count)
+    batch_seconds = time.perf_counter() - started
+
+    scalar_us = scalar_seconds / scalar_count * 1e6
+    batch_us = batch_seconds / device_count * 1e6
+    print(f'devices: {device_count} (scalar timed on {scalar_count}), all 10 models, outputs match')
+    print(f'scalar loop    : {scalar_us:10.3f} us/device ({scalar_seconds:.2f}s)')
+    print(f'numpy batch    : {batch_us:10.3f} us/device ({batch_seconds:.3f}s)')
+    print(f'speedup        : {scalar_us / batch_us:10.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--scalar-devices', type=int, default=10000,
+                        help='devices timed through the scalar loop, to keep the run short')
+    args = parser.parse_args()
+    run(args.devices, args.scalar_devices)
@@ -0,0 +1,147 @@
+# benchmarks/bench_server_rps.py
+"""
+Requests per second of the topology and ingest endpoints under the Flask
+development server (python server.py) and the production server (gunicorn
+with gunicorn.conf.py), each run as a subprocess against the same scratch
+database and driven by keep-alive client threads.
+
+Usage: python -m benchmarks.bench_server_rps [--devices 500] [--seconds 10] [--concurrency 16]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import database
+from benchmarks.bench_metrics_ingest import create_scratch_db, random_sample
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPOLOGY_PATH = '/api/network/topology/details?mode=temporal'
+INGEST_PATH = '/api/device_metrics/batch'
+INGEST_BATCH = 50
+
+
+def seed_database(path, device_count):
+    """Scratch database with devices, a sparse connection graph and one sample per device."""
+    create_scratch_db(path, device_count)
+    with database.write_connection() as conn:
+        conn.executemany(
+            'INSERT INTO connections (source_device_id, target_device_id) VALUES (?, ?)',
+            [(i, random.randint(1, device_count)) for i in range(1, device_count + 1)]
+        )
+    database.reset_connection_pool()
+
+
+def start_server(kind, port, db_path, workers, threads):
+    env = dict(os.environ, DATABASE_PATH=db_path, LOG_LEVEL='WARNING', PORT=str(port),
+               GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads))
+    if kind == 'dev':
+        command = [sys.executable, 'server.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+    process = subprocess.Popen(command, cwd=ROOT, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', TOPOLOGY_PATH)
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{kind} server did not start on port {port}')
+
+
+def stop_server(process):
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def drive(port, method, path, make_body, seconds, concurrency):
+    """Issue requests from `concurrency` threads for `seconds`; return (requests/s, errors)."""
+    completed = [0] * concurrency
+    errors = [0] * concurrency
+    stop_at = time.monotonic() + seconds
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < stop_at:
+            try:
+                conn.request(method, path, body=make_body(),
+                             headers={'Content-Type': 'application/json'})
+                response = conn.getresponse()
+                response.read()
+                if response.status == 200:
+                    completed[index] += 1
+                else:
+                    errors[index] += 1
+            except (OSError, http.client.HTTPException):
+                errors[index] += 1
+                conn.close()
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return sum(completed) / seconds, sum(errors)
+
+
+def run(device_count, seconds, concurrency, workers, threads, port):
+    def ingest_body():
+        ids = random.sample(range(1, device_count + 1), INGEST_BATCH)
+        return json.dumps({'samples': [random_sample(i) for i in ids]})
+
+    endpoints = [
+        ('GET topology', 'GET', TOPOLOGY_PATH, lambda: None),
+        (f'POST ingest x{INGEST_BATCH}', 'POST', INGEST_PATH, ingest_body),
+    ]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        seed_database(db_path, device_count)
+        for kind in ('dev', 'gunicorn'):
+            process = start_server(kind, port, db_path, workers, threads)
+            try:
+                for name, method, path, make_body in endpoints:
+                    drive(port, method, path, make_body, 1, concurrency)
+                    results[(kind, name)] = drive(port, method, path, make_body, seconds, concurrency)
+            finally:
+                stop_server(process)
+
+    print(f'devices: {device_count}, clients: {concurrency}, {seconds}s per endpoint, '
+          f'gunicorn: {workers} workers x {threads} threads, cpus: {os.cpu_count()}')
+    print(f'{"endpoint":<16} {"dev req/s":>10} {"gunicorn req/s":>15} {"speedup":>8} {"errors":>8}')
+    for name, *_ in endpoints:
+        dev_rps, dev_errors = results[('dev', name)]
+        prod_rps, prod_errors = results[('gunicorn', name)]
+        print(f'{name:<16} {dev_rps:10.1f} {prod_rps:15.1f} {prod_rps / dev_rps:7.1f}x '
+              f'{dev_errors + prod_errors:8d}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=min(2 * (os.cpu_count() or 1) + 1, 8))
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+    run(args.devices, args.seconds, args.concurrency, args.workers, args.threads, args.port)
@@ -1,7 +1,7 @@
 # blueprints/device_management.py
 
 from flask import Blueprint, render_template, request, jsonify
-import sqlite3
+from database import read_connection, write_connection
 import os
 import json
 from datetime import datetime
@@ -9,7 +9,6 @@ from datetime import datetime
 device_management_bp = Blueprint('device_management', __name__, template_folder='templates')
 
 # Constants
-DATABASE = 'app.db'
 JSON_STORAGE_FOLDER = 'json_exports'
 
 # Ensure the folder for storing JSON exists
@@ -57,7 +56,7 @@ def save_network():
 
 def save_to_db(json_data, project_name):
     """Save network configuration to database with enhanced data structure."""
-    with sqlite3.connect(DATABASE) as conn:
+    with write_connection() as conn:
         cursor = conn.cursor()
         
         # Insert or update project
@@ -121,15 +120,13 @@ def save_to_db(json_data, project_name):
                 }))
             ))
 
-        conn.commit()
         return project_id
 
 @device_management_bp.route('/load_network/<int:project_id>', methods=['GET'])
 def load_network(project_id):
     """Load network configuration from database."""
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row
+        with read_connection() as conn:
             cursor = conn.cursor()
 
             # Get project info
@@ -182,8 +179,7 @@ def load_network(project_id):
 def get_projects():
     """Get list of all projects."""
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            conn.row_factory = sqlite3.Row
+        with read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM projects ORDER BY last_modified DESC')
             projects = [dict(row) for row in cursor.fetchall()]
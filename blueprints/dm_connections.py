@@ -1,7 +1,7 @@
 # dm_connections.py
 
 from flask import Blueprint, jsonify, request
-from database import get_db_connection  # Updated import to match database.py
+from database import read_connection, write_connection
 
 # Blueprint for managing connections
 dm_connections_bp = Blueprint('dm_connections', __name__)
@@ -9,7 +9,7 @@ dm_connections_bp = Blueprint('dm_connections', __name__)
 # Route to get all connections
 @dm_connections_bp.route('/connections', methods=['GET'])
 def get_connections():
-    with get_db_connection() as db:
+    with read_connection() as db:
         cursor = db.execute('SELECT * FROM connections')
         connections = cursor.fetchall()
         connections_list = [dict(connection) for connection in connections]
@@ -27,12 +27,11 @@ def add_connection():
     if not all([source_device, target_device, type_]):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    with get_db_connection() as db:
+    with write_connection() as db:
         db.execute('''
             INSERT INTO connections (start_device, end_device, type, bandwidth)
             VALUES (?, ?, ?, ?)
         ''', (source_device, target_device, type_, bandwidth))
-        db.commit()
     return jsonify({'message': 'Connection added successfully'}), 201
 
 # Route to delete a connection
@@ -45,11 +44,10 @@ def delete_connection():
     if not all([source_device, target_device]):
         return jsonify({'error': 'Missing required fields'}), 400
 
-    with get_db_connection() as db:
+    with write_connection() as db:
         db.execute('''
             DELETE FROM connections WHERE start_device = ? AND end_device = ?
         ''', (source_device, target_device))
-        db.commit()
     return jsonify({'message': 'Connection deleted successfully'}), 200
 
 
@@ -57,7 +55,7 @@ def delete_connection():
 # Route to get connections for a specific device
 @dm_connections_bp.route('/connections/<device_name>', methods=['GET'])
 def get_connections_for_device(device_name):
-    with get_db_connection() as db:
+    with read_connection() as db:
         cursor = db.execute('''
             SELECT * FROM connections
             WHERE start_device = ? OR end_device = ?
@@ -1,15 +1,54 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from models.device_zscore import DeviceZScore
-from database import get_db_connection
-from contextlib import closing
+from models.device_baseline import device_baseline
+from models.device_forecast import device_forecaster
+from models.device_state_machine import device_state_machine
+from utils.fleet_coupling import COUPLING_METHODS, get_coupling
+from utils.change_versions import VersionedListing, parse_since_version
+from utils.topology_stream import (
+    TopologyStream, TOPOLOGY_STREAM_HEARTBEAT_SECONDS, TOPOLOGY_STREAM_RETRY_MS
+)
+from models.robust_zscore import RobustDeviceZScore, population_sketches
+from database import (
+    read_connection, get_change_version, DEVICE_METRICS, HISTORY_METRICS, ANALYSIS_COLUMNS,
+    RAW_RETENTION_DAYS, RAW_SAMPLE_SECONDS
+)
+import json
 import logging
-import sqlite3
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 bp = Blueprint('network_visualization', __name__)
 
+# Upper bound on samples returned by the device history endpoint
+MAX_HISTORY_LIMIT = 100000
+
+# Upper bound on ?limit= for the paginated rankings and anomalies
+MAX_PAGE_LIMIT = 1000
+
+# Upper bound on ?h= for the device forecast endpoint, in samples
+MAX_FORECAST_HORIZON = 1440
+
+# Bounds of the coupling analysis: grid slots, pairs returned and window hours
+MAX_COUPLING_POINTS = 10000
+MAX_COUPLING_PAIRS = 1000
+# Bounded at 7 days when raw samples are kept forever
+MAX_COUPLING_HOURS = (RAW_RETENTION_DAYS or 7) * 24
+
+# Population Z-score methods selectable with ?method=
+ZSCORE_METHODS = {
+    'mean': DeviceZScore,
+    'robust': RobustDeviceZScore
+}
+
+def get_zscore_analyzer():
+    """Build the analyzer for the request's ?method= (mean or robust); None if unknown."""
+    analyzer_class = ZSCORE_METHODS.get(request.args.get('method', 'mean'))
+    return analyzer_class() if analyzer_class else None
+
+def invalid_method_response():
+    return jsonify({'error': f"method must be one of {', '.join(ZSCORE_METHODS)}"}), 400
+
 def get_zscore_status(zscore):
     """Determine status based on Z-score magnitude."""
     if zscore is None:
@@ -25,106 +64,214 @@ def get_zscore_status(zscore):
     else:
         return 'extreme'
 
+# Devices with their current metrics and latest analysis. Devices without
+# analysis get NULLs but are still returned.
+TOPOLOGY_QUERY = '''
+    SELECT d.id, d.name, d.ip_address,
+           d.cpu_usage, d.memory_usage, d.disk_usage, d.vulnerability_score,
+           a.zscore_cpu, a.zscore_memory, a.zscore_disk, a.zscore_vulnerability,
+           a.device_state
+    FROM devices d
+    LEFT JOIN device_latest a ON d.id = a.device_id
+'''
+
+# Versioned tables the topology of each mode is built from; both modes
+# serve the device state kept in device_latest
+TOPOLOGY_VERSION_TABLES = {
+    'temporal': ['devices', 'device_latest'],
+    'population': ['devices', 'device_latest']
+}
+
+def topology_device_entry(device, mode='temporal', analysis=None, device_metrics=DEVICE_METRICS):
+    """
+    Build the topology entry of one TOPOLOGY_QUERY row.
+
+    :param mode: 'temporal' uses the Z-scores stored on ingest; 'population'
+        uses `analysis` from the fleet analyzer.
+    :param analysis: Population analysis of the device, or None.
+    """
+    if mode == 'population':
+        stored_zscores = {
+            metric: analysis[metric]['zscore'] if analysis and metric in analysis else None
+            for metric in device_metrics
+        }
+    else:
+        stored_zscores = {
+            'cpu_usage': device['zscore_cpu'],
+            'memory_usage': device['zscore_memory'],
+            'disk_usage': device['zscore_disk'],
+            'vulnerability_score': device['zscore_vulnerability']
+        }
+
+    zscores_data = {
+        metric: {
+            'zscore': zscore,
+            'status': get_zscore_status(zscore)
+        }
+        for metric, zscore in stored_zscores.items()
+    }
+
+    # Add zscore_mean if available
+    if analysis and 'zscore_mean' in analysis:
+        zscores_data['zscore_mean'] = {
+            'zscore': analysis['zscore_mean']['zscore'],
+            'status': analysis['zscore_mean']['status'],
+            'component_scores': analysis['zscore_mean'].get('component_scores', []),
+            'metric_count': analysis['zscore_mean'].get('metric_count', 0)
+        }
+    elif mode == 'temporal':
+        component_scores = [z for z in stored_zscores.values() if z is not None]
+        if component_scores:
+            mean_z = sum(component_scores) / len(component_scores)
+            zscores_data['zscore_mean'] = {
+                'zscore': mean_z,
+                'status': get_zscore_status(mean_z),
+                'component_scores': component_scores,
+                'metric_count': len(component_scores)
+            }
+
+    # Determine if Z-scores are present
+    zs_present = (
+        any(z is not None for z in stored_zscores.values())
+        or ('zscore_mean' in zscores_data)
+    )
+
+    device_data = {
+        'id': device['id'],
+        'name': device['name'],
+        'ip_address': device['ip_address'],
+        'metrics': {
+            'cpu_usage': device['cpu_usage'] if device['cpu_usage'] is not None else 0,
+            'memory_usage': device['memory_usage'] if device['memory_usage'] is not None else 0,
+            'disk_usage': device['disk_usage'] if device['disk_usage'] is not None else 0,
+            'vulnerability_score': device['vulnerability_score'] if device['vulnerability_score'] is not None else 0
+        },
+        'zscores': zscores_data if zs_present else None,
+        'state': device['device_state']
+    }
+
+    if analysis:
+        device_data['analysis'] = analysis
+    return device_data
+
+def load_temporal_topology():
+    """Temporal topology entries of every device, keyed by device id."""
+    with read_connection() as conn:
+        devices = conn.execute(TOPOLOGY_QUERY).fetchall()
+    return {device['id']: topology_device_entry(device) for device in devices}
+
+def load_temporal_topology_version():
+    """Change version of everything the temporal topology is built from."""
+    with read_connection() as conn:
+        return get_change_version(conn, TOPOLOGY_VERSION_TABLES['temporal'])[0]
+
+# Shared producer behind /network/topology/stream
+topology_stream = TopologyStream(load_temporal_topology, load_temporal_topology_version)
+
 @bp.route('/network/topology/details', methods=['GET'])
 def get_network_topology():
-    """Get network topology with device metrics and Z-scores."""
+    """
+    Get network topology with device metrics and Z-scores.
+
+    mode=population (default) scores every device against the fleet and adds
+    the full analysis, using mean/std or, with method=robust, median/MAD.
+    mode=temporal serves the Z-scores precomputed on ingest against each
+    device's own rolling baseline, runs no analysis and has no 'analysis'
+    key; it is what /network/topology/stream sends.
+
+    Responses carry the change version of the devices and their latest
+    analysis, which holds their state, as ETag; a matching If-None-Match is
+    answered 304. In temporal mode ?since_version= returns only the devices
+    changed since that version plus the ids of removed devices.
+    """
     try:
-        with closing(get_db_connection()) as conn:
-            conn.row_factory = sqlite3.Row
-
-            # This query selects devices and their metrics from the 'devices' table.
-            # If there's analysis data in device_analysis_results, it will join it.
-            # Otherwise, a.* will be NULL, but the device will still be returned.
-            devices = conn.execute('''
-                SELECT d.id, d.name, d.ip_address,
-                       d.cpu_usage, d.memory_usage, d.disk_usage, d.vulnerability_score,
-                       a.zscore_cpu, a.zscore_memory, a.zscore_disk, a.zscore_vulnerability,
-                       a.device_state
-                FROM devices d
-                LEFT JOIN device_analysis_results a ON d.id = a.device_id
-                AND a.id IN (
-                    SELECT MAX(id)
-                    FROM device_analysis_results
-                    GROUP BY device_id
-                )
-            ''').fetchall()
+        mode = request.args.get('mode', 'population')
+        if mode not in ('temporal', 'population'):
+            return jsonify({'error': 'mode must be temporal or population'}), 400
+        try:
+            since_version = parse_since_version()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if since_version is not None and mode != 'temporal':
+            # Population Z-scores of every device move with any change
+            return jsonify({'error': 'since_version requires mode=temporal'}), 400
+        zscore_analyzer = get_zscore_analyzer()
+        if zscore_analyzer is None:
+            return invalid_method_response()
+        method = request.args.get('method', 'mean') if mode == 'population' else None
 
-            zscore_analyzer = DeviceZScore()
-            topology = {
-                'devices': []
-            }
+        listing = VersionedListing('-'.join(filter(None, ['topology', mode, method])),
+                                   TOPOLOGY_VERSION_TABLES[mode], since_version=since_version)
+        not_modified = listing.not_modified()
+        if not_modified is not None:
+            return not_modified
 
-            for device in devices:
-                zscores_data = {
-                    'cpu_usage': {
-                        'zscore': device['zscore_cpu'],
-                        'status': get_zscore_status(device['zscore_cpu'])
-                    },
-                    'memory_usage': {
-                        'zscore': device['zscore_memory'],
-                        'status': get_zscore_status(device['zscore_memory'])
-                    },
-                    'disk_usage': {
-                        'zscore': device['zscore_disk'],
-                        'status': get_zscore_status(device['zscore_disk'])
-                    },
-                    'vulnerability_score': {
-                        'zscore': device['zscore_vulnerability'],
-                        'status': get_zscore_status(device['zscore_vulnerability'])
-                    }
-                }
-
-                # Analyze device if possible
-                analysis = zscore_analyzer.analyze_device(device['id'])
-                logger.debug(f"DEBUG: Analysis for device {device['id']}:", analysis)
-
-                # Add zscore_mean if available
-                if analysis and 'zscore_mean' in analysis:
-                    zscores_data['zscore_mean'] = {
-                        'zscore': analysis['zscore_mean']['zscore'],
-                        'status': analysis['zscore_mean']['status'],
-                        'component_scores': analysis['zscore_mean'].get('component_scores', []),
-                        'metric_count': analysis['zscore_mean'].get('metric_count', 0)
-                    }
-
-                # Determine if Z-scores are present
-                zs_present = (
-                    (device['zscore_cpu'] is not None or 
-                     device['zscore_memory'] is not None or 
-                     device['zscore_disk'] is not None or 
-                     device['zscore_vulnerability'] is not None) 
-                    or ('zscore_mean' in zscores_data)
-                )
+        removed = []
+        with read_connection() as conn:
+            if listing.is_delta:
+                changed, removed = listing.changed_rows(conn, 'devices')
+                changed_latest, _ = listing.changed_rows(conn, 'device_latest')
+                devices = conn.execute(f'{TOPOLOGY_QUERY} WHERE d.id IN (SELECT value FROM json_each(?))',
+                                       (json.dumps(sorted(set(changed) | set(changed_latest))),)).fetchall()
+            else:
+                devices = conn.execute(TOPOLOGY_QUERY).fetchall()
 
-                device_data = {
-                    'id': device['id'],
-                    'name': device['name'],
-                    'ip_address': device['ip_address'],
-                    'metrics': {
-                        'cpu_usage': device['cpu_usage'] if device['cpu_usage'] is not None else 0,
-                        'memory_usage': device['memory_usage'] if device['memory_usage'] is not None else 0,
-                        'disk_usage': device['disk_usage'] if device['disk_usage'] is not None else 0,
-                        'vulnerability_score': device['vulnerability_score'] if device['vulnerability_score'] is not None else 0
-                    },
-                    'zscores': zscores_data if zs_present else None,
-                    'state': device['device_state']
-                }
-
-                if analysis:
-                    device_data['analysis'] = analysis
-
-                topology['devices'].append(device_data)
-
-            return jsonify(topology)
+        fleet_analysis = {}
+        if mode == 'population':
+            # Population Z-scores for the whole fleet in one pass
+            fleet_analysis = {
+                device_id: analysis
+                for device_id, _, analysis in zscore_analyzer.analyze_fleet()
+            }
+        topology = {
+            'mode': mode,
+            'version': listing.version,
+            'devices': [
+                topology_device_entry(device, mode, fleet_analysis.get(device['id']),
+                                      zscore_analyzer.device_metrics)
+                for device in devices
+            ]
+        }
+        if since_version is not None:
+            topology.update(since_version=since_version, full=not listing.is_delta, removed=removed)
+        return listing.apply(jsonify(topology))
     except Exception as e:
         logger.exception("Exception in get_network_topology route:")
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/network/topology/stream', methods=['GET'])
+def stream_network_topology():
+    """
+    Server-Sent Events stream of the temporal topology.
+
+    Sends a 'snapshot' event with every device on connect, then 'delta'
+    events with only the devices whose metrics, Z-scores or state changed
+    and the ids of removed devices. All viewers share one producer.
+    """
+    subscription = topology_stream.subscribe()
+
+    def events():
+        try:
+            yield f'retry: {TOPOLOGY_STREAM_RETRY_MS}\n\n'
+            while True:
+                message = subscription.next(TOPOLOGY_STREAM_HEARTBEAT_SECONDS)
+                # Comment lines keep proxies from closing an idle stream
+                yield message if message is not None else ': keep-alive\n\n'
+        finally:
+            topology_stream.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @bp.route('/device/<int:device_id>/zscores', methods=['GET'])
 def get_device_zscores(device_id):
     """Get Z-score analysis for a specific device."""
     try:
-        zscore_analyzer = DeviceZScore()
+        zscore_analyzer = get_zscore_analyzer()
+        if zscore_analyzer is None:
+            return invalid_method_response()
         analysis = zscore_analyzer.analyze_device(device_id)
         if analysis:
             return jsonify(analysis)
@@ -132,13 +279,223 @@ def get_device_zscores(device_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/device/<int:device_id>/baseline', methods=['GET'])
+def get_device_baseline(device_id):
+    """Get the rolling per-device baseline behind the temporal Z-scores."""
+    try:
+        baseline = device_baseline.get_baseline(device_id)
+        if not baseline:
+            return jsonify({'error': 'No baseline for device'}), 404
+        return jsonify({
+            'device_id': device_id,
+            'window_samples': device_baseline.window,
+            'min_samples': device_baseline.min_samples,
+            'metrics': baseline
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/device/<int:device_id>/analysis', methods=['GET'])
+def get_device_analysis(device_id):
+    """
+    Get the stored analysis of a device as written by the analysis pipeline.
+
+    Returns the latest result and, with ?limit=, that many earlier rows of
+    device_analysis_results, newest first.
+    """
+    try:
+        limit = min(request.args.get('limit', 0, type=int), MAX_HISTORY_LIMIT)
+        columns = ', '.join(ANALYSIS_COLUMNS)
+        with read_connection() as conn:
+            latest = conn.execute(f'''
+                SELECT {columns}, analysis_timestamp FROM device_latest
+                WHERE device_id = ? AND analysis_timestamp IS NOT NULL
+            ''', (device_id,)).fetchone()
+            if latest is None:
+                return jsonify({'error': 'No analysis for device'}), 404
+            history = []
+            if limit > 0:
+                history = conn.execute(f'''
+                    SELECT {columns}, timestamp FROM device_analysis_results
+                    WHERE device_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ''', (device_id, limit)).fetchall()
+        return jsonify({
+            'device_id': device_id,
+            'latest': dict(latest),
+            'history': [dict(row) for row in history]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/device/<int:device_id>/forecast', methods=['GET'])
+def get_device_forecast(device_id):
+    """
+    Forecast the next ?h= samples of a device from its stored Holt-Winters state.
+
+    Defaults to one seasonal cycle; ?metric= restricts the forecast to one
+    history metric.
+    """
+    try:
+        horizon = request.args.get('h', device_forecaster.season_length, type=int)
+        if horizon < 1 or horizon > MAX_FORECAST_HORIZON:
+            return jsonify({'error': f'h must be between 1 and {MAX_FORECAST_HORIZON}'}), 400
+        metric = request.args.get('metric')
+        if metric is not None and metric not in HISTORY_METRICS:
+            return jsonify({'error': f'Unknown metric: {metric}'}), 400
+
+        forecasts = device_forecaster.get_forecast(device_id, horizon, [metric] if metric else None)
+        if not forecasts:
+            return jsonify({'error': 'No forecast state for device'}), 404
+        return jsonify({
+            'device_id': device_id,
+            'horizon': horizon,
+            'parameters': {
+                'alpha': device_forecaster.alpha,
+                'beta': device_forecaster.beta,
+                'gamma': device_forecaster.gamma,
+                'season_length': device_forecaster.season_length
+            },
+            'metrics': forecasts
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/device/<int:device_id>/capacity_forecast', methods=['GET'])
+def get_device_capacity_forecast(device_id):
+    """Get the hourly capacity forecasts written by the nightly fleet forecast job."""
+    try:
+        metric = request.args.get('metric')
+        if metric is not None and metric not in HISTORY_METRICS:
+            return jsonify({'error': f'Unknown metric: {metric}'}), 400
+        with read_connection() as conn:
+            rows = conn.execute('''
+                SELECT * FROM device_forecasts
+                WHERE device_id = ? AND (? IS NULL OR metric = ?)
+            ''', (device_id, metric, metric)).fetchall()
+        if not rows:
+            return jsonify({'error': 'No capacity forecast for device'}), 404
+        return jsonify({
+            'device_id': device_id,
+            'metrics': {
+                row['metric']: dict(
+                    {k: row[k] for k in row.keys() if k not in ('device_id', 'metric', 'forecast')},
+                    forecast=json.loads(row['forecast'])
+                )
+                for row in rows
+            }
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/network/coupling', methods=['GET'])
+def get_network_coupling():
+    """
+    Get the most strongly coupled device pairs on one metric.
+
+    Query parameters: metric (default cpu_usage), method (pearson or mi),
+    hours and step (seconds) of the aligned time grid, threshold on |r| or
+    MI, top_k, and project_id.
+    """
+    try:
+        metric = request.args.get('metric', 'cpu_usage')
+        method = request.args.get('method', 'pearson')
+        hours = request.args.get('hours', 6, type=int)
+        step = request.args.get('step', 60, type=int)
+        top_k = request.args.get('top_k', 50, type=int)
+        if metric not in HISTORY_METRICS:
+            return jsonify({'error': f'Unknown metric: {metric}'}), 400
+        if method not in COUPLING_METHODS:
+            return jsonify({'error': f"method must be one of {', '.join(COUPLING_METHODS)}"}), 400
+        if not 1 <= hours <= MAX_COUPLING_HOURS or step < RAW_SAMPLE_SECONDS:
+            return jsonify({'error': f'hours must be between 1 and {MAX_COUPLING_HOURS} '
+                                     f'and step at least {RAW_SAMPLE_SECONDS}'}), 400
+        if hours * 3600 // step > MAX_COUPLING_POINTS:
+            return jsonify({'error': f'hours / step exceeds {MAX_COUPLING_POINTS} points'}), 400
+        if not 1 <= top_k <= MAX_COUPLING_PAIRS:
+            return jsonify({'error': f'top_k must be between 1 and {MAX_COUPLING_PAIRS}'}), 400
+
+        return jsonify(get_coupling(
+            metric=metric,
+            method=method,
+            hours=hours,
+            step_seconds=step,
+            threshold=request.args.get('threshold', type=float),
+            top_k=top_k,
+            project_id=request.args.get('project_id', type=int)
+        ))
+    except Exception as e:
+        logger.exception("Exception in get_network_coupling route:")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/devices/state_changes', methods=['GET'])
+def get_device_state_changes():
+    """
+    Get the devices whose state changed since ?since= (epoch seconds).
+
+    Served from the indexed transition log; ?limit= caps the number of devices.
+    """
+    try:
+        since = request.args.get('since', type=float)
+        if since is None:
+            return jsonify({'error': 'since (epoch seconds) is required'}), 400
+        limit = request.args.get('limit', MAX_PAGE_LIMIT, type=int)
+        if not 1 <= limit <= MAX_PAGE_LIMIT:
+            return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_LIMIT}'}), 400
+        devices = device_state_machine.changed_since(since, limit)
+        return jsonify({'since': since, 'count': len(devices), 'devices': devices})
+    except Exception as e:
+        logger.exception("Exception in get_device_state_changes route:")
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/devices/state/evaluate', methods=['POST'])
+def evaluate_device_states():
+    """
+    Run one fleet-wide state transition pass.
+
+    Body: optional "admin_actions" and "risks" objects keyed by device id,
+    and "device_ids" to restrict the pass.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        admin_actions = {int(k): str(v) for k, v in (data.get('admin_actions') or {}).items()}
+        risks = {int(k): float(v) for k, v in (data.get('risks') or {}).items()}
+        device_ids = data.get('device_ids')
+        if device_ids is not None:
+            device_ids = [int(device_id) for device_id in device_ids]
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid state evaluation request: {e}'}), 400
+    try:
+        return jsonify(device_state_machine.evaluate(admin_actions, risks, device_ids))
+    except Exception as e:
+        logger.exception("Exception in evaluate_device_states route:")
+        return jsonify({'error': str(e)}), 500
+
 @bp.route('/api/network/anomalies', methods=['GET'])
 def get_network_anomalies():
-    """Get devices with anomalous metrics."""
+    """
+    Get devices with anomalous metrics.
+
+    With ?limit= the result is paged: {'anomalies': [...], 'next_cursor': token},
+    and the token is passed back as ?cursor= for the next page.
+    """
     try:
-        zscore_analyzer = DeviceZScore()
+        zscore_analyzer = get_zscore_analyzer()
+        if zscore_analyzer is None:
+            return invalid_method_response()
         threshold = float(request.args.get('threshold', 2.0))
         metric_type = request.args.get('metric', None)  # Optional metric filter
+
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_LIMIT)
+            anomalies, next_cursor = zscore_analyzer.get_anomalous_devices_page(
+                threshold, limit, cursor=request.args.get('cursor'),
+                metrics=[metric_type] if metric_type else None
+            )
+            return jsonify({'anomalies': anomalies, 'next_cursor': next_cursor})
+
         anomalies = zscore_analyzer.get_anomalous_devices(threshold)
         
         # Filter by metric if specified
@@ -149,21 +506,43 @@ def get_network_anomalies():
             ]
             
         return jsonify(anomalies)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @bp.route('/api/metrics/rankings', methods=['GET'])
 def get_metric_rankings():
-    """Get devices ranked by their Z-scores for each metric."""
+    """
+    Get devices ranked by their Z-scores for each metric.
+
+    With ?limit= only the worst `limit` devices per metric are read:
+    {'rankings': {metric: [...]}, 'next_cursor': token}, and the token is
+    passed back as ?cursor= for the next page.
+    """
     try:
-        zscore_analyzer = DeviceZScore()
+        zscore_analyzer = get_zscore_analyzer()
+        if zscore_analyzer is None:
+            return invalid_method_response()
         metric_type = request.args.get('metric', None)  # Optional metric filter
+
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_LIMIT)
+            rankings, next_cursor = zscore_analyzer.get_metric_rankings_page(
+                limit, cursor=request.args.get('cursor'),
+                metrics=[metric_type] if metric_type else None
+            )
+            return jsonify({'rankings': rankings, 'next_cursor': next_cursor})
+
         rankings = zscore_analyzer.get_metric_rankings()
         
         # Filter by metric if specified
         if metric_type and metric_type in rankings:
             return jsonify({metric_type: rankings[metric_type]})
         return jsonify(rankings)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -171,37 +550,45 @@ def get_metric_rankings():
 def get_device_history(device_id):
     """Get historical Z-scores for a device."""
     try:
-        zscore_analyzer = DeviceZScore()
-        limit = int(request.args.get('limit', 100))
+        zscore_analyzer = get_zscore_analyzer()
+        if zscore_analyzer is None:
+            return invalid_method_response()
+        limit = min(int(request.args.get('limit', 100)), MAX_HISTORY_LIMIT)
         metric_type = request.args.get('metric', None)  # Optional metric filter
-        history = zscore_analyzer.get_device_history(device_id, limit)
-        
-        # Filter by metric if specified
-        if metric_type:
-            for record in history:
-                if 'metrics' in record and metric_type in record['metrics']:
-                    record['metrics'] = {metric_type: record['metrics'][metric_type]}
+        history = zscore_analyzer.get_device_history(
+            device_id, limit,
+            metrics=[metric_type] if metric_type in zscore_analyzer.device_metrics else None
+        )
                 
         return jsonify(history)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/api/zscore/robust-stats', methods=['GET'])
+def get_robust_stats():
+    """Get the sketch median and MAD of every metric, fleet-wide or for ?project_id=."""
+    try:
+        project_id = request.args.get('project_id', type=int)
+        stats = {}
+        for metric in DEVICE_METRICS:
+            median, mad, count = population_sketches.get_stats(metric, project_id)
+            stats[metric] = {'median': median, 'mad': mad, 'count': count}
+        return jsonify({'project_id': project_id, 'metrics': stats})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @bp.route('/api/zscore/status-summary', methods=['GET'])
 def get_zscore_status_summary():
     """Get a summary of Z-score statuses across all devices."""
     try:
-        with closing(get_db_connection()) as conn:
+        with read_connection() as conn:
             cursor = conn.cursor()
             # Get latest analysis results for all devices
             cursor.execute('''
                 SELECT device_id,
                        zscore_cpu, zscore_memory, zscore_disk, zscore_vulnerability
-                FROM device_analysis_results
-                WHERE id IN (
-                    SELECT MAX(id)
-                    FROM device_analysis_results
-                    GROUP BY device_id
-                )
+                FROM device_latest
+                WHERE analysis_timestamp IS NOT NULL
             ''')
             results = cursor.fetchall()
             
@@ -1,5 +1,10 @@
+import json
+import os
+import queue
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from contextlib import contextmanager
 import logging
 
 # Configure logging
@@ -8,151 +13,670 @@ logger = logging.getLogger(__name__)
 
 # Define module exports
 __all__ = [
-    'get_db_connection', 'init_db', 'get_or_create_numeric_id', 'add_device',
-    'update_device', 'delete_device', 'get_device', 'insert_device_metrics',
+    'get_db_connection', 'read_connection', 'write_connection',
+    'get_connection_pool', 'reset_connection_pool', 'init_db',
+    'get_or_create_numeric_id', 'add_device',
+    'update_device', 'delete_device', 'get_device',
     'validate_device_data', 'get_all_connections', 'get_latest_device_metrics',
-    'get_all_devices', 'get_latest_metrics', 'verify_database_integrity'
+    'get_all_devices', 'get_latest_metrics', 'verify_database_integrity',
+    'update_metric_rollups', 'rebuild_metric_rollups', 'rebuild_population_stats',
+    'get_population_stats', 'rebuild_population_histograms', 'get_population_histograms',
+    'prune_metrics_history',
+    'select_history_resolution', 'get_metrics_history', 'format_timestamp',
+    'upsert_latest_metrics', 'insert_analysis_results', 'rebuild_device_latest',
+    'check_device_latest', 'add_cip_control', 'update_cip_control', 'get_cip_control',
+    'get_change_version', 'get_changed_rows'
 ]
 
-DATABASE_NAME = 'app.db'
+DATABASE_NAME = os.environ.get(
+    'DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.db')
+)
 
-def get_db_connection():
-    """Create a database connection with Row factory."""
-    conn = sqlite3.connect(DATABASE_NAME)
+# Metric columns of device_metrics_history, in row order
+HISTORY_METRICS = [
+    'cpu_usage', 'memory_usage', 'disk_usage',
+    'vulnerability_score', 'network_usage', 'temperature'
+]
+
+# Current-value metric columns of the devices table
+DEVICE_METRICS = ['cpu_usage', 'memory_usage', 'disk_usage', 'vulnerability_score']
+
+# population_stats scope that covers every device regardless of project
+FLEET_SCOPE = 0
+
+# Tables whose changes are versioned in change_versions and row_versions:
+# table -> (row id column, project column or None to version fleet-wide
+# only, columns whose updates count as a change)
+VERSIONED_TABLES = {
+    'devices': ('id', 'project_id', [
+        'project_id', 'name', 'type', 'x', 'y', *DEVICE_METRICS, 'ip_address', 'subnet_mask'
+    ]),
+    'connections': ('id', 'project_id', [
+        'project_id', 'source_device_id', 'target_device_id', 'connection_type',
+        'bandwidth', 'latency', 'packet_loss'
+    ]),
+    # Only the analysis columns served by the topology; metric upserts do not count
+    'device_latest': ('device_id', None, [
+        'zscore_cpu', 'zscore_memory', 'zscore_disk', 'zscore_vulnerability', 'device_state'
+    ]),
+}
+
+# change_versions row holding the sequence every change version is drawn from
+CHANGE_SEQUENCE = '*'
+
+# Fixed-bin histograms behind the robust (median/MAD) statistics: every
+# device metric is a 0-100 score, split into SKETCH_BINS equal bins with
+# out-of-range values clamped into the edge bins
+SKETCH_RANGE = (0.0, 100.0)
+SKETCH_BINS = 1000
+
+# Rollup resolutions: (name, bucket seconds, table, retention days or None to keep forever)
+ROLLUP_RESOLUTIONS = [
+    ('1m', 60, 'device_metrics_rollup_1m', int(os.environ.get('METRICS_ROLLUP_1M_RETENTION_DAYS', 30))),
+    ('1h', 3600, 'device_metrics_rollup_1h', None),
+    ('1d', 86400, 'device_metrics_rollup_1d', None),
+]
+
+# Analysis result columns shared by device_analysis_results and device_latest
+ANALYSIS_COLUMNS = [
+    'ema_cpu', 'ema_memory', 'ema_disk', 'sigmoid_risk',
+    'zscore_cpu', 'zscore_memory', 'zscore_disk', 'zscore_vulnerability',
+    'device_state', 'time_decay_factor'
+]
+
+# Raw device_metrics_history and device_analysis_results retention, and the
+# expected raw sample interval. Raw rows are kept forever unless
+# METRICS_RAW_RETENTION_DAYS is set: pruning deletes the samples for good,
+# and only the rollups keep their aggregates.
+RAW_RETENTION_DAYS = (int(os.environ['METRICS_RAW_RETENTION_DAYS'])
+                      if os.environ.get('METRICS_RAW_RETENTION_DAYS') else None)
+RAW_SAMPLE_SECONDS = 10
+PRUNE_INTERVAL_SECONDS = 300
+# Retention of the compact device_state_transitions log
+TRANSITION_RETENTION_DAYS = int(os.environ.get('STATE_TRANSITION_RETENTION_DAYS', 90))
+PRUNE_BATCH_ROWS = 10000
+
+# Connection tuning applied to every pooled connection
+MAX_READ_CONNECTIONS = int(os.environ.get('DB_MAX_READ_CONNECTIONS', 8))
+STATEMENT_CACHE_SIZE = 256
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',   # 256 MB
+    'PRAGMA cache_size=-16384',     # 16 MB per connection
+    'PRAGMA temp_store=MEMORY',
+]
+
+
+def _connect(database_path, readonly=False):
+    """Open a connection with Row factory, statement cache and tuning pragmas."""
+    conn = sqlite3.connect(
+        database_path,
+        timeout=30,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute('PRAGMA query_only=ON')
     return conn
 
+
+class ConnectionPool:
+    """
+    Pool of read-only connections plus a single serialized write connection.
+
+    The database runs in WAL mode so readers never block behind the writer.
+    Writes from every thread in the process share one connection guarded by
+    a lock, which removes "database is locked" contention between threads.
+    """
+
+    def __init__(self, database_path, max_readers=MAX_READ_CONNECTIONS):
+        self.database_path = database_path
+        self.max_readers = max_readers
+        self.pid = os.getpid()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._writer = _connect(database_path)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                return _connect(self.database_path, readonly=True)
+        return self._readers.get()
+
+    def prefill(self):
+        """Open every read connection up front instead of on first use."""
+        with self._reader_lock:
+            while self._reader_count < self.max_readers:
+                self._reader_count += 1
+                self._readers.put(_connect(self.database_path, readonly=True))
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection for the duration of the block."""
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """
+        Hold the write connection for the duration of the block.
+
+        The outermost block commits on success and rolls back on error, so
+        nested helpers can share one transaction. It opens the transaction
+        with BEGIN IMMEDIATE: the lock only serializes threads of this
+        process, and taking SQLite's write lock before the first read keeps
+        read-modify-write blocks of other processes (gunicorn workers) from
+        working on the same stale state.
+        """
+        with self._write_lock:
+            self._write_depth += 1
+            try:
+                if self._write_depth == 1 and not self._writer.in_transaction:
+                    self._writer.execute('BEGIN IMMEDIATE')
+                yield self._writer
+                if self._write_depth == 1:
+                    self._writer.commit()
+            except Exception:
+                if self._write_depth == 1:
+                    self._writer.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        """Close every connection owned by the pool."""
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    """Return the process-wide connection pool, recreating it after a fork."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = ConnectionPool(DATABASE_NAME)
+        return _pool
+
+
+def reset_connection_pool():
+    """Close the current pool so the next call reopens against DATABASE_NAME."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+def read_connection():
+    """Context manager yielding a pooled read-only connection."""
+    return get_connection_pool().reader()
+
+
+def write_connection():
+    """Context manager yielding the shared write connection inside a transaction."""
+    return get_connection_pool().writer()
+
+
+def get_db_connection():
+    """Create a standalone connection with Row factory, for scripts and one-off use."""
+    return _connect(DATABASE_NAME)
+
 def init_db():
     """Initialize the database schema."""
-    with closing(get_db_connection()) as conn:
-        with conn:
-            # Enable foreign keys
-            conn.execute('PRAGMA foreign_keys=ON;')
-            
-            # Projects table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS projects (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+    with write_connection() as conn:
+        # Projects table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS projects (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
 
-            # Devices table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    project_id INTEGER,
-                    name TEXT NOT NULL,
-                    type TEXT NOT NULL,
-                    x INTEGER,
-                    y INTEGER,
-                    cpu_usage INTEGER,
-                    memory_usage INTEGER,
-                    disk_usage INTEGER,
-                    vulnerability_score REAL,
-                    ip_address TEXT,
-                    subnet_mask TEXT,
-                    mac_address TEXT,
-                    gateway TEXT,
-                    dns_settings TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
-                )
-            ''')
+        # Devices table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS devices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                x INTEGER,
+                y INTEGER,
+                cpu_usage INTEGER,
+                memory_usage INTEGER,
+                disk_usage INTEGER,
+                vulnerability_score REAL,
+                ip_address TEXT,
+                subnet_mask TEXT,
+                mac_address TEXT,
+                gateway TEXT,
+                dns_settings TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+            )
+        ''')
 
-            # Network devices table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS network_devices (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    ip_address TEXT NOT NULL,
-                    description TEXT
-                )
-            ''')
-            
-            # Connections table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS connections (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    project_id INTEGER,
-                    source_device_id INTEGER,
-                    target_device_id INTEGER,
-                    connection_type TEXT,
-                    bandwidth TEXT,
-                    latency REAL,
-                    packet_loss REAL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
-                    FOREIGN KEY (source_device_id) REFERENCES devices(id) ON DELETE CASCADE,
-                    FOREIGN KEY (target_device_id) REFERENCES devices(id) ON DELETE CASCADE
-                )
-            ''')
+        # Network devices table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS network_devices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                ip_address TEXT NOT NULL,
+                description TEXT
+            )
+        ''')
+        
+        # Connections table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS connections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                project_id INTEGER,
+                source_device_id INTEGER,
+                target_device_id INTEGER,
+                connection_type TEXT,
+                bandwidth TEXT,
+                latency REAL,
+                packet_loss REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE,
+                FOREIGN KEY (source_device_id) REFERENCES devices(id) ON DELETE CASCADE,
+                FOREIGN KEY (target_device_id) REFERENCES devices(id) ON DELETE CASCADE
+            )
+        ''')
 
-            # Device metrics table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS device_metrics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_id INTEGER NOT NULL,
-                    cpu_usage REAL,
-                    memory_usage REAL,
-                    disk_usage REAL,
-                    vulnerability_score REAL,
-                    network_usage REAL,
-                    temperature REAL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (device_id) REFERENCES network_devices (id)
-                )
-            ''')
+        # Device metrics table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id INTEGER NOT NULL,
+                cpu_usage REAL,
+                memory_usage REAL,
+                disk_usage REAL,
+                vulnerability_score REAL,
+                network_usage REAL,
+                temperature REAL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (device_id) REFERENCES network_devices (id)
+            )
+        ''')
 
-            # Device analysis results table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS device_analysis_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+        # Device metrics history table (raw samples from the ingest path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_metrics_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id INTEGER NOT NULL,
+                cpu_usage REAL,
+                memory_usage REAL,
+                disk_usage REAL,
+                vulnerability_score REAL,
+                network_usage REAL,
+                temperature REAL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (device_id) REFERENCES network_devices (id)
+            )
+        ''')
+
+        # Metric rollup tables, one per resolution
+        for _, _, table, _ in ROLLUP_RESOLUTIONS:
+            metric_columns = ',\n'.join(
+                f'{metric}_min REAL, {metric}_max REAL, {metric}_mean REAL'
+                for metric in HISTORY_METRICS
+            )
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
                     device_id INTEGER NOT NULL,
-                    ema_cpu REAL,
-                    ema_memory REAL,
-                    ema_disk REAL,
-                    sigmoid_risk REAL,
-                    zscore_cpu REAL,
-                    zscore_memory REAL,
-                    zscore_disk REAL,
-                    zscore_vulnerability REAL,
-                    device_state TEXT,
-                    time_decay_factor REAL,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (device_id) REFERENCES network_devices (id)
-                )
+                    bucket_start INTEGER NOT NULL,
+                    sample_count INTEGER NOT NULL,
+                    {metric_columns},
+                    PRIMARY KEY (device_id, bucket_start)
+                ) WITHOUT ROWID
             ''')
 
-            # Device ID mapping table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS device_id_mapping (
-                    numeric_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    string_id TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+        # Device analysis results table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_analysis_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                device_id INTEGER NOT NULL,
+                ema_cpu REAL,
+                ema_memory REAL,
+                ema_disk REAL,
+                sigmoid_risk REAL,
+                zscore_cpu REAL,
+                zscore_memory REAL,
+                zscore_disk REAL,
+                zscore_vulnerability REAL,
+                device_state TEXT,
+                time_decay_factor REAL,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (device_id) REFERENCES network_devices (id)
+            )
+        ''')
 
-            # CIP controls table
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS cip_controls (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    control_name TEXT NOT NULL,
-                    settings TEXT NOT NULL
-                )
+        # Latest metrics and analysis per device, maintained on every write
+        metric_columns = ',\n'.join(f'{m} REAL' for m in HISTORY_METRICS)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS device_latest (
+                device_id INTEGER PRIMARY KEY,
+                {metric_columns},
+                metrics_timestamp DATETIME,
+                ema_cpu REAL,
+                ema_memory REAL,
+                ema_disk REAL,
+                sigmoid_risk REAL,
+                zscore_cpu REAL,
+                zscore_memory REAL,
+                zscore_disk REAL,
+                zscore_vulnerability REAL,
+                device_state TEXT,
+                time_decay_factor REAL,
+                analysis_timestamp DATETIME
+            )
+        ''')
+
+        # Per-device exponentially weighted mean and variance of each device
+        # metric, folded in on ingest by models.device_baseline
+        baseline_columns = ',\n'.join(
+            f'{m}_count INTEGER NOT NULL DEFAULT 0, {m}_mean REAL, {m}_var REAL'
+            for m in DEVICE_METRICS
+        )
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS device_baselines (
+                device_id INTEGER PRIMARY KEY,
+                {baseline_columns},
+                updated_at DATETIME
+            )
+        ''')
+
+        # Incremental Holt-Winters state of every history metric, packed as
+        # float64 blobs, updated on ingest by models.device_forecast
+        forecast_columns = ',\n'.join(f'{m}_state BLOB' for m in HISTORY_METRICS)
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS device_forecast_state (
+                device_id INTEGER PRIMARY KEY,
+                {forecast_columns},
+                updated_at DATETIME
+            )
+        ''')
+
+        # Streaming EMAs of each device, a JSON document of metric -> alpha ->
+        # [ema, samples], updated on ingest by models.ema_state
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_ema_state (
+                device_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at DATETIME
+            )
+        ''')
+
+        # Device state changes, one row per transition with states stored as
+        # codes of models.device_state_machine.DEVICE_STATES and epoch seconds
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_state_transitions (
+                id INTEGER PRIMARY KEY,
+                device_id INTEGER NOT NULL,
+                from_state INTEGER NOT NULL,
+                to_state INTEGER NOT NULL,
+                risk REAL,
+                changed_at INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_state_transitions_changed '
+                     'ON device_state_transitions(changed_at)')
+
+        # Latest fleet-wide capacity forecast of each device metric, written
+        # by the utils.fleet_forecast batch job
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_forecasts (
+                device_id INTEGER NOT NULL,
+                metric TEXT NOT NULL,
+                forecast_start INTEGER NOT NULL,
+                step_seconds INTEGER NOT NULL,
+                forecast TEXT NOT NULL,
+                alpha REAL NOT NULL,
+                beta REAL NOT NULL,
+                gamma REAL NOT NULL,
+                season_length INTEGER NOT NULL,
+                rmse REAL NOT NULL,
+                samples INTEGER NOT NULL,
+                fitted_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (device_id, metric)
+            ) WITHOUT ROWID
+        ''')
+
+        # Running Welford statistics (count, mean, M2) of each device metric,
+        # fleet-wide (FLEET_SCOPE) and per project, kept current by triggers
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS population_stats (
+                metric TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                mean REAL NOT NULL,
+                m2 REAL NOT NULL,
+                PRIMARY KEY (metric, project_id)
+            ) WITHOUT ROWID
+        ''')
+        population_stats_created = conn.execute(
+            'SELECT 1 FROM population_stats LIMIT 1'
+        ).fetchone() is None
+
+        # Per-bin counts of each device metric, fleet-wide and per project,
+        # kept current by the same triggers as population_stats
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS population_histograms (
+                metric TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                bin INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (metric, project_id, bin)
+            ) WITHOUT ROWID
+        ''')
+        population_histograms_created = conn.execute(
+            'SELECT 1 FROM population_histograms LIMIT 1'
+        ).fetchone() is None
+        for event, statements in _population_stats_trigger_bodies().items():
+            conn.execute(f'DROP TRIGGER IF EXISTS trg_population_stats_{event.lower()}')
+            conn.execute(f'''
+                CREATE TRIGGER trg_population_stats_{event.lower()}
+                AFTER {event} ON devices
+                BEGIN
+                    {statements}
+                END
             ''')
+        if population_stats_created:
+            rebuild_population_stats(conn)
+        if population_histograms_created:
+            rebuild_population_histograms(conn)
+
+        # Change versions per table and project scope, drawn from one
+        # monotonic sequence, and the version at which each row last changed
+        # in each scope (deleted rows and rows moved out of a project are
+        # kept as tombstones), so listing endpoints can answer conditional
+        # and delta requests without reading the tables themselves
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS change_versions (
+                table_name TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (table_name, project_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS row_versions (
+                table_name TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                row_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (table_name, project_id, row_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_row_versions_version
+            ON row_versions (table_name, project_id, version)
+        ''')
+        conn.execute(f'''
+            INSERT OR IGNORE INTO change_versions (table_name, project_id, version, updated_at)
+            VALUES ('{CHANGE_SEQUENCE}', {FLEET_SCOPE}, 0, {_EPOCH_NOW_SQL})
+        ''')
+        for table in VERSIONED_TABLES:
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                trigger = f'trg_change_versions_{table}_{event.lower()}'
+                conn.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+                conn.execute(f'''
+                    CREATE TRIGGER {trigger}
+                    {_change_version_trigger_sql(table, event)}
+                ''')
+
+        # Device ID mapping table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_id_mapping (
+                numeric_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                string_id TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # CIP controls table; version is bumped on every update so compiled
+        # risk profiles of models.risk_profile can be cached per version
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cip_controls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                control_name TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1
+            )
+        ''')
+        control_columns = {row[1] for row in conn.execute('PRAGMA table_info(cip_controls)')}
+        if 'version' not in control_columns:
+            conn.execute('ALTER TABLE cip_controls ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
 
-            # Create indices for better performance
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_device_metrics_device_id ON device_metrics(device_id)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_device_id_mapping_string ON device_id_mapping(string_id)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_device_analysis_device_id ON device_analysis_results(device_id)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_connections_devices ON connections(source_device_id, target_device_id)')
+        # Every device's risk scored against each CIP control, rewritten by
+        # the utils.recalculation_jobs job whenever the control changes
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_risk_scores (
+                control_id INTEGER NOT NULL,
+                device_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                sigmoid_risk REAL NOT NULL,
+                weighted_score REAL NOT NULL,
+                computed_at INTEGER NOT NULL,
+                PRIMARY KEY (control_id, device_id)
+            ) WITHOUT ROWID
+        ''')
+        # Scores of a running job, keyed by the lease of the run; swapped into
+        # device_risk_scores in one transaction when the job completes,
+        # dropped if it does not. Staged rows are transient, so a table of
+        # the per-job layout is simply recreated
+        staging_columns = {row[1] for row in conn.execute('PRAGMA table_info(device_risk_scores_staging)')}
+        if 'job_id' in staging_columns:
+            conn.execute('DROP TABLE device_risk_scores_staging')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS device_risk_scores_staging (
+                run_id TEXT NOT NULL,
+                device_id INTEGER NOT NULL,
+                sigmoid_risk REAL NOT NULL,
+                weighted_score REAL NOT NULL,
+                PRIMARY KEY (run_id, device_id)
+            ) WITHOUT ROWID
+        ''')
+        # Recalculation jobs, shared by every worker process. A running job is
+        # held by the lease of the worker running it, renewed as it
+        # progresses; cancel_requested asks that worker to stop
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS recalculation_jobs (
+                id TEXT PRIMARY KEY,
+                control_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                version INTEGER,
+                edits INTEGER NOT NULL DEFAULT 1,
+                devices INTEGER NOT NULL DEFAULT 0,
+                processed INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                cancel_requested TEXT,
+                lease_id TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_recalculation_jobs_status
+            ON recalculation_jobs (status, created_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_recalculation_jobs_control
+            ON recalculation_jobs (control_id, created_at)
+        ''')
+
+        # Fitted models of models.model_registry, pickled, one row per
+        # feature set and version
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS model_registry (
+                feature_set TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                estimator TEXT NOT NULL,
+                model BLOB NOT NULL,
+                training_hash TEXT,
+                samples_seen INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME,
+                updated_at DATETIME,
+                PRIMARY KEY (feature_set, version)
+            ) WITHOUT ROWID
+        ''')
+
+        # Create indices for better performance
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_metrics_device_id ON device_metrics(device_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_id_mapping_string ON device_id_mapping(string_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_analysis_device_id ON device_analysis_results(device_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_connections_devices ON connections(source_device_id, target_device_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_metrics_history_device_ts ON device_metrics_history(device_id, timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_metrics_history_ts ON device_metrics_history(timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_device_analysis_ts ON device_analysis_results(timestamp)')
+        # Value indexes behind the paginated |z| rankings and anomaly ranges
+        for m in DEVICE_METRICS:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_devices_{m} ON devices({m})')
+
+        # Populate device_latest from history when it is first created
+        if conn.execute('SELECT 1 FROM device_latest LIMIT 1').fetchone() is None:
+            rebuild_device_latest(conn)
+
+        # Backfill rollups the first time they are created on an existing database.
+        # The coarsest table is never pruned, so it is only empty before the first run.
+        if conn.execute(f'SELECT 1 FROM {ROLLUP_RESOLUTIONS[-1][2]} LIMIT 1').fetchone() is None:
+            rebuild_metric_rollups(conn)
 
 def get_or_create_numeric_id(string_id):
     """Convert a string device ID to a numeric ID, creating a mapping if needed."""
-    with closing(get_db_connection()) as conn:
+    with write_connection() as conn:
         cursor = conn.cursor()
         
         # Check existing mapping
@@ -165,8 +689,8 @@ def get_or_create_numeric_id(string_id):
         if result:
             return result['numeric_id']
             
-        # Create new mapping and device
-        cursor.execute('BEGIN TRANSACTION')
+        # Create new mapping and device; an error propagates out of the
+        # block, which rolls the outermost transaction back
         try:
             cursor.execute('''
                 INSERT INTO device_id_mapping (string_id)
@@ -184,60 +708,11 @@ def get_or_create_numeric_id(string_id):
                   "192.168.1.1",
                   f"Auto-created device from {string_id}"))
             
-            conn.commit()
             return numeric_id
         except Exception as e:
-            conn.rollback()
             print(f"Error creating device mapping: {str(e)}")
             raise
 
-# Device metrics functions
-def insert_device_metrics(device_id, metrics_data):
-    """Insert new metrics for a device."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO device_metrics (
-                    device_id, cpu_usage, memory_usage, disk_usage,
-                    vulnerability_score, network_usage, temperature
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                device_id,
-                metrics_data.get('cpu', 0),
-                metrics_data.get('memory', 0),
-                metrics_data.get('disk', 0),
-                metrics_data.get('vulnerability', 0),
-                metrics_data.get('network', 0),
-                metrics_data.get('temperature', 0)
-            ))
-            # Insert into device_analysis_results if applicable
-            cursor.execute('''
-                INSERT INTO device_analysis_results (
-                    device_id, ema_cpu, ema_memory, ema_disk,
-                    sigmoid_risk, zscore_cpu, zscore_memory, zscore_disk,
-                    zscore_vulnerability, device_state, time_decay_factor
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                device_id,
-                0,  # Placeholder for EMA CPU
-                0,  # Placeholder for EMA Memory
-                0,  # Placeholder for EMA Disk
-                0,  # Placeholder for Sigmoid Risk
-                0,  # Placeholder for Z-score CPU
-                0,  # Placeholder for Z-score Memory
-                0,  # Placeholder for Z-score Disk
-                0,  # Placeholder for Z-score Vulnerability
-                'normal',  # Placeholder for Device State
-                1.0  # Placeholder for Time Decay Factor
-            ))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error inserting metrics: {str(e)}")
-            conn.rollback()
-            return False
-
 def validate_device_data(name, ip_address):
     """Validate device data before insertion."""
     if not name or not ip_address:
@@ -247,70 +722,98 @@ def validate_device_data(name, ip_address):
 
 def get_all_connections():
     """Retrieve all connections."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         return conn.execute('SELECT * FROM connections').fetchall()
 
 
 def update_device(device_id, name, ip_address, description):
     """Update an existing device in the network_devices table."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
+    try:
+        with write_connection() as conn:
+            conn.execute('''
                 UPDATE network_devices
                 SET name = ?, ip_address = ?, description = ?
                 WHERE id = ?
             ''', (name, ip_address, description, device_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error updating device: {str(e)}")
-            conn.rollback()
-            return False
+        return True
+    except Exception as e:
+        print(f"Error updating device: {str(e)}")
+        return False
 
 def delete_device(device_id):
     """Delete a device and associated metrics and analysis."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute('DELETE FROM network_devices WHERE id = ?', (device_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting device: {str(e)}")
-            conn.rollback()
-            return False
+    try:
+        with write_connection() as conn:
+            conn.execute('DELETE FROM network_devices WHERE id = ?', (device_id,))
+        return True
+    except Exception as e:
+        print(f"Error deleting device: {str(e)}")
+        return False
 
 def add_device(name, ip_address, description):
     """Add a new device to the network_devices table."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
+    try:
+        with write_connection() as conn:
+            cursor = conn.execute('''
                 INSERT INTO network_devices (name, ip_address, description)
                 VALUES (?, ?, ?)
             ''', (name, ip_address, description))
-            conn.commit()
             return cursor.lastrowid  # Return the new device's ID
-        except Exception as e:
-            print(f"Error adding device: {str(e)}")
-            conn.rollback()
-            return None
+    except Exception as e:
+        print(f"Error adding device: {str(e)}")
+        return None
 
 
 def get_device(device_id):
     """Retrieve a device by its ID."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM network_devices WHERE id = ?
         ''', (device_id,))
         return cursor.fetchone()
 
+# CIP control functions
+def _settings_text(settings):
+    """Store settings given as a JSON-compatible object as JSON text."""
+    return settings if isinstance(settings, str) else json.dumps(settings)
+
+def add_cip_control(control_name, settings):
+    """Add a CIP control and return its id."""
+    with write_connection() as conn:
+        cursor = conn.execute('''
+            INSERT INTO cip_controls (control_name, settings, version)
+            VALUES (?, ?, 1)
+        ''', (control_name, _settings_text(settings)))
+        return cursor.lastrowid
+
+def update_cip_control(control_id, control_name, settings):
+    """
+    Replace a CIP control's name and settings and bump its version.
+
+    :return: The new version, or None if the control does not exist.
+    """
+    with write_connection() as conn:
+        cursor = conn.execute('''
+            UPDATE cip_controls
+            SET control_name = ?, settings = ?, version = version + 1
+            WHERE id = ?
+        ''', (control_name, _settings_text(settings), control_id))
+        if cursor.rowcount == 0:
+            return None
+        return conn.execute('SELECT version FROM cip_controls WHERE id = ?', (control_id,)).fetchone()[0]
+
+def get_cip_control(control_id):
+    """Retrieve a CIP control by its ID."""
+    with read_connection() as conn:
+        return conn.execute('''
+            SELECT id, control_name, settings, version FROM cip_controls WHERE id = ?
+        ''', (control_id,)).fetchone()
+
 # Query functions
 def get_latest_device_metrics(device_id):
     """Get the latest metrics for a specific device."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         return conn.execute('''
             SELECT 
                 cpu_usage, memory_usage, disk_usage, vulnerability_score, 
@@ -324,42 +827,549 @@ def get_latest_device_metrics(device_id):
 
 def get_all_devices():
     """Retrieve all network devices."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         return conn.execute('SELECT * FROM network_devices').fetchall()
 
 def get_latest_metrics():
     """Retrieve the latest metrics for all devices."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         return conn.execute('''
             SELECT 
                 d.id,
                 d.name,
                 d.ip_address,
                 d.description,
-                m.cpu_usage,
-                m.memory_usage,
-                m.disk_usage,
-                m.vulnerability_score,
-                a.zscore_cpu,
-                a.zscore_memory,
-                a.zscore_disk,
-                a.zscore_vulnerability,
-                a.device_state
+                l.cpu_usage,
+                l.memory_usage,
+                l.disk_usage,
+                l.vulnerability_score,
+                l.zscore_cpu,
+                l.zscore_memory,
+                l.zscore_disk,
+                l.zscore_vulnerability,
+                l.device_state
             FROM network_devices d
-            LEFT JOIN device_metrics m ON d.id = m.device_id
-            LEFT JOIN device_analysis_results a ON d.id = a.device_id
-            WHERE m.id IN (
-                SELECT MAX(id) FROM device_metrics GROUP BY device_id
+            JOIN device_latest l ON d.id = l.device_id
+            WHERE l.metrics_timestamp IS NOT NULL
+            AND l.analysis_timestamp IS NOT NULL
+        ''').fetchall()
+
+# Latest-state functions
+def upsert_latest_metrics(conn, rows):
+    """
+    Record the newest sample per device in device_latest.
+
+    :param conn: Write connection inside the caller's transaction.
+    :param rows: Tuples (device_id, <HISTORY_METRICS...>, epoch_seconds) in arrival order.
+    """
+    latest = {}
+    for row in rows:
+        latest[row[0]] = row
+    metric_count = len(HISTORY_METRICS)
+    columns = ', '.join(HISTORY_METRICS)
+    updates = ', '.join(f'{m} = excluded.{m}' for m in HISTORY_METRICS)
+    conn.executemany(f'''
+        INSERT INTO device_latest (device_id, {columns}, metrics_timestamp)
+        VALUES ({', '.join('?' * (metric_count + 2))})
+        ON CONFLICT(device_id) DO UPDATE SET
+            {updates},
+            metrics_timestamp = excluded.metrics_timestamp
+    ''', [(*row[:1 + metric_count], format_timestamp(row[-1])) for row in latest.values()])
+
+def insert_analysis_results(conn, rows):
+    """
+    Append analysis rows to device_analysis_results and mirror the newest into device_latest.
+
+    :param conn: Write connection inside the caller's transaction.
+    :param rows: Tuples (device_id, <ANALYSIS_COLUMNS...>, epoch_seconds) in arrival order.
+    """
+    columns = ', '.join(ANALYSIS_COLUMNS)
+    placeholders = ', '.join('?' * (len(ANALYSIS_COLUMNS) + 2))
+    params = [(*row[:-1], format_timestamp(row[-1])) for row in rows]
+    conn.executemany(f'''
+        INSERT INTO device_analysis_results (device_id, {columns}, timestamp)
+        VALUES ({placeholders})
+    ''', params)
+
+    latest = {}
+    for row in params:
+        latest[row[0]] = row
+    updates = ', '.join(f'{c} = excluded.{c}' for c in ANALYSIS_COLUMNS)
+    conn.executemany(f'''
+        INSERT INTO device_latest (device_id, {columns}, analysis_timestamp)
+        VALUES ({placeholders})
+        ON CONFLICT(device_id) DO UPDATE SET
+            {updates},
+            analysis_timestamp = excluded.analysis_timestamp
+    ''', list(latest.values()))
+
+# Newest history row per device; devices whose raw history or analysis rows
+# were pruned keep the values already materialized in device_latest. Legacy rows keyed by
+# client-side string ids never match a device and are skipped.
+_LATEST_FROM_HISTORY = f'''
+    SELECT ids.device_id,
+           {', '.join(f'CASE WHEN h.id IS NULL THEN old.{m} ELSE h.{m} END' for m in HISTORY_METRICS)},
+           CASE WHEN h.id IS NULL THEN old.metrics_timestamp ELSE h.timestamp END,
+           {', '.join(f'CASE WHEN a.id IS NULL THEN old.{c} ELSE a.{c} END' for c in ANALYSIS_COLUMNS)},
+           CASE WHEN a.id IS NULL THEN old.analysis_timestamp ELSE a.timestamp END
+    FROM (
+        SELECT device_id FROM device_metrics_history
+        UNION
+        SELECT device_id FROM device_analysis_results
+    ) ids
+    LEFT JOIN device_metrics_history h ON h.id = (
+        SELECT MAX(id) FROM device_metrics_history WHERE device_id = ids.device_id
+    )
+    LEFT JOIN device_analysis_results a ON a.id = (
+        SELECT MAX(id) FROM device_analysis_results WHERE device_id = ids.device_id
+    )
+    LEFT JOIN device_latest old ON old.device_id = ids.device_id
+    WHERE typeof(ids.device_id) = 'integer'
+'''
+
+def rebuild_device_latest(conn):
+    """Rewrite device_latest rows from device_metrics_history and device_analysis_results."""
+    conn.execute(f'''
+        INSERT OR REPLACE INTO device_latest (
+            device_id, {', '.join(HISTORY_METRICS)}, metrics_timestamp,
+            {', '.join(ANALYSIS_COLUMNS)}, analysis_timestamp
+        )
+        {_LATEST_FROM_HISTORY}
+    ''')
+
+def check_device_latest(repair=True):
+    """
+    Compare device_latest with the newest history rows and rebuild it on drift.
+
+    :return: Number of devices whose materialized row did not match history.
+    """
+    columns = ['device_id'] + HISTORY_METRICS + ['metrics_timestamp'] + ANALYSIS_COLUMNS + ['analysis_timestamp']
+    with read_connection() as conn:
+        expected = {row[0]: tuple(row) for row in conn.execute(_LATEST_FROM_HISTORY)}
+        actual = {
+            row[0]: tuple(row)
+            for row in conn.execute(f'SELECT {", ".join(columns)} FROM device_latest')
+        }
+
+    mismatched = [
+        device_id for device_id, row in expected.items()
+        if actual.get(device_id) != row
+    ]
+    if mismatched:
+        logger.warning(f"device_latest out of sync for {len(mismatched)} devices")
+        if repair:
+            with write_connection() as conn:
+                rebuild_device_latest(conn)
+    return len(mismatched)
+
+# Population statistics functions
+def _welford_add_sql(metric, value, project, condition='1'):
+    """Statements adding `value` to the running stats of `metric` for the fleet and `project`."""
+    return f'''
+        INSERT OR IGNORE INTO population_stats (metric, project_id, count, mean, m2)
+        SELECT '{metric}', {project}, 0, 0, 0 WHERE {project} IS NOT NULL;
+        UPDATE population_stats
+        SET count = count + 1,
+            mean = mean + ({value} - mean) / (count + 1),
+            m2 = m2 + ({value} - mean) * ({value} - (mean + ({value} - mean) / (count + 1)))
+        WHERE metric = '{metric}'
+          AND project_id IN ({FLEET_SCOPE}, COALESCE({project}, {FLEET_SCOPE}))
+          AND {value} IS NOT NULL
+          AND {condition};
+    '''
+
+def _welford_remove_sql(metric, value, project, condition='1'):
+    """UPDATE removing `value` from the running stats of `metric` for the fleet and `project`."""
+    return f'''
+        UPDATE population_stats
+        SET count = count - 1,
+            mean = CASE WHEN count <= 1 THEN 0
+                        ELSE mean - ({value} - mean) / (count - 1) END,
+            m2 = CASE WHEN count <= 1 THEN 0
+                      ELSE MAX(m2 - ({value} - mean) * ({value} - (mean - ({value} - mean) / (count - 1))), 0) END
+        WHERE metric = '{metric}'
+          AND project_id IN ({FLEET_SCOPE}, COALESCE({project}, {FLEET_SCOPE}))
+          AND {value} IS NOT NULL
+          AND count > 0
+          AND {condition};
+    '''
+
+def _histogram_bin_sql(value):
+    """SQL expression mapping `value` to its population_histograms bin."""
+    low, high = SKETCH_RANGE
+    scale = SKETCH_BINS / (high - low)
+    return f'MIN(MAX(CAST(({value} - {low}) * {scale} AS INTEGER), 0), {SKETCH_BINS - 1})'
+
+def _histogram_add_sql(metric, value, project, condition='1'):
+    """Statement counting `value` in the histogram of `metric` for the fleet and `project`."""
+    return f'''
+        INSERT INTO population_histograms (metric, project_id, bin, count)
+        SELECT '{metric}', scope, {_histogram_bin_sql(value)}, 1
+        FROM (SELECT {FLEET_SCOPE} AS scope UNION ALL SELECT {project} WHERE {project} IS NOT NULL)
+        WHERE {value} IS NOT NULL AND {condition}
+        ON CONFLICT(metric, project_id, bin) DO UPDATE SET count = count + 1;
+    '''
+
+def _histogram_remove_sql(metric, value, project, condition='1'):
+    """Statement uncounting `value` from the histogram of `metric` for the fleet and `project`."""
+    return f'''
+        UPDATE population_histograms
+        SET count = count - 1
+        WHERE metric = '{metric}'
+          AND project_id IN ({FLEET_SCOPE}, COALESCE({project}, {FLEET_SCOPE}))
+          AND bin = {_histogram_bin_sql(value)}
+          AND count > 0
+          AND {value} IS NOT NULL
+          AND {condition};
+    '''
+
+def _population_stats_trigger_bodies():
+    """Trigger bodies keeping population_stats in step with devices, keyed by event."""
+    insert, delete, update = [], [], []
+    for m in DEVICE_METRICS:
+        insert.append(_welford_add_sql(m, f'NEW.{m}', 'NEW.project_id'))
+        delete.append(_welford_remove_sql(m, f'OLD.{m}', 'OLD.project_id'))
+        # A replaced value first removes the old contribution, then adds the new one
+        changed = f'(OLD.{m} IS NOT NEW.{m} OR OLD.project_id IS NOT NEW.project_id)'
+        update.append(_welford_remove_sql(m, f'OLD.{m}', 'OLD.project_id', changed))
+        update.append(_welford_add_sql(m, f'NEW.{m}', 'NEW.project_id', changed))
+        insert.append(_histogram_add_sql(m, f'NEW.{m}', 'NEW.project_id'))
+        delete.append(_histogram_remove_sql(m, f'OLD.{m}', 'OLD.project_id'))
+        # Moves within one bin leave the histogram unchanged
+        rebinned = (f'({_histogram_bin_sql(f"OLD.{m}")} IS NOT {_histogram_bin_sql(f"NEW.{m}")}'
+                    f' OR OLD.project_id IS NOT NEW.project_id)')
+        update.append(_histogram_remove_sql(m, f'OLD.{m}', 'OLD.project_id', rebinned))
+        update.append(_histogram_add_sql(m, f'NEW.{m}', 'NEW.project_id', rebinned))
+    return {
+        'INSERT': '\n'.join(insert),
+        'DELETE': '\n'.join(delete),
+        'UPDATE': '\n'.join(update)
+    }
+
+_EPOCH_NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+def _change_version_trigger_sql(table, event):
+    """
+    Trigger event clause and body stamping each change of a versioned table.
+
+    The sequence is advanced once per changed row; the table's fleet and
+    project versions and the row's version in each scope are set to it.
+    An update that moves a row to another project leaves a tombstone in
+    the old project's scope.
+    """
+    row_id, project, columns = VERSIONED_TABLES[table]
+    scopes = [f'SELECT {FLEET_SCOPE} AS scope, {int(event == "DELETE")} AS deleted']
+    if project is not None:
+        if event == 'INSERT':
+            scopes.append(f'SELECT NEW.{project}, 0')
+        elif event == 'DELETE':
+            scopes.append(f'SELECT OLD.{project}, 1')
+        else:
+            scopes.append(f'SELECT NEW.{project}, 0')
+            scopes.append(f'SELECT OLD.{project}, 1 WHERE OLD.{project} IS NOT NEW.{project}')
+    row = f"{'OLD' if event == 'DELETE' else 'NEW'}.{row_id}"
+    sequence = f"seq.table_name = '{CHANGE_SEQUENCE}' AND seq.project_id = {FLEET_SCOPE}"
+
+    if event == 'UPDATE':
+        changed = ' OR '.join(f'OLD.{c} IS NOT NEW.{c}' for c in columns)
+        clause = f"AFTER UPDATE OF {', '.join(columns)} ON {table} WHEN {changed}"
+    else:
+        clause = f'AFTER {event} ON {table}'
+    return f'''{clause}
+        BEGIN
+            UPDATE change_versions SET version = version + 1, updated_at = {_EPOCH_NOW_SQL}
+            WHERE table_name = '{CHANGE_SEQUENCE}' AND project_id = {FLEET_SCOPE};
+            INSERT INTO change_versions (table_name, project_id, version, updated_at)
+            SELECT '{table}', scopes.scope, seq.version, seq.updated_at
+            FROM change_versions seq, ({' UNION ALL '.join(scopes)}) scopes
+            WHERE {sequence} AND scopes.scope IS NOT NULL
+            ON CONFLICT (table_name, project_id) DO UPDATE SET
+                version = excluded.version, updated_at = excluded.updated_at;
+            INSERT INTO row_versions (table_name, project_id, row_id, version, deleted)
+            SELECT '{table}', scopes.scope, {row}, seq.version, scopes.deleted
+            FROM change_versions seq, ({' UNION ALL '.join(scopes)}) scopes
+            WHERE {sequence} AND scopes.scope IS NOT NULL
+            ON CONFLICT (table_name, project_id, row_id) DO UPDATE SET
+                version = excluded.version, deleted = excluded.deleted;
+        END'''
+
+def get_change_version(conn, tables, project_id=None):
+    """
+    Current change version of one or more versioned tables.
+
+    Versions of different tables come from one sequence, so the result is
+    the version of the latest change to any of them.
+
+    :param tables: Names from VERSIONED_TABLES.
+    :param project_id: Project scope, or None for the whole fleet.
+    :return: Tuple (version, updated_at epoch seconds); (0, None) before
+        the first change.
+    """
+    placeholders = ', '.join('?' for _ in tables)
+    version, updated_at = conn.execute(f'''
+        SELECT MAX(version), MAX(updated_at) FROM change_versions
+        WHERE project_id = ? AND table_name IN ({placeholders})
+    ''', (FLEET_SCOPE if project_id is None else project_id, *tables)).fetchone()
+    return (version or 0), updated_at
+
+def get_changed_rows(conn, table, since_version, project_id=None):
+    """
+    Ids of the rows of a versioned table that changed after `since_version`.
+
+    :param project_id: Project scope, or None for the whole fleet.
+    :return: Tuple (ids of rows inserted or updated, ids of rows deleted or
+        moved out of the project).
+    """
+    changed, removed = [], []
+    for row_id, deleted in conn.execute('''
+        SELECT row_id, deleted FROM row_versions
+        WHERE table_name = ? AND project_id = ? AND version > ?
+    ''', (table, FLEET_SCOPE if project_id is None else project_id, since_version)):
+        (removed if deleted else changed).append(row_id)
+    return changed, removed
+
+def rebuild_population_stats(conn):
+    """Recompute population_stats from the devices table (two-pass, exact)."""
+    conn.execute('DELETE FROM population_stats')
+    for m in DEVICE_METRICS:
+        conn.execute(f'''
+            INSERT INTO population_stats (metric, project_id, count, mean, m2)
+            WITH vals AS (
+                SELECT {FLEET_SCOPE} AS scope, {m} AS v FROM devices WHERE {m} IS NOT NULL
+                UNION ALL
+                SELECT project_id, {m} FROM devices
+                WHERE {m} IS NOT NULL AND project_id IS NOT NULL
+            ),
+            avgs AS (
+                SELECT scope, COUNT(*) AS n, AVG(v) AS mu FROM vals GROUP BY scope
             )
-            AND a.id IN (
-                SELECT MAX(id) FROM device_analysis_results GROUP BY device_id
+            SELECT '{m}', avgs.scope, avgs.n, avgs.mu, SUM((v - avgs.mu) * (v - avgs.mu))
+            FROM vals JOIN avgs ON vals.scope = avgs.scope
+            GROUP BY avgs.scope
+        ''')
+        conn.execute('''
+            INSERT OR IGNORE INTO population_stats (metric, project_id, count, mean, m2)
+            VALUES (?, ?, 0, 0, 0)
+        ''', (m, FLEET_SCOPE))
+
+def rebuild_population_histograms(conn):
+    """Recount population_histograms from the devices table."""
+    conn.execute('DELETE FROM population_histograms')
+    for m in DEVICE_METRICS:
+        conn.execute(f'''
+            INSERT INTO population_histograms (metric, project_id, bin, count)
+            SELECT '{m}', scope, bin, COUNT(*)
+            FROM (
+                SELECT {FLEET_SCOPE} AS scope, {_histogram_bin_sql(m)} AS bin
+                FROM devices WHERE {m} IS NOT NULL
+                UNION ALL
+                SELECT project_id, {_histogram_bin_sql(m)}
+                FROM devices WHERE {m} IS NOT NULL AND project_id IS NOT NULL
             )
+            GROUP BY scope, bin
+        ''')
+
+def get_population_histograms():
+    """
+    Read the non-empty population histogram bins.
+
+    :return: Dict (metric, project_id) -> {bin: count}.
+    """
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT metric, project_id, bin, count FROM population_histograms WHERE count > 0
         ''').fetchall()
+    histograms = {}
+    for row in rows:
+        histograms.setdefault((row[0], row[1]), {})[row[2]] = row[3]
+    return histograms
+
+def get_population_stats(project_id=None):
+    """
+    Read the running mean and sample standard deviation of every device metric.
+
+    :param project_id: Restrict to one project; None for the whole fleet.
+    :return: Dict metric -> (mean, std), with (None, None) for metrics without values.
+    """
+    scope = FLEET_SCOPE if project_id is None else project_id
+    with read_connection() as conn:
+        rows = conn.execute('''
+            SELECT metric, count, mean, m2 FROM population_stats WHERE project_id = ?
+        ''', (scope,)).fetchall()
+    stats = {m: (None, None) for m in DEVICE_METRICS}
+    for row in rows:
+        if row['count'] > 0:
+            std = (row['m2'] / (row['count'] - 1)) ** 0.5 if row['count'] > 1 else 0
+            stats[row['metric']] = (row['mean'], std)
+    return stats
+
+# Rollup and retention functions
+def format_timestamp(epoch):
+    """Format epoch seconds like SQLite CURRENT_TIMESTAMP (UTC)."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
+
+def update_metric_rollups(conn, rows):
+    """
+    Fold raw samples into every rollup table.
+
+    Samples are pre-aggregated per (device, bucket) so each bucket is upserted
+    once per call, merging min/max and count-weighted means with the stored row.
+
+    :param conn: Write connection inside the caller's transaction.
+    :param rows: Tuples (device_id, <HISTORY_METRICS...>, epoch_seconds).
+    """
+    metric_count = len(HISTORY_METRICS)
+    for _, bucket_seconds, table, _ in ROLLUP_RESOLUTIONS:
+        buckets = {}
+        for row in rows:
+            key = (row[0], int(row[-1]) // bucket_seconds * bucket_seconds)
+            values = row[1:1 + metric_count]
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = [1, list(values), list(values), list(values)]
+                continue
+            agg[0] += 1
+            for i, value in enumerate(values):
+                agg[1][i] = min(agg[1][i], value)
+                agg[2][i] = max(agg[2][i], value)
+                agg[3][i] += value
+
+        params = []
+        for (device_id, bucket_start), (count, mins, maxs, sums) in buckets.items():
+            params.append((device_id, bucket_start, count, *[
+                v for i in range(metric_count) for v in (mins[i], maxs[i], sums[i] / count)
+            ]))
+
+        columns = ', '.join(f'{m}_min, {m}_max, {m}_mean' for m in HISTORY_METRICS)
+        updates = ',\n'.join(
+            f'{m}_min = MIN({m}_min, excluded.{m}_min), '
+            f'{m}_max = MAX({m}_max, excluded.{m}_max), '
+            f'{m}_mean = ({m}_mean * sample_count + excluded.{m}_mean * excluded.sample_count)'
+            f' / (sample_count + excluded.sample_count)'
+            for m in HISTORY_METRICS
+        )
+        placeholders = ', '.join('?' * (3 + 3 * metric_count))
+        conn.executemany(f'''
+            INSERT INTO {table} (device_id, bucket_start, sample_count, {columns})
+            VALUES ({placeholders})
+            ON CONFLICT(device_id, bucket_start) DO UPDATE SET
+                {updates},
+                sample_count = sample_count + excluded.sample_count
+        ''', params)
+
+def rebuild_metric_rollups(conn):
+    """Recompute every rollup table from the raw rows in device_metrics_history."""
+    columns = ', '.join(f'{m}_min, {m}_max, {m}_mean' for m in HISTORY_METRICS)
+    aggregates = ', '.join(f'MIN({m}), MAX({m}), AVG({m})' for m in HISTORY_METRICS)
+    for _, bucket_seconds, table, _ in ROLLUP_RESOLUTIONS:
+        conn.execute(f'DELETE FROM {table}')
+        conn.execute(f'''
+            INSERT INTO {table} (device_id, bucket_start, sample_count, {columns})
+            SELECT device_id,
+                   CAST(strftime('%s', timestamp) AS INTEGER) / {bucket_seconds} * {bucket_seconds},
+                   COUNT(*), {aggregates}
+            FROM device_metrics_history
+            GROUP BY 1, 2
+        ''')
+
+_last_prune = 0.0
+
+def prune_metrics_history(conn, now=None, force=False):
+    """
+    Delete raw samples, analysis rows, state transitions and rollup buckets that are past their retention.
+
+    Runs at most once every PRUNE_INTERVAL_SECONDS unless `force` is set, and
+    deletes raw rows in chunks of PRUNE_BATCH_ROWS to keep each call short.
+    Raw samples and analysis rows are only pruned when RAW_RETENTION_DAYS is
+    set, and never before the rollups have been backfilled from them.
+
+    :return: Number of raw history rows deleted.
+    """
+    global _last_prune
+    monotonic_now = time.monotonic()
+    if not force and monotonic_now - _last_prune < PRUNE_INTERVAL_SECONDS:
+        return 0
+    _last_prune = monotonic_now
+
+    now = time.time() if now is None else now
+    deleted = 0
+    backfilled = conn.execute(f'SELECT 1 FROM {ROLLUP_RESOLUTIONS[-1][2]} LIMIT 1').fetchone() is not None
+    if RAW_RETENTION_DAYS is not None and backfilled:
+        raw_cutoff = format_timestamp(now - RAW_RETENTION_DAYS * 86400)
+        deleted = conn.execute('''
+            DELETE FROM device_metrics_history
+            WHERE id IN (
+                SELECT id FROM device_metrics_history
+                WHERE timestamp < ?
+                LIMIT ?
+            )
+        ''', (raw_cutoff, PRUNE_BATCH_ROWS)).rowcount
+        conn.execute('''
+            DELETE FROM device_analysis_results
+            WHERE id IN (
+                SELECT id FROM device_analysis_results
+                WHERE timestamp < ?
+                LIMIT ?
+            )
+        ''', (raw_cutoff, PRUNE_BATCH_ROWS))
+    conn.execute('DELETE FROM device_state_transitions WHERE changed_at < ?',
+                 (int(now - TRANSITION_RETENTION_DAYS * 86400),))
+
+    for _, _, table, retention_days in ROLLUP_RESOLUTIONS:
+        if retention_days is not None:
+            conn.execute(f'DELETE FROM {table} WHERE bucket_start < ?',
+                         (int(now - retention_days * 86400),))
+    return deleted
+
+def select_history_resolution(start, end, max_points, now=None):
+    """
+    Pick the resolution to serve a history query for [start, end] (epoch seconds).
+
+    Coarsens only as far as the range requires: returns the finest resolution
+    whose retention still covers `start` and whose bucket count over the range
+    fits in `max_points`, falling back to the coarsest rollup.
+
+    :return: Tuple (name, bucket_seconds, table); table is None for raw samples.
+    """
+    now = time.time() if now is None else now
+    span = max(end - start, 0)
+    candidates = [('raw', RAW_SAMPLE_SECONDS, None, RAW_RETENTION_DAYS)] + ROLLUP_RESOLUTIONS
+    for name, bucket_seconds, table, retention_days in candidates:
+        covers_range = retention_days is None or start >= now - retention_days * 86400
+        if covers_range and span / bucket_seconds <= max_points:
+            return name, bucket_seconds, table
+    name, bucket_seconds, table, _ = ROLLUP_RESOLUTIONS[-1]
+    return name, bucket_seconds, table
+
+def get_metrics_history(device_id, start, end, max_points=100):
+    """
+    Read a device's metric history for [start, end] (epoch seconds).
+
+    :return: Tuple (resolution name, rows). Raw rows carry the sample values;
+        rollup rows carry sample_count and <metric>_min/_max/_mean columns.
+    """
+    resolution, bucket_seconds, table = select_history_resolution(start, end, max_points)
+    with read_connection() as conn:
+        if table is None:
+            rows = conn.execute('''
+                SELECT device_id, timestamp, cpu_usage, memory_usage, disk_usage,
+                       vulnerability_score, network_usage, temperature
+                FROM device_metrics_history
+                WHERE device_id = ? AND timestamp BETWEEN ? AND ?
+                ORDER BY timestamp DESC
+            ''', (device_id, format_timestamp(start), format_timestamp(end))).fetchall()
+        else:
+            rows = conn.execute(f'''
+                SELECT * FROM {table}
+                WHERE device_id = ? AND bucket_start > ? AND bucket_start <= ?
+                ORDER BY bucket_start DESC
+            ''', (device_id, int(start) - bucket_seconds, int(end))).fetchall()
+    return resolution, rows
 
 # Verification functions
 def verify_database_integrity():
     """Verify the integrity of the database and mappings."""
-    with closing(get_db_connection()) as conn:
+    with read_connection() as conn:
         cursor = conn.cursor()
         
         orphaned_metrics = cursor.execute('''
@@ -381,8 +1391,15 @@ def verify_database_integrity():
         
         if orphaned_analysis:
             logger.warning(f"Found {len(orphaned_analysis)} orphaned analysis results: {orphaned_analysis}")
+
+    stale_latest = check_device_latest()
+
+    # Re-anchor the incrementally maintained statistics to exact values
+    with write_connection() as conn:
+        rebuild_population_stats(conn)
+        rebuild_population_histograms(conn)
         
-        return not (bool(orphaned_metrics) or bool(orphaned_analysis))
+    return not (bool(orphaned_metrics) or bool(orphaned_analysis) or bool(stale_latest))
 
 
 # Initialize the database when the script is run directly
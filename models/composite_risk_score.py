@@ -1,5 +1,7 @@
 # models/composite_risk_score.py
 
+from models.factor_arrays import factor_matrix, factor_vector
+
 def calculate_composite_risk_score(risk_components, weights):
     """
     Calculate the Composite Risk Score (CRS) from multiple risk factors.
@@ -14,3 +16,15 @@ def calculate_composite_risk_score(risk_components, weights):
     composite_score = sum(weights[key] * risk_components[key] for key in risk_components.keys())
 
     return composite_score
+
+def calculate_composite_risk_score_batch(risk_components, weights):
+    """
+    Calculate Composite Risk Scores for N devices at once.
+
+    :param risk_components: N x K array with columns in `weights` key order, a
+        structured array or a dictionary of per-key columns (normalized between 0 and 1).
+    :param weights: Dictionary of weights for each risk component.
+    :return: N-vector of Composite Risk Scores.
+    """
+    keys = list(weights.keys())
+    return factor_matrix(risk_components, keys) @ factor_vector(weights, keys)
@@ -0,0 +1,115 @@
+# models/decay_engine.py
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from models.factor_arrays import factor_matrix, factor_vector
+
+# Exponent tables kept for recurring (rates, step, count) grids
+DECAY_TABLE_CACHE_SIZE = int(os.environ.get('DECAY_TABLE_CACHE_SIZE', 64))
+
+
+class DecayEngine:
+    """
+    Vectorized time decay over (influences x timestamps) grids.
+
+    Evaluates value * exp(-rate * t) for many influences, devices and time
+    points in one broadcast. Regular grids reuse cached tables of
+    exp(-rate * k * step), so a recurring timeline costs one multiply.
+    """
+
+    def __init__(self, cache_size=DECAY_TABLE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def table(self, rates, step, count):
+        """
+        Return the K x count table exp(-rates[k] * i * step), i = 0..count-1.
+
+        Tables are read-only and shared between callers.
+        """
+        rates = np.asarray(rates, dtype=float)
+        key = (rates.tobytes(), float(step), int(count))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = np.exp(-np.outer(rates, np.arange(count) * step))
+        table.flags.writeable = False
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.cache_size:
+                self._tables.popitem(last=False)
+        return table
+
+    def decay(self, initial_values, rates, times):
+        """
+        Decay values over arbitrary time points.
+
+        :param initial_values: K values, or N x K (e.g. devices x influences).
+        :param rates: K decay rates.
+        :param times: T elapsed times, or N x T per-row times.
+        :return: Array of shape (..., K, T).
+        """
+        values = np.asarray(initial_values, dtype=float)
+        rates = np.asarray(rates, dtype=float)
+        times = np.asarray(times, dtype=float)
+        exponents = -rates[:, None] * times[..., None, :]
+        return values[..., None] * np.exp(exponents)
+
+    def decay_grid(self, initial_values, rates, start, step, count):
+        """
+        Decay values over the regular grid start, start + step, ... using a cached table.
+
+        :param initial_values: K values, or N x K.
+        :param rates: K decay rates.
+        :return: Array of shape (..., K, count).
+        """
+        rates = np.asarray(rates, dtype=float)
+        table = self.table(rates, step, count)
+        values = np.asarray(initial_values, dtype=float)
+        if start:
+            values = values * np.exp(-rates * start)
+        return values[..., None] * table
+
+    def decay_factors(self, rate, elapsed):
+        """Decay factor exp(-rate * elapsed) of a single rate for an array of elapsed times."""
+        return np.exp(-rate * np.asarray(elapsed, dtype=float))
+
+    def curves(self, initial_values, decay_rates, start, step, count):
+        """
+        Decay curves of named influences, as calculate_time_decay_multiple over a timeline.
+
+        :param initial_values: Dictionary of initial values for one device, or
+            anything factor_matrix accepts for N devices.
+        :param decay_rates: Dictionary of decay rates for each value.
+        :return: Dictionary of key -> array of shape (count,) or (N, count).
+        """
+        keys = list(decay_rates.keys())
+        if isinstance(initial_values, dict) and all(np.ndim(v) == 0 for v in initial_values.values()):
+            values = factor_vector(initial_values, keys)
+        else:
+            values = factor_matrix(initial_values, keys)
+        grid = self.decay_grid(values, factor_vector(decay_rates, keys), start, step, count)
+        return {key: grid[..., k, :] for k, key in enumerate(keys)}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tables': len(self._tables),
+                'capacity': self.cache_size,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+decay_engine = DecayEngine()
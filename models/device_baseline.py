@@ -0,0 +1,144 @@
+# models/device_baseline.py
+
+import math
+import os
+
+from database import DEVICE_METRICS, read_connection, format_timestamp
+
+# Effective window of the exponentially weighted baseline, in samples
+BASELINE_WINDOW_SAMPLES = int(os.environ.get('BASELINE_WINDOW_SAMPLES', 60))
+# Samples a baseline needs before it produces Z-scores
+BASELINE_MIN_SAMPLES = int(os.environ.get('BASELINE_MIN_SAMPLES', 5))
+
+
+def update_ewm_stats(count, mean, var, value, alpha):
+    """
+    Fold one value into an exponentially weighted mean and variance.
+
+    :param count: Samples folded in so far (0 for a new baseline).
+    :param mean: Current weighted mean.
+    :param var: Current weighted variance.
+    :param value: New sample.
+    :param alpha: Smoothing factor (between 0 and 1).
+    :return: Updated (count, mean, var).
+    """
+    if count == 0:
+        return 1, value, 0.0
+    diff = value - mean
+    increment = alpha * diff
+    return count + 1, mean + increment, (1 - alpha) * (var + diff * increment)
+
+
+class DeviceBaseline:
+    """
+    Rolling per-device baseline for temporal anomaly detection.
+
+    Keeps an exponentially weighted mean and variance of every metric in one
+    device_baselines row per device and scores every analyzed sample against
+    the device's own recent history rather than against the fleet.
+    """
+
+    def __init__(self, window=BASELINE_WINDOW_SAMPLES, min_samples=BASELINE_MIN_SAMPLES):
+        self.window = window
+        self.alpha = 2.0 / (window + 1)
+        self.min_samples = min_samples
+        self.device_metrics = DEVICE_METRICS
+        self.state_columns = ', '.join(
+            f'{m}_count, {m}_mean, {m}_var' for m in self.device_metrics
+        )
+
+    def calculate_zscore(self, count, mean, var, value):
+        """Z-score of `value` against a baseline; None while it is warming up."""
+        if count < self.min_samples:
+            return None
+        if var <= 0:
+            return 0.0
+        return (value - mean) / math.sqrt(var)
+
+    def load(self, conn, device_ids):
+        """
+        Read the baselines of `device_ids`.
+
+        :return: Dict (device_id, metric) -> (count, mean, var) for every
+            baseline that has seen at least one sample.
+        """
+        baselines = {}
+        for start in range(0, len(device_ids), 500):
+            chunk = device_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(f'''
+                SELECT device_id, {self.state_columns} FROM device_baselines
+                WHERE device_id IN ({placeholders})
+            ''', chunk):
+                for i, metric in enumerate(self.device_metrics):
+                    count, mean, var = row[1 + 3 * i:4 + 3 * i]
+                    if count:
+                        baselines[(row[0], metric)] = (count, mean, var)
+        return baselines
+
+    def score(self, baselines, device_id, values):
+        """
+        Score one sample against the device's baseline, then fold it in.
+
+        The sample is scored before it is folded in, so a spike is not
+        absorbed into the statistics it is measured against.
+
+        :param baselines: Dict from load(), updated in place.
+        :param values: Dict metric -> value; None values are skipped.
+        :return: Dict metric -> Z-score, None while the baseline warms up.
+        """
+        zscores = {}
+        for metric in self.device_metrics:
+            value = values.get(metric)
+            if value is None:
+                continue
+            count, mean, var = baselines.get((device_id, metric), (0, 0.0, 0.0))
+            zscores[metric] = self.calculate_zscore(count, mean, var, value)
+            baselines[(device_id, metric)] = update_ewm_stats(count, mean, var, value, self.alpha)
+        return zscores
+
+    def save(self, conn, baselines, updated_at):
+        """
+        Write baselines back inside the caller's transaction.
+
+        :param baselines: Dict from load() after score().
+        :param updated_at: Dict device_id -> epoch seconds of its newest sample;
+            only these devices are written.
+        """
+        empty = (0, None, None)
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO device_baselines (device_id, {self.state_columns}, updated_at)
+            VALUES ({', '.join('?' * (3 * len(self.device_metrics) + 2))})
+        ''', [
+            (device_id,
+             *[v for m in self.device_metrics for v in baselines.get((device_id, m), empty)],
+             format_timestamp(epoch))
+            for device_id, epoch in updated_at.items()
+        ])
+
+    def get_baseline(self, device_id):
+        """
+        Read the current baseline of a device.
+
+        :return: Dict metric -> {'mean', 'std', 'count', 'updated_at', 'warmed_up'};
+            empty if the device has no baseline yet.
+        """
+        with read_connection() as conn:
+            row = conn.execute('''
+                SELECT * FROM device_baselines WHERE device_id = ?
+            ''', (device_id,)).fetchone()
+        if row is None:
+            return {}
+        return {
+            metric: {
+                'mean': row[f'{metric}_mean'],
+                'std': math.sqrt(max(row[f'{metric}_var'], 0.0)),
+                'count': row[f'{metric}_count'],
+                'updated_at': row['updated_at'],
+                'warmed_up': row[f'{metric}_count'] >= self.min_samples
+            }
+            for metric in self.device_metrics
+            if row[f'{metric}_count']
+        }
+
+device_baseline = DeviceBaseline()
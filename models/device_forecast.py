@@ -0,0 +1,127 @@
+# models/device_forecast.py
+
+import os
+
+from database import HISTORY_METRICS, read_connection, format_timestamp
+from models.holt_winters import HoltWintersState
+
+# Smoothing coefficients of the per-device forecasters
+FORECAST_ALPHA = float(os.environ.get('FORECAST_ALPHA', 0.5))
+FORECAST_BETA = float(os.environ.get('FORECAST_BETA', 0.1))
+FORECAST_GAMMA = float(os.environ.get('FORECAST_GAMMA', 0.1))
+# Length of the seasonal cycle, in samples
+FORECAST_SEASON_LENGTH = int(os.environ.get('FORECAST_SEASON_LENGTH', 30))
+
+
+class DeviceForecaster:
+    """
+    Per-device Holt-Winters forecasts of every history metric.
+
+    The level, trend and seasonal state of each metric is kept in one
+    device_forecast_state row per device and updated in constant time as
+    samples are analyzed, so a forecast is read from the stored state
+    instead of being refitted over the device's history.
+    """
+
+    def __init__(self, alpha=FORECAST_ALPHA, beta=FORECAST_BETA, gamma=FORECAST_GAMMA,
+                 season_length=FORECAST_SEASON_LENGTH):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.season_length = season_length
+        self.metrics = HISTORY_METRICS
+        self.state_columns = ', '.join(f'{m}_state' for m in self.metrics)
+
+    def _decode(self, blob):
+        """State from a stored blob; a fresh one if it has another season length."""
+        if blob:
+            state = HoltWintersState.from_bytes(blob)
+            if state.season_length == self.season_length:
+                return state
+        return HoltWintersState(self.season_length)
+
+    def load(self, conn, device_ids):
+        """
+        Read the forecast state of `device_ids`.
+
+        :return: Dict (device_id, metric) -> HoltWintersState for every stored state.
+        """
+        states = {}
+        for start in range(0, len(device_ids), 500):
+            chunk = device_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in conn.execute(f'''
+                SELECT device_id, {self.state_columns} FROM device_forecast_state
+                WHERE device_id IN ({placeholders})
+            ''', chunk):
+                for metric, blob in zip(self.metrics, row[1:]):
+                    if blob:
+                        states[(row[0], metric)] = self._decode(blob)
+        return states
+
+    def update(self, states, device_id, values):
+        """
+        Fold one sample into the device's forecasters.
+
+        :param states: Dict from load(), updated in place.
+        :param values: Dict metric -> value; None values are skipped.
+        """
+        for metric in self.metrics:
+            value = values.get(metric)
+            if value is None:
+                continue
+            state = states.get((device_id, metric))
+            if state is None:
+                state = states[(device_id, metric)] = HoltWintersState(self.season_length)
+            state.update(value, self.alpha, self.beta, self.gamma)
+
+    def save(self, conn, states, updated_at):
+        """
+        Write forecast state back inside the caller's transaction.
+
+        :param states: Dict from load() after update().
+        :param updated_at: Dict device_id -> epoch seconds of its newest sample;
+            only these devices are written.
+        """
+        def encode(device_id, metric):
+            state = states.get((device_id, metric))
+            return None if state is None else state.to_bytes()
+
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO device_forecast_state (device_id, {self.state_columns}, updated_at)
+            VALUES ({', '.join('?' * (len(self.metrics) + 2))})
+        ''', [
+            (device_id, *[encode(device_id, m) for m in self.metrics], format_timestamp(epoch))
+            for device_id, epoch in updated_at.items()
+        ])
+
+    def get_forecast(self, device_id, horizon, metrics=None):
+        """
+        Forecast the next `horizon` samples of a device from its stored state.
+
+        :param metrics: Metrics to forecast; None for every history metric.
+        :return: Dict metric -> {'forecast', 'samples', 'ready', 'warmup_remaining',
+            'updated_at'}, or None if the device has no forecast state.
+        """
+        with read_connection() as conn:
+            row = conn.execute('''
+                SELECT * FROM device_forecast_state WHERE device_id = ?
+            ''', (device_id,)).fetchone()
+        if row is None:
+            return None
+
+        result = {}
+        for metric in metrics or self.metrics:
+            if not row[f'{metric}_state']:
+                continue
+            state = self._decode(row[f'{metric}_state'])
+            result[metric] = {
+                'forecast': state.forecast(horizon),
+                'samples': state.count if state.ready else len(state.warmup),
+                'ready': state.ready,
+                'warmup_remaining': 0 if state.ready else 2 * self.season_length - len(state.warmup),
+                'updated_at': row['updated_at']
+            }
+        return result
+
+device_forecaster = DeviceForecaster()
@@ -0,0 +1,168 @@
+# models/device_state_machine.py
+
+import json
+import time
+from collections import Counter
+
+import numpy as np
+
+from database import (
+    ANALYSIS_COLUMNS, read_connection, write_connection, insert_analysis_results
+)
+from models.state_transition_adjusted import state_transition_adjusted_batch
+
+# Device states, in the order of their codes in device_state_transitions
+DEVICE_STATES = ('normal', 'warning', 'critical')
+STATE_CODES = {state: code for code, state in enumerate(DEVICE_STATES)}
+
+# Risk levels at which state_transition_adjusted escalates a device
+STATE_THRESHOLDS = {'warning': 0.7, 'critical': 0.9}
+
+
+class DeviceStateMachine:
+    """
+    Fleet-wide device state transitions with a persisted transition log.
+
+    The current state of each device lives in device_analysis_results.device_state
+    (mirrored into device_latest). evaluate() moves every device through
+    state_transition_adjusted in one vectorized pass; each change appends a
+    device_analysis_results row carrying the new state and a row to the
+    compact device_state_transitions log, which is indexed by time so
+    changed_since() never scans the fleet.
+    """
+
+    def __init__(self, thresholds=STATE_THRESHOLDS):
+        self.thresholds = thresholds
+
+    def transition(self, current_states, risks, admin_actions='none'):
+        """
+        Next state of N devices.
+
+        :param current_states: N-vector of states; None is treated as 'normal'.
+        :param risks: N-vector of composite risks.
+        :param admin_actions: N-vector of admin actions, or one for every device.
+        :return: N-vector of new states.
+        """
+        current = np.array([state or 'normal' for state in current_states], dtype='<U8')
+        risks = np.asarray(risks, dtype=float).reshape(-1, 1)
+        return state_transition_adjusted_batch(current, admin_actions, risks, self.thresholds)
+
+    def log_transitions(self, conn, transitions):
+        """
+        Append state changes to device_state_transitions inside the caller's transaction.
+
+        :param transitions: Tuples (device_id, from_state, to_state, risk, epoch_seconds).
+        """
+        conn.executemany('''
+            INSERT INTO device_state_transitions (device_id, from_state, to_state, risk, changed_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (device_id, STATE_CODES[from_state], STATE_CODES[to_state], risk, int(epoch))
+            for device_id, from_state, to_state, risk, epoch in transitions
+        ])
+
+    def evaluate(self, admin_actions=None, risks=None, device_ids=None, now=None):
+        """
+        Apply one state transition to every device.
+
+        Devices without analysis results yet have no risk signal: they stay
+        'normal' unless `risks` gives them one.
+
+        :param admin_actions: Dict device_id -> admin action; other devices get 'none'.
+        :param risks: Dict device_id -> composite risk overriding the device's
+            latest sigmoid_risk.
+        :param device_ids: Devices to evaluate; None for the whole fleet.
+        :param now: Epoch seconds recorded for the changes; defaults to the current time.
+        :return: Dict with the number of devices evaluated and changed and the
+            count of each 'from->to' transition.
+        """
+        now = int(time.time() if now is None else now)
+        admin_actions = admin_actions or {}
+        risks = risks or {}
+        device_filter = '' if device_ids is None else \
+            'WHERE d.id IN (SELECT value FROM json_each(?))'
+        params = () if device_ids is None else (json.dumps(list(device_ids)),)
+
+        with write_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT d.id AS device_id, {', '.join(f'l.{c}' for c in ANALYSIS_COLUMNS)}
+                FROM devices d
+                LEFT JOIN device_latest l ON l.device_id = d.id
+                {device_filter}
+                ORDER BY d.id
+            ''', params).fetchall()
+            if not rows:
+                return {'devices': 0, 'changed': 0, 'transitions': {}}
+
+            ids = [row['device_id'] for row in rows]
+            current = [row['device_state'] or 'normal' for row in rows]
+            device_risks = [risks.get(device_id, row['sigmoid_risk'] or 0.0)
+                            for device_id, row in zip(ids, rows)]
+            new_states = self.transition(
+                current,
+                device_risks,
+                np.array([admin_actions.get(device_id, 'none') for device_id in ids])
+            )
+            changed = np.flatnonzero(new_states != np.array(current, dtype='<U8')).tolist()
+
+            transitions = []
+            results = []
+            for i in changed:
+                state = str(new_states[i])
+                transitions.append((ids[i], current[i], state, device_risks[i], now))
+                analysis = dict(zip(ANALYSIS_COLUMNS, tuple(rows[i])[1:]), device_state=state)
+                results.append((ids[i], *[analysis[c] for c in ANALYSIS_COLUMNS], now))
+            insert_analysis_results(conn, results)
+            self.log_transitions(conn, transitions)
+
+        return {
+            'devices': len(ids),
+            'changed': len(changed),
+            'transitions': dict(Counter(f'{old}->{new}' for _, old, new, _, _ in transitions))
+        }
+
+    def changed_since(self, since, limit=None):
+        """
+        Devices whose state changed at or after `since`, from the transition log.
+
+        :param since: Epoch seconds.
+        :param limit: Maximum number of devices returned, earliest change first.
+        :return: List of {'device_id', 'from_state', 'state', 'transitions',
+            'changed_at'}: the state before its first change since `since`,
+            the state after its last one, the number of changes and the time
+            of the last.
+        """
+        # One row per device, aggregated and limited in SQL: its first and
+        # last change since `since` and how many there were
+        with read_connection() as conn:
+            rows = conn.execute('''
+                WITH recent AS (
+                    SELECT id, device_id, from_state, to_state, changed_at,
+                           ROW_NUMBER() OVER (PARTITION BY device_id
+                                              ORDER BY changed_at, id) AS first_rank,
+                           ROW_NUMBER() OVER (PARTITION BY device_id
+                                              ORDER BY changed_at DESC, id DESC) AS last_rank,
+                           COUNT(*) OVER (PARTITION BY device_id) AS transitions
+                    FROM device_state_transitions
+                    WHERE changed_at >= ?
+                )
+                SELECT f.device_id, f.from_state, l.to_state, f.transitions, l.changed_at
+                FROM recent f
+                JOIN recent l ON l.device_id = f.device_id AND l.last_rank = 1
+                WHERE f.first_rank = 1
+                ORDER BY f.changed_at, f.id
+                LIMIT ?
+            ''', (int(since), -1 if limit is None else limit)).fetchall()
+
+        return [
+            {
+                'device_id': device_id,
+                'from_state': DEVICE_STATES[from_state],
+                'state': DEVICE_STATES[to_state],
+                'transitions': transitions,
+                'changed_at': changed_at
+            }
+            for device_id, from_state, to_state, transitions, changed_at in rows
+        ]
+
+device_state_machine = DeviceStateMachine()
@@ -1,6 +1,26 @@
-from database import get_db_connection
-from contextlib import closing
-from statistics import mean, stdev
+from database import read_connection, get_population_stats
+import base64
+import json
+import numpy as np
+
+# Upper |z| bound for each status; anything above the last bound is 'extreme'
+ZSCORE_STATUS_BOUNDS = [(1, 'normal'), (2, 'warning'), (3, 'critical')]
+
+
+def encode_cursor(state):
+    """Serialize pagination state into an opaque URL-safe token"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(token):
+    """Parse a token from encode_cursor; raises ValueError if it is malformed"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(state, dict):
+        raise ValueError('Invalid cursor')
+    return state
 
 class DeviceZScore:
     """Handles Z-score calculations for device metrics"""
@@ -14,27 +34,18 @@ class DeviceZScore:
             'vulnerability_score'
         ]
 
-    def get_population_stats(self, metric_name):
-        """Calculate mean and standard deviation for a metric across all devices"""
-        with closing(get_db_connection()) as conn:
-            cursor = conn.cursor()
-            try:
-                # Get all non-null values for the metric
-                cursor.execute(f'''
-                    SELECT {metric_name} 
-                    FROM devices 
-                    WHERE {metric_name} IS NOT NULL
-                ''')
-                values = [row[0] for row in cursor.fetchall()]
-                
-                if not values:
-                    return None, None
-                
-                return mean(values), stdev(values) if len(values) > 1 else 0
-                
-            except Exception as e:
-                print(f"Error calculating stats for {metric_name}: {str(e)}")
-                return None, None
+    def get_population_stats(self, metric_name, project_id=None):
+        """
+        Get mean and standard deviation for a metric across all devices.
+
+        Reads the running statistics that the devices table triggers keep in
+        population_stats, so no table scan is needed.
+        """
+        return get_population_stats(project_id).get(metric_name, (None, None))
+
+    def get_baseline(self):
+        """Get (mean, std) of every metric in one read of population_stats"""
+        return get_population_stats()
 
     def calculate_single_zscore(self, value, metric_mean, metric_std):
         """Calculate Z-score for a single value"""
@@ -44,7 +55,7 @@ class DeviceZScore:
 
     def get_device_metrics(self, device_id):
         """Get current metrics for a specific device"""
-        with closing(get_db_connection()) as conn:
+        with read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT cpu_usage, memory_usage, disk_usage, vulnerability_score
@@ -61,10 +72,11 @@ class DeviceZScore:
 
         analysis = {}
         zscores = []  # Track individual zscores for mean calculation
+        population_stats = self.get_baseline()
 
         for i, metric_name in enumerate(self.device_metrics):
-            mean_val, std_dev = self.get_population_stats(metric_name)
-            if mean_val is not None:
+            mean_val, std_dev = population_stats[metric_name]
+            if mean_val is not None and metrics[i] is not None:
                 zscore = self.calculate_single_zscore(metrics[i], mean_val, std_dev)
                 zscores.append(zscore)  # Add to zscores list
                 analysis[metric_name] = {
@@ -87,6 +99,107 @@ class DeviceZScore:
 
         return analysis
 
+    def get_fleet_metrics(self):
+        """Fetch id, name and current metrics for every device in one query"""
+        with read_connection() as conn:
+            return conn.execute(f'''
+                SELECT id, name, {', '.join(self.device_metrics)}
+                FROM devices
+            ''').fetchall()
+
+    def compute_fleet_stats(self, values):
+        """
+        Compute population mean and sample standard deviation for every metric column.
+
+        :param values: N x K float array with NaN for missing values.
+        :return: Tuple (means, stds, counts); means is NaN where a column has no values.
+        """
+        present = ~np.isnan(values)
+        counts = present.sum(axis=0)
+        filled = np.where(present, values, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = filled.sum(axis=0) / counts
+            deviations = np.where(present, values - means, 0.0)
+            stds = np.sqrt((deviations ** 2).sum(axis=0) / (counts - 1))
+        stds = np.where(counts > 1, stds, 0.0)
+        return means, stds, counts
+
+    def calculate_zscores(self, values, means, stds):
+        """Vectorized calculate_single_zscore; NaN inputs stay NaN"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            zscores = (values - means) / stds
+        return np.where(stds == 0, np.where(np.isnan(values), np.nan, 0.0), zscores)
+
+    def get_statuses_from_zscores(self, zscores):
+        """Vectorized get_status_from_zscore"""
+        abs_zscores = np.abs(zscores)
+        return np.select(
+            [abs_zscores <= bound for bound, _ in ZSCORE_STATUS_BOUNDS],
+            [status for _, status in ZSCORE_STATUS_BOUNDS],
+            'extreme'
+        )
+
+    def analyze_fleet(self):
+        """
+        Analyze every device with one table scan.
+
+        Population statistics for all metrics are computed in a single pass
+        and z-scores, statuses and mean z-scores are computed as array
+        operations. Devices with a NULL metric get no entry for that metric.
+
+        :return: List of (device_id, device_name, analysis) where analysis has
+            the same shape as analyze_device.
+        """
+        rows = self.get_fleet_metrics()
+        if not rows:
+            return []
+
+        values = np.array(
+            [[np.nan if v is None else v for v in row[2:]] for row in rows],
+            dtype=float
+        ).reshape(len(rows), len(self.device_metrics))
+        means, stds, counts = self.compute_fleet_stats(values)
+        zscores = self.calculate_zscores(values, means, stds)
+        statuses = self.get_statuses_from_zscores(zscores)
+
+        # Mean Z-score over the metrics each device actually has
+        has_zscore = ~np.isnan(zscores)
+        zscore_counts = has_zscore.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_zscores = np.where(has_zscore, zscores, 0.0).sum(axis=1) / zscore_counts
+        mean_statuses = self.get_statuses_from_zscores(mean_zscores)
+
+        means_list = [None if count == 0 else float(m) for m, count in zip(means, counts)]
+        stds_list = stds.tolist()
+        zscores_list = zscores.tolist()
+        statuses_list = statuses.tolist()
+
+        results = []
+        for row_index, row in enumerate(rows):
+            analysis = {}
+            component_scores = []
+            for i, metric_name in enumerate(self.device_metrics):
+                if means_list[i] is None or not has_zscore[row_index, i]:
+                    continue
+                zscore = zscores_list[row_index][i]
+                component_scores.append(zscore)
+                analysis[metric_name] = {
+                    'current_value': row[2 + i],
+                    'population_mean': means_list[i],
+                    'population_std': stds_list[i],
+                    'zscore': zscore,
+                    'status': statuses_list[row_index][i]
+                }
+            if component_scores:
+                analysis['zscore_mean'] = {
+                    'zscore': float(mean_zscores[row_index]),
+                    'status': str(mean_statuses[row_index]),
+                    'component_scores': component_scores,
+                    'metric_count': len(component_scores)
+                }
+            results.append((row[0], row[1], analysis))
+        return results
+
     def get_status_from_zscore(self, zscore):
         """Determine status based on Z-score magnitude"""
         abs_zscore = abs(zscore)
@@ -101,91 +214,263 @@ class DeviceZScore:
 
     def get_anomalous_devices(self, threshold=2.0):
         """Find all devices with metrics beyond the threshold"""
-        with closing(get_db_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, name FROM devices')
-            devices = cursor.fetchall()
-
-            anomalies = []
-            for device_id, device_name in devices:
-                analysis = self.analyze_device(device_id)
-                if analysis:
-                    device_anomalies = []
-                    for metric_name, metric_data in analysis.items():
-                        if abs(metric_data['zscore']) > threshold:
-                            device_anomalies.append({
-                                'metric': metric_name,
-                                'value': metric_data['current_value'],
-                                'zscore': metric_data['zscore'],
-                                'status': metric_data['status']
-                            })
-                    
-                    if device_anomalies:
-                        anomalies.append({
-                            'device_id': device_id,
-                            'device_name': device_name,
-                            'anomalies': device_anomalies
-                        })
-
-            return anomalies
+        anomalies = []
+        for device_id, device_name, analysis in self.analyze_fleet():
+            device_anomalies = []
+            for metric_name in self.device_metrics:
+                metric_data = analysis.get(metric_name)
+                if metric_data and abs(metric_data['zscore']) > threshold:
+                    device_anomalies.append({
+                        'metric': metric_name,
+                        'value': metric_data['current_value'],
+                        'zscore': metric_data['zscore'],
+                        'status': metric_data['status']
+                    })
+            
+            if device_anomalies:
+                anomalies.append({
+                    'device_id': device_id,
+                    'device_name': device_name,
+                    'anomalies': device_anomalies
+                })
+
+        return anomalies
 
     def get_metric_rankings(self):
         """Rank all devices by their Z-scores for each metric"""
         rankings = {metric: [] for metric in self.device_metrics}
-        
-        with closing(get_db_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, name FROM devices')
-            devices = cursor.fetchall()
-
-            for device_id, device_name in devices:
-                analysis = self.analyze_device(device_id)
-                if analysis:
-                    for metric_name, metric_data in analysis.items():
-                        rankings[metric_name].append({
-                            'device_id': device_id,
-                            'device_name': device_name,
-                            'value': metric_data['current_value'],
-                            'zscore': metric_data['zscore'],
-                            'status': metric_data['status']
-                        })
-
-            # Sort each metric's rankings by absolute Z-score
-            for metric in rankings:
-                rankings[metric].sort(key=lambda x: abs(x['zscore']), reverse=True)
-
-            return rankings
-
-    def get_device_history(self, device_id, limit=100):
-        """Get historical Z-scores for a device"""
-        with closing(get_db_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT timestamp, cpu_usage, memory_usage, disk_usage, vulnerability_score
+
+        for device_id, device_name, analysis in self.analyze_fleet():
+            for metric_name in self.device_metrics:
+                metric_data = analysis.get(metric_name)
+                if metric_data:
+                    rankings[metric_name].append({
+                        'device_id': device_id,
+                        'device_name': device_name,
+                        'value': metric_data['current_value'],
+                        'zscore': metric_data['zscore'],
+                        'status': metric_data['status']
+                    })
+
+        # Sort each metric's rankings by absolute Z-score
+        for metric in rankings:
+            rankings[metric].sort(key=lambda x: abs(x['zscore']), reverse=True)
+
+        return rankings
+
+    def _rank_page(self, conn, metric, frontier, limit):
+        """
+        Take the next `limit` devices by |z| for one metric.
+
+        All devices share the same center and scale, so |z| orders devices by
+        distance from the center and the worst offenders always sit at the
+        two ends of the metric's value index. Both ends are read in index
+        order from the frontiers of the previous page and merged; nothing
+        between the frontiers is read.
+
+        :return: Tuple (entries, frontier); frontier is None once every device is ranked.
+        """
+        center, scale = frontier['center'], frontier['scale']
+        low, high = frontier['low'], frontier['high']
+        high_rows = conn.execute(f'''
+            SELECT id, name, {metric} FROM devices
+            WHERE {metric} IS NOT NULL {'AND (' + metric + ', id) < (?, ?)' if high else ''}
+            ORDER BY {metric} DESC, id DESC
+            LIMIT ?
+        ''', (*(high or ()), limit)).fetchall()
+        low_rows = conn.execute(f'''
+            SELECT id, name, {metric} FROM devices
+            WHERE {metric} IS NOT NULL {'AND (' + metric + ', id) > (?, ?)' if low else ''}
+            ORDER BY {metric} ASC, id ASC
+            LIMIT ?
+        ''', (*(low or ()), limit)).fetchall()
+
+        entries = []
+        high_index = low_index = 0
+        while len(entries) < limit:
+            top = high_rows[high_index] if high_index < len(high_rows) else None
+            bottom = low_rows[low_index] if low_index < len(low_rows) else None
+            # Rows at or past the other end's frontier were already taken from that end
+            if top is not None and low is not None and (top[2], top[0]) <= tuple(low):
+                top = None
+            if bottom is not None and high is not None and (bottom[2], bottom[0]) >= tuple(high):
+                bottom = None
+            if top is None and bottom is None:
+                break
+            if bottom is None or (top is not None and abs(top[2] - center) >= abs(bottom[2] - center)):
+                row, high, high_index = top, [top[2], top[0]], high_index + 1
+            else:
+                row, low, low_index = bottom, [bottom[2], bottom[0]], low_index + 1
+            zscore = self.calculate_single_zscore(row[2], center, scale)
+            entries.append({
+                'device_id': row[0],
+                'device_name': row[1],
+                'value': row[2],
+                'zscore': zscore,
+                'status': self.get_status_from_zscore(zscore)
+            })
+
+        if len(entries) < limit:
+            return entries, None
+        return entries, dict(frontier, low=low, high=high)
+
+    def get_metric_rankings_page(self, limit, cursor=None, metrics=None):
+        """
+        Rank devices by |z| one page at a time.
+
+        The baseline is pinned in the cursor so every page of a walk ranks
+        against the same center and scale.
+
+        :param limit: Devices per metric on this page.
+        :param cursor: Token from the previous page, or None for the first page.
+        :param metrics: Optional subset of device_metrics; ignored with a cursor.
+        :return: Tuple (rankings, next_cursor); next_cursor is None on the last page.
+        """
+        if cursor:
+            state = decode_cursor(cursor)
+            if not set(state) <= set(self.device_metrics):
+                raise ValueError('Invalid cursor')
+        else:
+            baseline = self.get_baseline()
+            state = {
+                m: {'center': baseline[m][0], 'scale': baseline[m][1], 'low': None, 'high': None}
+                for m in self.device_metrics
+                if (metrics is None or m in metrics) and baseline[m][0] is not None
+            }
+
+        rankings = {}
+        next_state = {}
+        with read_connection() as conn:
+            for metric, frontier in state.items():
+                rankings[metric], frontier = self._rank_page(conn, metric, frontier, limit)
+                if frontier:
+                    next_state[metric] = frontier
+        return rankings, encode_cursor(next_state) if next_state else None
+
+    def get_anomalous_devices_page(self, threshold, limit, cursor=None, metrics=None):
+        """
+        Find devices with metrics beyond the threshold, one page at a time.
+
+        |z| > threshold is turned into a value range per metric, so the
+        query only visits out-of-range rows through the metric indexes.
+        Pages follow device id; threshold and baseline are pinned in the cursor.
+
+        :return: Tuple (anomalies, next_cursor); next_cursor is None on the last page.
+        """
+        if cursor:
+            state = decode_cursor(cursor)
+            try:
+                after, threshold, bounds = state['after'], state['threshold'], state['bounds']
+            except KeyError as e:
+                raise ValueError('Invalid cursor') from e
+            if not set(bounds) <= set(self.device_metrics):
+                raise ValueError('Invalid cursor')
+        else:
+            after = 0
+            baseline = self.get_baseline()
+            # A zero scale gives every device a zero Z-score, so it cannot be anomalous
+            bounds = {
+                m: baseline[m]
+                for m in self.device_metrics
+                if (metrics is None or m in metrics) and baseline[m][0] is not None and baseline[m][1]
+            }
+        if not bounds:
+            return [], None
+
+        # One index range search per bound; only out-of-range rows are read
+        ranges = []
+        params = []
+        for metric, (center, scale) in bounds.items():
+            ranges.append(f'SELECT id FROM devices WHERE {metric} < ? AND id > ?')
+            ranges.append(f'SELECT id FROM devices WHERE {metric} > ? AND id > ?')
+            params.extend([center - threshold * scale, after, center + threshold * scale, after])
+        params.append(limit)
+        with read_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT id, name, {', '.join(bounds)} FROM devices
+                WHERE id IN ({' UNION ALL '.join(ranges)})
+                ORDER BY id
+                LIMIT ?
+            ''', params).fetchall()
+
+        anomalies = []
+        for row in rows:
+            device_anomalies = []
+            for i, (metric, (center, scale)) in enumerate(bounds.items()):
+                value = row[2 + i]
+                if value is None:
+                    continue
+                zscore = self.calculate_single_zscore(value, center, scale)
+                if abs(zscore) > threshold:
+                    device_anomalies.append({
+                        'metric': metric,
+                        'value': value,
+                        'zscore': zscore,
+                        'status': self.get_status_from_zscore(zscore)
+                    })
+            if device_anomalies:
+                anomalies.append({
+                    'device_id': row[0],
+                    'device_name': row[1],
+                    'anomalies': device_anomalies
+                })
+
+        if len(rows) < limit:
+            return anomalies, None
+        return anomalies, encode_cursor({'after': rows[-1][0], 'threshold': threshold, 'bounds': bounds})
+
+    def get_device_history(self, device_id, limit=100, metrics=None):
+        """
+        Get historical Z-scores for a device.
+
+        Every sample is scored against the current population baseline, read
+        once, and the whole window is scored as one array operation.
+
+        :param metrics: Optional subset of device_metrics to include.
+        """
+        metric_names = [m for m in self.device_metrics if metrics is None or m in metrics]
+        if not metric_names:
+            return []
+
+        with read_connection() as conn:
+            history = conn.execute(f'''
+                SELECT timestamp, {', '.join(metric_names)}
                 FROM device_metrics_history
                 WHERE device_id = ?
                 ORDER BY timestamp DESC
                 LIMIT ?
-            ''', (device_id, limit))
-            history = cursor.fetchall()
-
-            analyzed_history = []
-            for record in history:
-                timestamp = record[0]
-                metrics = record[1:]
-                analysis = {}
-                for i, metric_name in enumerate(self.device_metrics):
-                    mean_val, std_dev = self.get_population_stats(metric_name)
-                    if mean_val is not None and metrics[i] is not None:
-                        zscore = self.calculate_single_zscore(metrics[i], mean_val, std_dev)
-                        analysis[metric_name] = {
-                            'value': metrics[i],
-                            'zscore': zscore,
-                            'status': self.get_status_from_zscore(zscore)
-                        }
-                analyzed_history.append({
-                    'timestamp': timestamp,
-                    'metrics': analysis
-                })
+            ''', (device_id, limit)).fetchall()
+        if not history:
+            return []
+
+        population_stats = self.get_baseline()
+        baseline = [population_stats[m] for m in metric_names]
+        means = np.array([np.nan if mean_val is None else mean_val for mean_val, _ in baseline])
+        stds = np.array([np.nan if std_dev is None else std_dev for _, std_dev in baseline])
+
+        timestamps = [record[0] for record in history]
+        values = np.array(
+            [record[1:] for record in history], dtype=float
+        ).reshape(len(history), len(metric_names))
+        zscores = self.calculate_zscores(values, means, stds)
+        statuses = self.get_statuses_from_zscores(zscores).tolist()
+        valid = (~np.isnan(zscores)).tolist()
+        zscores = zscores.tolist()
+        values = values.tolist()
+
+        analyzed_history = []
+        for row in range(len(history)):
+            analysis = {}
+            for i, metric_name in enumerate(metric_names):
+                if valid[row][i]:
+                    analysis[metric_name] = {
+                        'value': values[row][i],
+                        'zscore': zscores[row][i],
+                        'status': statuses[row][i]
+                    }
+            analyzed_history.append({
+                'timestamp': timestamps[row],
+                'metrics': analysis
+            })
 
-            return analyzed_history
\ No newline at end of file
+        return analyzed_history
@@ -1,3 +1,5 @@
+import numpy as np
+
 def calculate_ema(current_value, previous_ema, alpha=0.2):
     """
     Calculate the Exponential Moving Average (EMA).
@@ -8,3 +10,16 @@ def calculate_ema(current_value, previous_ema, alpha=0.2):
     :return: Calculated EMA.
     """
     return alpha * current_value + (1 - alpha) * previous_ema
+
+def calculate_ema_batch(current_values, previous_emas, alpha=0.2):
+    """
+    Calculate the EMA for many series at once; matches calculate_ema elementwise.
+
+    :param current_values: Array of current metric values (e.g. N devices x K metrics).
+    :param previous_emas: Array of previous EMA values, broadcastable to current_values.
+    :param alpha: Smoothing factor, scalar or broadcastable array.
+    :return: Array of calculated EMAs.
+    """
+    current_values = np.asarray(current_values, dtype=float)
+    previous_emas = np.asarray(previous_emas, dtype=float)
+    return alpha * current_values + (1 - alpha) * previous_emas
@@ -0,0 +1,146 @@
+# models/ema_state.py
+
+import json
+import os
+import time
+
+from database import read_connection, write_connection, format_timestamp
+from models.ema import calculate_ema
+
+# Smoothing factors tracked for every ingested metric
+EMA_STATE_ALPHAS = tuple(
+    float(alpha) for alpha in os.environ.get('EMA_STATE_ALPHAS', '0.1,0.2').split(',')
+)
+
+
+class EmaState:
+    """
+    Server-side streaming EMA state per device, metric and smoothing factor.
+
+    Every ingested sample is folded into the EMAs of its device at each
+    tracked alpha by the analysis pipeline, and the state is written back to
+    device_ema_state, one JSON document per device, in the same transaction.
+    Clients read the current EMAs instead of sending previous_ema values
+    back with each request.
+    """
+
+    def __init__(self, alphas=EMA_STATE_ALPHAS):
+        self.alphas = alphas
+
+    def load(self, conn, device_ids):
+        """
+        Read the EMA state of `device_ids`.
+
+        :return: Dict (device_id, metric, alpha) -> (ema, samples).
+        """
+        states = {}
+        for device_id, document in conn.execute('''
+            SELECT device_id, state FROM device_ema_state
+            WHERE device_id IN (SELECT value FROM json_each(?))
+        ''', (json.dumps(list(device_ids)),)):
+            for metric, by_alpha in json.loads(document).items():
+                for alpha, (ema, samples) in by_alpha.items():
+                    states[(device_id, metric, float(alpha))] = (ema, samples)
+        return states
+
+    def update(self, states, device_id, values, alphas=None):
+        """
+        Fold one sample into the device's EMAs; the first sample seeds them.
+
+        :param states: Dict from load(), updated in place.
+        :param values: Dict metric -> value; None values are skipped.
+        :param alphas: Smoothing factors to update; None for the tracked ones.
+        :return: Dict (metric, alpha) -> updated EMA.
+        """
+        emas = {}
+        for metric, value in values.items():
+            if value is None:
+                continue
+            for alpha in alphas or self.alphas:
+                key = (device_id, metric, alpha)
+                previous = states.get(key)
+                if previous is None:
+                    ema, samples = value, 1
+                else:
+                    ema, samples = calculate_ema(value, previous[0], alpha), previous[1] + 1
+                states[key] = (ema, samples)
+                emas[(metric, alpha)] = ema
+        return emas
+
+    def save(self, conn, states, updated_at):
+        """
+        Write EMA state back inside the caller's transaction.
+
+        :param states: Dict from load() after update(); every state of a
+            written device must be present, as its row is replaced.
+        :param updated_at: Dict device_id -> epoch seconds of its newest sample;
+            only these devices are written.
+        """
+        documents = {}
+        for (device_id, metric, alpha), state in states.items():
+            if device_id in updated_at:
+                documents.setdefault(device_id, {}).setdefault(metric, {})[repr(float(alpha))] = state
+        conn.executemany('''
+            INSERT OR REPLACE INTO device_ema_state (device_id, state, updated_at)
+            VALUES (?, ?, ?)
+        ''', [
+            (device_id, json.dumps(document), format_timestamp(updated_at[device_id]))
+            for device_id, document in documents.items()
+        ])
+
+    def observe(self, device_id, values, alpha, seeds=None):
+        """
+        Fold one set of values of a device into its EMAs at `alpha` and persist them.
+
+        :param seeds: Optional dict metric -> EMA used when the server has no
+            state for that metric yet.
+        :return: Dict metric -> updated EMA.
+        """
+        with write_connection() as conn:
+            states = self.load(conn, [device_id])
+            for metric, seed in (seeds or {}).items():
+                if seed is not None and (device_id, metric, alpha) not in states:
+                    states[(device_id, metric, alpha)] = (seed, 1)
+            emas = self.update(states, device_id, values, [alpha])
+            self.save(conn, states, {device_id: time.time()})
+        return {metric: ema for (metric, _), ema in emas.items()}
+
+    def get_emas(self, device_ids, metrics=None, alphas=None):
+        """
+        Read the current EMAs of many devices in one query.
+
+        :param metrics: Metrics to return; None for every stored metric.
+        :param alphas: Smoothing factors to return; None for every stored one.
+        :return: Dict device_id -> metric -> str(alpha) -> {'ema', 'samples', 'updated_at'}.
+        """
+        with read_connection() as conn:
+            rows = conn.execute('''
+                SELECT device_id, state, updated_at FROM device_ema_state
+                WHERE device_id IN (SELECT value FROM json_each(?))
+                ORDER BY device_id
+            ''', (json.dumps(list(device_ids)),)).fetchall()
+
+        alphas = None if alphas is None else {float(alpha) for alpha in alphas}
+        result = {}
+        for device_id, document, updated_at in rows:
+            device = {}
+            for metric, by_alpha in json.loads(document).items():
+                if metrics is not None and metric not in metrics:
+                    continue
+                selected = {
+                    alpha: {'ema': ema, 'samples': samples, 'updated_at': updated_at}
+                    for alpha, (ema, samples) in by_alpha.items()
+                    if alphas is None or float(alpha) in alphas
+                }
+                if selected:
+                    device[metric] = selected
+            if device:
+                result[device_id] = device
+        return result
+
+    def get_ema(self, device_id, metric, alpha):
+        """Current EMA of one device metric at `alpha`, or None if it has no state."""
+        state = self.get_emas([device_id], [metric], [alpha]).get(device_id)
+        return None if state is None else state[metric][repr(float(alpha))]['ema']
+
+ema_state = EmaState()
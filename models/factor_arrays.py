@@ -0,0 +1,53 @@
+# models/factor_arrays.py
+
+import numpy as np
+from numpy.lib import recfunctions
+
+def factor_names(values):
+    """Return the factor names of a structured array or dictionary of columns, else None."""
+    if isinstance(values, dict):
+        return list(values.keys())
+    if isinstance(values, np.ndarray) and values.dtype.names:
+        return list(values.dtype.names)
+    return None
+
+def factor_matrix(values, keys):
+    """
+    Arrange per-device factor values as an N x K float array in `keys` order.
+
+    :param values: N x K array whose columns follow `keys`, a structured array
+        with one field per key, or a dictionary of per-key 1-D arrays.
+    :param keys: Factor names, in the column order of the result.
+    :return: N x K float array.
+    """
+    keys = list(keys)
+    names = factor_names(values)
+    if names is not None:
+        if set(names) != set(keys):
+            raise ValueError("Factor names must match the weight keys")
+        if isinstance(values, np.ndarray):
+            # A view rather than a copy when every field is already float
+            return recfunctions.structured_to_unstructured(values[keys], dtype=float)
+        return np.column_stack([np.asarray(values[key], dtype=float) for key in keys])
+
+    matrix = np.asarray(values, dtype=float)
+    if matrix.ndim != 2 or matrix.shape[1] != len(keys):
+        raise ValueError(f"Expected an N x {len(keys)} array of factor values")
+    return matrix
+
+def factor_vector(params, keys):
+    """
+    Arrange a per-factor parameter dictionary as a K-vector in `keys` order.
+
+    :param params: Dictionary keyed like `keys`, or a sequence already in `keys` order.
+    :return: K float array.
+    """
+    keys = list(keys)
+    if isinstance(params, dict):
+        if params.keys() != set(keys):
+            raise ValueError("Parameter keys must match the factor keys")
+        return np.array([params[key] for key in keys], dtype=float)
+    vector = np.asarray(params, dtype=float)
+    if vector.shape[-1] != len(keys):
+        raise ValueError(f"Expected {len(keys)} values per factor set")
+    return vector
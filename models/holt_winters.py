@@ -1,5 +1,7 @@
 # models/holt_winters.py
 
+import numpy as np
+
 def holt_winters_forecast(series, alpha, beta, gamma, season_length, forecast_length):
     """
     Perform Holt-Winters Exponential Smoothing forecast.
@@ -61,3 +63,138 @@ def initial_trend(series, season_length):
     for i in range(season_length):
         sum += (series[season_length + i] - series[i]) / season_length
     return sum / season_length
+
+def holt_winters_grid_search(series, alphas, betas, gammas, season_length, forecast_length):
+    """
+    Fit Holt-Winters to many equal-length series over a parameter grid at once.
+
+    Every series is run through every (alpha, beta, gamma) combination in a
+    single pass over time, with the state held in (series x combinations)
+    arrays. Initialization matches holt_winters_forecast, so the returned
+    forecast of a series equals holt_winters_forecast with its best parameters.
+
+    :param series: S x n array of historical data points.
+    :param alphas: Candidate smoothing coefficients for level.
+    :param betas: Candidate smoothing coefficients for trend.
+    :param gammas: Candidate smoothing coefficients for seasonality.
+    :param season_length: Length of the seasonal cycle.
+    :param forecast_length: Number of periods to forecast.
+    :return: Tuple (params S x 3 of the best alpha, beta, gamma,
+        rmse S-vector of their one-step-ahead errors, forecasts S x forecast_length).
+    """
+    series = np.asarray(series, dtype=float)
+    count, n = series.shape
+    if n < season_length * 2:
+        raise ValueError("Time series is too short for Holt-Winters forecasting")
+
+    grid = np.array(np.meshgrid(alphas, betas, gammas, indexing='ij'), dtype=float).reshape(3, -1)
+    alpha, beta, gamma = grid
+
+    # Vectorized initial_seasonal_components and initial_trend
+    n_seasons = n // season_length
+    seasons = series[:, :n_seasons * season_length].reshape(count, n_seasons, season_length)
+    initial_seasonals = (seasons - seasons.mean(axis=2, keepdims=True)).mean(axis=1)
+    trend_init = ((series[:, season_length:2 * season_length] - series[:, :season_length])
+                  / season_length).sum(axis=1) / season_length
+
+    shape = (count, grid.shape[1])
+    smooth = np.broadcast_to(series[:, :1], shape).copy()
+    trend = np.broadcast_to(trend_init[:, None], shape).copy()
+    seasonals = np.broadcast_to(initial_seasonals[:, None, :], shape + (season_length,)).copy()
+    squared_error = np.zeros(shape)
+
+    for i in range(n):
+        k = i % season_length
+        val = series[:, i:i + 1]
+        seasonal = seasonals[:, :, k]
+        squared_error += (val - (smooth + trend + seasonal)) ** 2
+        last_smooth = smooth
+        smooth = alpha * (val - seasonal) + (1 - alpha) * (smooth + trend)
+        trend = beta * (smooth - last_smooth) + (1 - beta) * trend
+        seasonals[:, :, k] = gamma * (val - smooth) + (1 - gamma) * seasonal
+
+    best = squared_error.argmin(axis=1)
+    rows = np.arange(count)
+    steps = np.arange(1, forecast_length + 1)
+    forecasts = (
+        smooth[rows, best][:, None]
+        + steps * trend[rows, best][:, None]
+        + seasonals[rows, best][:, (n + steps - 1) % season_length]
+    )
+    rmse = np.sqrt(squared_error[rows, best] / n)
+    return grid[:, best].T, rmse, forecasts
+
+class HoltWintersState:
+    """
+    Incremental additive Holt-Winters state of one series.
+
+    The first 2 * season_length values are buffered; the seasonal components
+    and trend are then initialized from them exactly as in
+    holt_winters_forecast, and every later value updates the level, trend and
+    one seasonal component in constant time. Forecasts never replay history.
+    """
+
+    def __init__(self, season_length, count=0, level=None, trend=None, seasonals=None, warmup=None):
+        self.season_length = season_length
+        self.count = count
+        self.level = level
+        self.trend = trend
+        self.seasonals = seasonals
+        self.warmup = [] if warmup is None and seasonals is None else warmup
+
+    @property
+    def ready(self):
+        return self.seasonals is not None
+
+    def update(self, value, alpha, beta, gamma):
+        """Fold the next value of the series into the state."""
+        if not self.ready:
+            self.warmup.append(value)
+            if len(self.warmup) == 2 * self.season_length:
+                series, self.warmup = self.warmup, None
+                self.seasonals = initial_seasonal_components(series, self.season_length)
+                self.trend = initial_trend(series, self.season_length)
+                self.level = series[0]
+                for buffered in series:
+                    self._step(buffered, alpha, beta, gamma)
+            return
+
+        self._step(value, alpha, beta, gamma)
+
+    def _step(self, value, alpha, beta, gamma):
+        i = self.count % self.season_length
+        last_level = self.level
+        self.level = alpha * (value - self.seasonals[i]) + (1 - alpha) * (self.level + self.trend)
+        self.trend = beta * (self.level - last_level) + (1 - beta) * self.trend
+        self.seasonals[i] = gamma * (value - self.level) + (1 - gamma) * self.seasonals[i]
+        self.count += 1
+
+    def forecast(self, forecast_length):
+        """
+        Forecast the next `forecast_length` values.
+
+        :return: List of forecasts, or None while the state is warming up.
+        """
+        if not self.ready:
+            return None
+        return [
+            self.level + m * self.trend + self.seasonals[(self.count + m - 1) % self.season_length]
+            for m in range(1, forecast_length + 1)
+        ]
+
+    def to_bytes(self):
+        """
+        Pack the state as float64 values: season length, count, ready flag,
+        level and trend, followed by the seasonals or the buffered values.
+        """
+        values = self.seasonals if self.ready else self.warmup
+        header = [self.season_length, self.count, float(self.ready), self.level or 0.0, self.trend or 0.0]
+        return np.array(header + values, dtype=np.float64).tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Unpack a state written by to_bytes()."""
+        season_length, count, ready, level, trend, *values = np.frombuffer(blob, dtype=np.float64).tolist()
+        if ready:
+            return cls(int(season_length), int(count), level, trend, values)
+        return cls(int(season_length), int(count), warmup=values)
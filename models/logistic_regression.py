@@ -2,22 +2,44 @@
 
 from sklearn.linear_model import LogisticRegression
 
-def logistic_regression_threshold_adaptation(X_train, y_train, X_test):
+from models.model_registry import model_registry
+
+# Registry feature set of the threshold adaptation models
+THRESHOLD_FEATURE_SET = 'threshold_adaptation'
+
+def logistic_regression_threshold_adaptation(X_train, y_train, X_test, feature_set=THRESHOLD_FEATURE_SET):
     """
     Fit a logistic regression model and predict probabilities for threshold adaptation.
 
+    The fitted model is kept in the model registry; it is only refit when the
+    training data differs from the data of the registered model.
+
     :param X_train: Training feature matrix (e.g., past event data).
     :param y_train: Training labels (e.g., 0 for false positive, 1 for actual vulnerability).
     :param X_test: Test feature matrix (current data for prediction).
+    :param feature_set: Registry key of the model.
     :return: Predicted probabilities for the positive class.
     """
-    # Initialize the logistic regression model
-    model = LogisticRegression(solver='liblinear')  # 'liblinear' is good for small datasets
-
-    # Fit the model with training data
-    model.fit(X_train, y_train)
+    # 'liblinear' is good for small datasets
+    entry = model_registry.fit(feature_set, X_train, y_train, lambda: LogisticRegression(solver='liblinear'))
 
     # Predict probabilities on the test data
-    probabilities = model.predict_proba(X_test)[:, 1]  # Probability of class '1'
+    return entry['estimator'].predict_proba(X_test)[:, 1]  # Probability of class '1'
+
+def incremental_threshold_adaptation(X_new, y_new, X_test, feature_set=THRESHOLD_FEATURE_SET):
+    """
+    Update the threshold adaptation model with newly labeled events and predict probabilities.
+
+    Only the new events are trained on, with a logistic-loss SGD classifier,
+    so the cost does not grow with the labeled history. After a batch fit of
+    the same feature set, the classifier continues from the fitted model.
 
-    return probabilities
+    :param X_new: Feature matrix of the newly labeled events; may be empty.
+    :param y_new: Labels of the new events.
+    :param X_test: Test feature matrix (current data for prediction).
+    :param feature_set: Registry key of the model.
+    :return: Predicted probabilities for the positive class.
+    """
+    if len(y_new):
+        model_registry.partial_fit(feature_set, X_new, y_new)
+    return model_registry.predict_proba(feature_set, X_test)
@@ -0,0 +1,250 @@
+# models/model_registry.py
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+from database import read_connection, write_connection, format_timestamp
+
+# Fitted estimators kept unpickled in memory, least recently used first out
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', 32))
+# Registered versions kept per feature set; older ones are deleted
+MODEL_REGISTRY_VERSIONS = int(os.environ.get('MODEL_REGISTRY_VERSIONS', 10))
+
+
+def training_fingerprint(X, y):
+    """Hash of a training set, used to skip refits on unchanged data."""
+    digest = hashlib.sha1()
+    for array in (X, y):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def new_incremental_classifier():
+    """Logistic-loss SGD classifier that supports partial_fit."""
+    return SGDClassifier(loss='log_loss', alpha=1e-4, random_state=0)
+
+
+def warm_started_classifier(estimator, samples_seen):
+    """
+    Incremental classifier starting from a fitted linear classifier's coefficients.
+
+    The constant step of 1/samples_seen weighs each new event about as much
+    as one of the events the coefficients were fitted on, so a few new
+    events refine the model rather than replace it.
+    """
+    classifier = SGDClassifier(loss='log_loss', alpha=1e-4, learning_rate='constant',
+                               eta0=1.0 / max(samples_seen, 1), random_state=0)
+    # partial_fit continues from fitted coefficients it finds on the estimator
+    classifier.classes_ = np.array(estimator.classes_)
+    classifier.coef_ = np.array(estimator.coef_, dtype=np.float64)
+    classifier.intercept_ = np.array(estimator.intercept_, dtype=np.float64)
+    classifier.n_features_in_ = classifier.coef_.shape[1]
+    return classifier
+
+
+class ModelRegistry:
+    """
+    Registry of fitted models persisted in SQLite, keyed by feature set and version.
+
+    Estimators are pickled into model_registry and served from an in-process
+    LRU cache, so predictions never refit. fit() registers a new version only
+    when the training data changed; partial_fit() folds newly labeled events
+    into the latest version in place, so its cost grows with the new events
+    rather than with the whole labeled history. Only the newest `keep`
+    versions of a feature set are kept.
+    """
+
+    def __init__(self, cache_size=MODEL_CACHE_SIZE, keep=MODEL_REGISTRY_VERSIONS):
+        self.cache_size = cache_size
+        self.keep = keep
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _remember(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def latest_version(self, feature_set):
+        """Return the highest registered version of a feature set, or None."""
+        with read_connection() as conn:
+            row = conn.execute('''
+                SELECT MAX(version) FROM model_registry WHERE feature_set = ?
+            ''', (feature_set,)).fetchone()
+        return row[0]
+
+    def find_version(self, feature_set, training_hash):
+        """Return the newest version of a feature set fitted on the given data, or None."""
+        with read_connection() as conn:
+            row = conn.execute('''
+                SELECT MAX(version) FROM model_registry
+                WHERE feature_set = ? AND training_hash = ?
+            ''', (feature_set, training_hash)).fetchone()
+        return row[0]
+
+    def get(self, feature_set, version=None):
+        """
+        Return the registry entry of a model, loading it on a cache miss.
+
+        A cached entry is reloaded when another process has updated the
+        stored model since it was cached.
+
+        :param version: Model version; None for the latest.
+        :return: Dict with 'estimator', 'version', 'training_hash' and
+            'samples_seen', or None if nothing is registered.
+        """
+        with self._lock:
+            with read_connection() as conn:
+                row = conn.execute('''
+                    SELECT version, samples_seen FROM model_registry
+                    WHERE feature_set = ? AND (? IS NULL OR version = ?)
+                    ORDER BY version DESC
+                    LIMIT 1
+                ''', (feature_set, version, version)).fetchone()
+                if row is None:
+                    return None
+                key = (feature_set, row['version'])
+                entry = self._cache.get(key)
+                if entry is not None and entry['samples_seen'] == row['samples_seen']:
+                    self._cache.move_to_end(key)
+                    return entry
+
+                row = conn.execute('''
+                    SELECT version, model, training_hash, samples_seen FROM model_registry
+                    WHERE feature_set = ? AND version = ?
+                ''', key).fetchone()
+            entry = {
+                'estimator': pickle.loads(row['model']),
+                'version': row['version'],
+                'training_hash': row['training_hash'],
+                'samples_seen': row['samples_seen']
+            }
+            self._remember(key, entry)
+            return entry
+
+    def _save(self, feature_set, entry, created):
+        now = format_timestamp(time.time())
+        with write_connection() as conn:
+            if created:
+                conn.execute('''
+                    INSERT INTO model_registry (
+                        feature_set, version, estimator, model, training_hash,
+                        samples_seen, created_at, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (feature_set, entry['version'], type(entry['estimator']).__name__,
+                      pickle.dumps(entry['estimator']), entry['training_hash'],
+                      entry['samples_seen'], now, now))
+                conn.execute('''
+                    DELETE FROM model_registry WHERE feature_set = ? AND version <= ?
+                ''', (feature_set, entry['version'] - self.keep))
+            else:
+                conn.execute('''
+                    UPDATE model_registry
+                    SET model = ?, samples_seen = ?, updated_at = ?
+                    WHERE feature_set = ? AND version = ?
+                ''', (pickle.dumps(entry['estimator']), entry['samples_seen'], now,
+                      feature_set, entry['version']))
+        if created:
+            for key in [key for key in self._cache
+                        if key[0] == feature_set and key[1] <= entry['version'] - self.keep]:
+                del self._cache[key]
+        self._remember((feature_set, entry['version']), entry)
+
+    def register(self, feature_set, estimator, training_hash=None, samples_seen=0):
+        """Persist a fitted estimator as the next version of a feature set."""
+        with self._lock:
+            latest = self.latest_version(feature_set)
+            entry = {
+                'estimator': estimator,
+                'version': 1 if latest is None else latest + 1,
+                'training_hash': training_hash,
+                'samples_seen': samples_seen
+            }
+            self._save(feature_set, entry, created=True)
+            return entry
+
+    def fit(self, feature_set, X, y, estimator_factory):
+        """
+        Return a model of `feature_set` fitted on (X, y), fitting only if needed.
+
+        Any kept version fitted on the same data is reused, not only the latest.
+
+        :param estimator_factory: Callable returning an unfitted estimator.
+        :return: Registry entry of the version fitted on (X, y).
+        """
+        fingerprint = training_fingerprint(X, y)
+        with self._lock:
+            version = self.find_version(feature_set, fingerprint)
+            if version is not None:
+                entry = self.get(feature_set, version)
+                if entry is not None:
+                    return entry
+            estimator = estimator_factory()
+            estimator.fit(X, y)
+            return self.register(feature_set, estimator, fingerprint, len(y))
+
+    def partial_fit(self, feature_set, X, y, classes=(0, 1)):
+        """
+        Fold newly labeled events into the latest version of a feature set.
+
+        A latest model that cannot be updated incrementally, such as a batch
+        LogisticRegression, is kept as is: a new version continues from its
+        coefficients. A feature set without a model starts a new classifier.
+
+        :return: Registry entry of the updated version.
+        """
+        with self._lock:
+            entry = self.get(feature_set)
+            created = entry is None or not hasattr(entry['estimator'], 'partial_fit')
+            if entry is None:
+                entry = {
+                    'estimator': new_incremental_classifier(),
+                    'version': 1,
+                    'training_hash': None,
+                    'samples_seen': 0
+                }
+            elif created:
+                entry = {
+                    'estimator': warm_started_classifier(entry['estimator'], entry['samples_seen']),
+                    'version': entry['version'] + 1,
+                    'training_hash': None,
+                    'samples_seen': entry['samples_seen']
+                }
+            entry['estimator'].partial_fit(X, y, classes=np.asarray(classes))
+            entry['samples_seen'] += len(y)
+            self._save(feature_set, entry, created)
+            return entry
+
+    def predict_proba(self, feature_set, X, version=None):
+        """
+        Predict positive-class probabilities with a registered model.
+
+        :raises KeyError: If the feature set has no such model.
+        """
+        with self._lock:
+            entry = self.get(feature_set, version)
+            if entry is None:
+                raise KeyError(f"No model registered for feature set {feature_set!r}")
+            return entry['estimator'].predict_proba(X)[:, 1]
+
+    def versions(self, feature_set):
+        """List the metadata of every version of a feature set, newest first."""
+        with read_connection() as conn:
+            rows = conn.execute('''
+                SELECT version, estimator, training_hash, samples_seen, created_at, updated_at
+                FROM model_registry WHERE feature_set = ?
+                ORDER BY version DESC
+            ''', (feature_set,)).fetchall()
+        return [dict(row) for row in rows]
+
+model_registry = ModelRegistry()
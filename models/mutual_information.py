@@ -1,5 +1,6 @@
 # models/mutual_information.py
 
+import numpy as np
 from sklearn.metrics import mutual_info_score
 
 def calculate_mutual_information(X_events, Y_events):
@@ -15,3 +16,66 @@ def calculate_mutual_information(X_events, Y_events):
 
     mi = mutual_info_score(X_events, Y_events)
     return mi
+
+def discretize_rows(series, bins=16):
+    """
+    Bin each row of `series` into `bins` equal-width bins over its own range.
+
+    :return: N x T array of integer bin labels; constant rows are all 0.
+    """
+    series = np.asarray(series, dtype=float)
+    low = series.min(axis=1, keepdims=True)
+    span = series.max(axis=1, keepdims=True) - low
+    scaled = np.divide(series - low, span, out=np.zeros_like(series), where=span > 0)
+    return np.minimum((scaled * bins).astype(np.int64), bins - 1)
+
+def iter_mutual_information_blocks(labels, bins=16, block_size=64):
+    """
+    Yield the upper-triangle blocks of the mutual information matrix of binned rows.
+
+    Joint histograms of a whole block of row pairs come from one product of
+    one-hot encodings, so the counting runs in BLAS instead of per pair.
+    MI is then H(X) + H(Y) - H(X, Y), with every c * log(c) term looked up
+    from a table indexed by the integer count.
+
+    :param labels: N x T array of bin labels from discretize_rows.
+    :param block_size: Rows per block.
+    :return: Iterator of (row offset, column offset, block) with row offset <= column offset.
+    """
+    labels = np.asarray(labels)
+    n, t = labels.shape
+    # T x N*bins one-hot encoding, column i * bins + b set when row i is in bin b
+    one_hot = np.zeros((t, n * bins), dtype=np.float32)
+    one_hot[np.arange(t)[:, None], np.arange(n) * bins + labels.T] = 1.0
+    counts = np.arange(t + 1, dtype=float)
+    count_log_count = counts * np.log(np.maximum(counts, 1))
+    # Sum of c * log(c) over the bins of each row
+    row_terms = count_log_count[one_hot.sum(axis=0).astype(np.int64)].reshape(n, bins).sum(axis=1)
+
+    for i in range(0, n, block_size):
+        rows = slice(i * bins, min(i + block_size, n) * bins)
+        for j in range(i, n, block_size):
+            cols = slice(j * bins, min(j + block_size, n) * bins)
+            joint = (one_hot[:, rows].T @ one_hot[:, cols]).astype(np.int64)
+            bi, bj = joint.shape[0] // bins, joint.shape[1] // bins
+            joint_terms = count_log_count[joint].reshape(bi, bins, bj, bins).sum(axis=(1, 3))
+            block = np.log(t) + (joint_terms - row_terms[i:i + bi, None] - row_terms[None, j:j + bj]) / t
+            yield i, j, np.maximum(block, 0.0)
+
+def mutual_information_matrix(series, bins=16, block_size=64):
+    """
+    Calculate the histogram-binned mutual information matrix of the rows of `series`.
+
+    Each row is binned with discretize_rows; entry (a, b) equals
+    calculate_mutual_information of the binned rows a and b.
+
+    :param series: N x T array, one aligned series per row.
+    :return: N x N matrix of mutual information scores (nats).
+    """
+    labels = discretize_rows(series, bins)
+    n = len(labels)
+    matrix = np.empty((n, n))
+    for i, j, block in iter_mutual_information_blocks(labels, bins, block_size):
+        matrix[i:i + block.shape[0], j:j + block.shape[1]] = block
+        matrix[j:j + block.shape[1], i:i + block.shape[0]] = block.T
+    return matrix
@@ -27,3 +27,43 @@ def calculate_pearson_correlation(X, Y):
     r = numerator / denominator
 
     return r
+
+def standardize_rows(series):
+    """
+    Center each row and scale it to unit norm, so row dot products are Pearson r.
+
+    Rows without variation become zeros, which correlate 0 with everything,
+    as in calculate_pearson_correlation.
+    """
+    series = np.asarray(series, dtype=float)
+    centered = series - series.mean(axis=1, keepdims=True)
+    norms = np.sqrt((centered ** 2).sum(axis=1, keepdims=True))
+    return np.divide(centered, norms, out=np.zeros_like(centered), where=norms > 0)
+
+def iter_correlation_blocks(series, block_size=512):
+    """
+    Yield the upper-triangle blocks of the Pearson correlation matrix of the rows of `series`.
+
+    :param series: N x T array, one aligned series per row.
+    :param block_size: Rows per block; each block is one block_size x block_size product.
+    :return: Iterator of (row offset, column offset, block) with row offset <= column offset.
+    """
+    standardized = standardize_rows(series)
+    for i in range(0, len(standardized), block_size):
+        rows = standardized[i:i + block_size]
+        for j in range(i, len(standardized), block_size):
+            yield i, j, np.clip(rows @ standardized[j:j + block_size].T, -1.0, 1.0)
+
+def pearson_correlation_matrix(series, block_size=512):
+    """
+    Calculate the full Pearson correlation matrix of the rows of `series`.
+
+    :param series: N x T array, one aligned series per row.
+    :return: N x N matrix of correlation coefficients.
+    """
+    n = len(series)
+    matrix = np.empty((n, n))
+    for i, j, block in iter_correlation_blocks(series, block_size):
+        matrix[i:i + block.shape[0], j:j + block.shape[1]] = block
+        matrix[j:j + block.shape[1], i:i + block.shape[0]] = block.T
+    return matrix
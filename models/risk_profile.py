@@ -0,0 +1,206 @@
+# models/risk_profile.py
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from database import DEVICE_METRICS, read_connection
+from models.factor_arrays import factor_matrix
+
+# Compiled profiles kept in memory, least recently used first out
+RISK_PROFILE_CACHE_SIZE = int(os.environ.get('RISK_PROFILE_CACHE_SIZE', 128))
+
+# Scoring methods of RiskProfile.score
+RISK_SCORE_METHODS = ('sigmoid', 'weighted')
+
+_SETTING_PAIR = re.compile(r'^\s*([A-Za-z_][\w.]*)\s*[:=]\s*([-+0-9.eE]+)\s*$')
+
+
+def parse_control_settings(settings):
+    """
+    Parse cip_controls.settings text into weights and sigmoid parameters.
+
+    Accepts JSON, either {"weights": {...}, "k": 10, "x0": 0.5} or a flat
+    object of weights, or free text of `name=value` / `name: value` pairs
+    separated by commas, semicolons or newlines, where `k` and `x0` set the
+    sigmoid parameters.
+
+    :return: Dict with 'weights' (name -> float), 'k' and 'x0'.
+    :raises ValueError: If the settings hold no weights.
+    """
+    try:
+        parsed = json.loads(settings)
+    except (TypeError, ValueError):
+        parsed = {}
+        for part in re.split(r'[,;\n]', settings or ''):
+            if not part.strip():
+                continue
+            match = _SETTING_PAIR.match(part)
+            if match is None:
+                raise ValueError(f"Unparseable setting: {part.strip()!r}")
+            parsed[match.group(1)] = float(match.group(2))
+    if not isinstance(parsed, dict):
+        raise ValueError("Control settings must be an object of weights")
+
+    if isinstance(parsed.get('weights'), dict):
+        weights = parsed['weights']
+    else:
+        weights = {key: value for key, value in parsed.items() if key not in ('k', 'x0')}
+    if not weights:
+        raise ValueError("Control settings define no weights")
+    return {
+        'weights': {key: float(value) for key, value in weights.items()},
+        'k': float(parsed.get('k', 10)),
+        'x0': float(parsed.get('x0', 0.5))
+    }
+
+
+def load_device_factors(conn, keys, project_id=None, id_range=None):
+    """
+    Read the current metrics of devices as an N x K factor matrix.
+
+    Values are normalized from 0-100 to 0-1 as in the analysis pipeline;
+    missing values count as 0.
+
+    :param keys: Device metrics, in the column order of the result.
+    :param id_range: Optional inclusive (first, last) device id range.
+    :return: Tuple (device id array, N x K array).
+    :raises ValueError: If a key is not a device metric.
+    """
+    unknown = [key for key in keys if key not in DEVICE_METRICS]
+    if unknown:
+        raise ValueError(f"Profile weights unknown device metrics: {', '.join(unknown)}")
+
+    filters, params = [], []
+    if project_id is not None:
+        filters.append('project_id = ?')
+        params.append(project_id)
+    if id_range is not None:
+        filters.append('id BETWEEN ? AND ?')
+        params.extend(id_range)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    columns = ', '.join(f'COALESCE({key}, 0)' for key in keys)
+    rows = conn.execute(f'SELECT id, {columns} FROM devices {where} ORDER BY id', params).fetchall()
+    data = np.array([tuple(row) for row in rows], dtype=float).reshape(-1, len(keys) + 1)
+    return data[:, 0].astype(np.int64), np.clip(data[:, 1:] / 100.0, 0.0, 1.0)
+
+
+class RiskProfile:
+    """
+    A CIP control's settings compiled into a fixed-order weight vector.
+
+    Scores match sigmoid_modified and calculate_weighted_score /
+    calculate_composite_risk_score with the control's weights, computed as
+    one matrix-vector product for N devices.
+    """
+
+    def __init__(self, control_id, version, weights, k=10, x0=0.5):
+        self.control_id = control_id
+        self.version = version
+        self.keys = tuple(weights.keys())
+        self.weights = np.array([weights[key] for key in self.keys], dtype=float)
+        self.weights.flags.writeable = False
+        self.k = k
+        self.x0 = x0
+
+    def weighted_score(self, values):
+        """Weighted (composite risk) score of N devices; `values` as accepted by factor_matrix."""
+        return factor_matrix(values, self.keys) @ self.weights
+
+    def sigmoid(self, values):
+        """Modified sigmoid risk of N devices; `values` as accepted by factor_matrix."""
+        weighted_sum = (factor_matrix(values, self.keys) - self.x0) @ self.weights
+        with np.errstate(over='ignore'):
+            return 1 / (1 + np.exp(-self.k * weighted_sum))
+
+    def score(self, values, method='sigmoid'):
+        """Score N devices with one of RISK_SCORE_METHODS."""
+        if method == 'sigmoid':
+            return self.sigmoid(values)
+        if method == 'weighted':
+            return self.weighted_score(values)
+        raise ValueError(f"Unknown risk score method: {method}")
+
+    def to_dict(self):
+        return {
+            'control_id': self.control_id,
+            'version': self.version,
+            'weights': dict(zip(self.keys, self.weights.tolist())),
+            'k': self.k,
+            'x0': self.x0
+        }
+
+
+class RiskProfileCache:
+    """
+    Compiled risk profiles keyed by control id and version.
+
+    A lookup reads only the control's version; settings are parsed again
+    only when update_cip_control has bumped it, or after invalidate().
+    """
+
+    def __init__(self, cache_size=RISK_PROFILE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, control_id):
+        """
+        Return the compiled profile of a control, or None if it does not exist.
+
+        :raises ValueError: If the control's settings cannot be compiled.
+        """
+        with read_connection() as conn:
+            row = conn.execute('SELECT version FROM cip_controls WHERE id = ?', (control_id,)).fetchone()
+            if row is None:
+                return None
+            version = row[0]
+            with self._lock:
+                profile = self._profiles.get(control_id)
+                if profile is not None and profile.version == version:
+                    self._profiles.move_to_end(control_id)
+                    return profile
+            row = conn.execute('''
+                SELECT settings, version FROM cip_controls WHERE id = ?
+            ''', (control_id,)).fetchone()
+
+        settings = parse_control_settings(row['settings'])
+        profile = RiskProfile(control_id, row['version'], settings['weights'], settings['k'], settings['x0'])
+        with self._lock:
+            self._profiles[control_id] = profile
+            self._profiles.move_to_end(control_id)
+            while len(self._profiles) > self.cache_size:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def invalidate(self, control_id=None):
+        """Drop the compiled profile of a control, or of every control."""
+        with self._lock:
+            if control_id is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(control_id, None)
+
+    def score_fleet(self, control_id, method='sigmoid', project_id=None):
+        """
+        Score every device's current metrics against a control's profile.
+
+        The profile's weight keys must be device metrics; values are
+        normalized from 0-100 to 0-1 as in the analysis pipeline.
+
+        :return: Tuple (profile, device id array, score array), or None if
+            the control does not exist.
+        :raises ValueError: If the profile weights a non-device metric.
+        """
+        profile = self.get(control_id)
+        if profile is None:
+            return None
+        with read_connection() as conn:
+            device_ids, values = load_device_factors(conn, profile.keys, project_id)
+        return profile, device_ids, profile.score(values, method)
+
+risk_profiles = RiskProfileCache()
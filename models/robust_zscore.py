@@ -0,0 +1,188 @@
+# models/robust_zscore.py
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from database import (
+    FLEET_SCOPE, SKETCH_RANGE, SKETCH_BINS, get_population_histograms
+)
+from models.device_zscore import DeviceZScore
+
+# Seconds a loaded set of sketches is served before it is re-read from SQLite
+SKETCH_REFRESH_SECONDS = float(os.environ.get('ROBUST_SKETCH_REFRESH_SECONDS', 1.0))
+
+# Scales the MAD to the standard deviation of normally distributed data, so
+# robust Z-scores share the thresholds of get_status_from_zscore
+MAD_SCALE = 1.4826
+
+
+class QuantileSketch:
+    """
+    Fixed-bin histogram sketch of one metric.
+
+    Bins split SKETCH_RANGE evenly, so sketches over the same range merge by
+    adding counts and values can be removed as well as added. Quantiles are
+    interpolated within a bin and are accurate to the bin width.
+    """
+
+    def __init__(self, counts=None, value_range=SKETCH_RANGE, bins=SKETCH_BINS):
+        self.low, self.high = value_range
+        self.bins = bins
+        self.width = (self.high - self.low) / bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        for bin_index, count in (counts or {}).items():
+            self.counts[bin_index] += count
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def add(self, value, count=1):
+        """Count `value` (negative `count` removes it)."""
+        scale = self.bins / (self.high - self.low)
+        bin_index = min(max(int((value - self.low) * scale), 0), self.bins - 1)
+        self.counts[bin_index] += count
+
+    def merge(self, other):
+        """Add the counts of another sketch over the same bins."""
+        if (other.low, other.high, other.bins) != (self.low, self.high, self.bins):
+            raise ValueError("Sketches with different bins cannot be merged")
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        """Value below which a fraction `q` of the counted values fall; None if empty."""
+        total = self.count
+        if total == 0:
+            return None
+        target = q * total
+        cumulative = np.cumsum(self.counts)
+        bin_index = int(np.searchsorted(cumulative, target, side='left'))
+        bin_index = min(bin_index, self.bins - 1)
+        before = cumulative[bin_index] - self.counts[bin_index]
+        fraction = (target - before) / self.counts[bin_index] if self.counts[bin_index] else 0.0
+        return float(self.low + (bin_index + fraction) * self.width)
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mad(self, median=None):
+        """
+        Median absolute deviation from the median, floored at half a bin width.
+
+        Bins are visited in order of distance from the median by walking
+        outwards from the median bin, which sorts the deviations in one pass.
+        """
+        total = self.count
+        if total == 0:
+            return None
+        median = self.median() if median is None else median
+        centers = self.low + (np.arange(self.bins) + 0.5) * self.width
+        right = int(np.searchsorted(centers, median, side='left'))
+        left = right - 1
+        target = total / 2.0
+        seen = 0
+        deviation = 0.0
+        while seen < target:
+            left_distance = median - centers[left] if left >= 0 else np.inf
+            right_distance = centers[right] - median if right < self.bins else np.inf
+            if left_distance <= right_distance:
+                deviation, seen, left = left_distance, seen + self.counts[left], left - 1
+            else:
+                deviation, seen, right = right_distance, seen + self.counts[right], right + 1
+        return max(float(deviation), self.width / 2)
+
+
+class PopulationSketches:
+    """
+    Process-wide cache of the population histograms as quantile sketches.
+
+    population_histograms is the checkpoint: triggers on the devices table
+    keep it current for every writer and process. Sketches are rebuilt from
+    it at most every SKETCH_REFRESH_SECONDS, and their median and MAD are
+    computed once per refresh so lookups are constant time.
+    """
+
+    def __init__(self, refresh_seconds=SKETCH_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._sketches = {}
+        self._stats = {}
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.refresh_seconds:
+            return
+        sketches = {
+            key: QuantileSketch(counts)
+            for key, counts in get_population_histograms().items()
+        }
+        stats = {}
+        for key, sketch in sketches.items():
+            median = sketch.median()
+            if median is not None:
+                stats[key] = (median, sketch.mad(median), sketch.count)
+        self._sketches, self._stats, self._loaded_at = sketches, stats, now
+
+    def invalidate(self):
+        """Force the next lookup to re-read the histograms."""
+        with self._lock:
+            self._loaded_at = None
+
+    def get_sketch(self, metric, project_id=None):
+        """Return the sketch of `metric` for the fleet or one project, or None."""
+        scope = FLEET_SCOPE if project_id is None else project_id
+        with self._lock:
+            self._refresh()
+            return self._sketches.get((metric, scope))
+
+    def get_stats(self, metric, project_id=None):
+        """
+        Return (median, mad, count) of `metric`.
+
+        :param project_id: Restrict to one project; None for the whole fleet.
+        :return: Tuple, or (None, None, 0) if the metric has no values.
+        """
+        scope = FLEET_SCOPE if project_id is None else project_id
+        with self._lock:
+            self._refresh()
+            return self._stats.get((metric, scope), (None, None, 0))
+
+
+population_sketches = PopulationSketches()
+
+
+class RobustDeviceZScore(DeviceZScore):
+    """
+    Robust Z-scores: (value - median) / (1.4826 * MAD).
+
+    A handful of devices pinned at 100% barely moves the median or the MAD,
+    so the rest of the fleet keeps meaningful scores. Medians and MADs come
+    from the population sketches instead of a scan of every device. Results
+    have the same shape and status classification as DeviceZScore; the
+    population_mean and population_std fields carry the median and the
+    scaled MAD.
+    """
+
+    def get_population_stats(self, metric_name, project_id=None):
+        """Get the median and scaled MAD of a metric from its sketch"""
+        median, mad, _ = population_sketches.get_stats(metric_name, project_id)
+        if median is None:
+            return None, None
+        return median, MAD_SCALE * mad
+
+    def get_baseline(self):
+        """Get the median and scaled MAD of every metric from the sketches"""
+        return {m: self.get_population_stats(m) for m in self.device_metrics}
+
+    def compute_fleet_stats(self, values):
+        """Medians and scaled MADs from the sketches; counts from `values`"""
+        baseline = self.get_baseline()
+        means = np.array([np.nan if baseline[m][0] is None else baseline[m][0] for m in self.device_metrics])
+        stds = np.array([np.nan if baseline[m][1] is None else baseline[m][1] for m in self.device_metrics])
+        counts = (~np.isnan(values)).sum(axis=0)
+        return means, stds, counts
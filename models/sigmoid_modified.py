@@ -2,6 +2,10 @@
 
 import math
 
+import numpy as np
+
+from models.factor_arrays import factor_matrix, factor_vector
+
 def sigmoid_modified(cip_values, weights, k=10, x0=0.5):
     """
     Calculate the modified sigmoid function value incorporating multiple CIP inputs.
@@ -19,3 +23,21 @@ def sigmoid_modified(cip_values, weights, k=10, x0=0.5):
 
     exponent = -k * weighted_sum
     return 1 / (1 + math.exp(exponent))
+
+def sigmoid_modified_batch(cip_values, weights, k=10, x0=0.5):
+    """
+    Calculate sigmoid_modified for N devices at once.
+
+    :param cip_values: N x K array with columns in `weights` key order, a
+        structured array or a dictionary of per-key columns (normalized between 0 and 1).
+    :param weights: Dictionary of weights for each CIP input.
+    :param k: Steepness of the sigmoid curve.
+    :param x0: Inflection point.
+    :return: N-vector of sigmoid values.
+    """
+    keys = list(weights.keys())
+    weight_vector = factor_vector(weights, keys)
+    # (values - x0) @ w without materializing values - x0
+    weighted_sum = factor_matrix(cip_values, keys) @ weight_vector - x0 * weight_vector.sum()
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-k * weighted_sum))
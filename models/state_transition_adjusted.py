@@ -1,5 +1,9 @@
 # models/state_transition_adjusted.py
 
+import numpy as np
+
+from models.factor_arrays import factor_names, factor_matrix
+
 def state_transition_adjusted(current_state, admin_action, external_factors, thresholds):
     """
     Determine the next state based on the current state, admin actions, and multiple external factors.
@@ -22,3 +26,34 @@ def state_transition_adjusted(current_state, admin_action, external_factors, thr
     elif current_state == 'critical' and admin_action == 'mitigated':
         return 'warning'
     return current_state
+
+def state_transition_adjusted_batch(current_states, admin_actions, external_factors, thresholds):
+    """
+    Determine the next state of N devices at once; matches state_transition_adjusted per device.
+
+    :param current_states: N-vector of current states; a fixed-width string
+        array compares much faster than an object array.
+    :param admin_actions: N-vector of admin actions, or one action for every device.
+    :param external_factors: N x K array, structured array or dictionary of
+        per-factor columns; each device's composite risk is its row sum.
+    :param thresholds: Dictionary of thresholds for state transitions.
+    :return: N-vector of new states.
+    """
+    current_states = np.asarray(current_states)
+    admin_actions = np.broadcast_to(np.asarray(admin_actions), current_states.shape)
+    names = factor_names(external_factors)
+    composite_risk = factor_matrix(
+        external_factors, names if names is not None else range(np.shape(external_factors)[1])
+    ).sum(axis=1)
+
+    warning = current_states == 'warning'
+    return np.select(
+        [
+            (current_states == 'normal') & (composite_risk >= thresholds['warning']),
+            warning & (composite_risk >= thresholds['critical']) & (admin_actions == 'none'),
+            warning & (composite_risk < thresholds['warning']),
+            (current_states == 'critical') & (admin_actions == 'mitigated'),
+        ],
+        ['warning', 'critical', 'normal', 'warning'],
+        current_states
+    )
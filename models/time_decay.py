@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 def calculate_time_decay(initial_value, decay_rate, time_elapsed):
     """
     Calculate the time-decayed value of CIP influence.
@@ -10,3 +12,16 @@ def calculate_time_decay(initial_value, decay_rate, time_elapsed):
     :return: Time-decayed value.
     """
     return initial_value * math.exp(-decay_rate * time_elapsed)
+
+def calculate_time_decay_batch(initial_values, decay_rates, time_elapsed):
+    """
+    Calculate time-decayed values for many inputs at once; matches calculate_time_decay elementwise.
+
+    :param initial_values: Array of values to decay.
+    :param decay_rates: Rates of decay, broadcastable to initial_values.
+    :param time_elapsed: Times elapsed, broadcastable to initial_values.
+    :return: Array of time-decayed values.
+    """
+    return np.asarray(initial_values, dtype=float) * np.exp(
+        -np.asarray(decay_rates, dtype=float) * np.asarray(time_elapsed, dtype=float)
+    )
@@ -2,6 +2,10 @@
 
 import math
 
+import numpy as np
+
+from models.factor_arrays import factor_matrix, factor_vector
+
 def calculate_time_decay_multiple(initial_values, decay_rates, time_elapsed):
     """
     Calculate the time-decayed values of multiple CIP influences.
@@ -19,3 +23,18 @@ def calculate_time_decay_multiple(initial_values, decay_rates, time_elapsed):
         decayed_values[key] = initial_values[key] * math.exp(-decay_rates[key] * time_elapsed)
 
     return decayed_values
+
+def calculate_time_decay_multiple_batch(initial_values, decay_rates, time_elapsed):
+    """
+    Calculate calculate_time_decay_multiple for N devices at once.
+
+    :param initial_values: N x K array with columns in `decay_rates` key order,
+        a structured array or a dictionary of per-key columns.
+    :param decay_rates: Dictionary of decay rates for each value.
+    :param time_elapsed: Scalar, or N-vector of times elapsed per device.
+    :return: N x K array of time-decayed values in `decay_rates` key order.
+    """
+    keys = list(decay_rates.keys())
+    values = factor_matrix(initial_values, keys)
+    elapsed = np.asarray(time_elapsed, dtype=float).reshape(-1, 1) if np.ndim(time_elapsed) else time_elapsed
+    return values * np.exp(-factor_vector(decay_rates, keys) * elapsed)
@@ -1,5 +1,9 @@
 # models/user_risk_score.py
 
+import numpy as np
+
+from models.factor_arrays import factor_matrix, factor_vector
+
 def calculate_user_risk_score(user_activities, activity_means, activity_stds, weights):
     """
     Calculate the User Risk Score (URS) for insider threats.
@@ -22,3 +26,26 @@ def calculate_user_risk_score(user_activities, activity_means, activity_stds, we
         urs += weights[key] * abs(z_score)  # Use absolute value to measure deviation in any direction
 
     return urs
+
+def calculate_user_risk_score_batch(user_activities, activity_means, activity_stds, weights):
+    """
+    Calculate User Risk Scores for N users or devices at once.
+
+    :param user_activities: N x K array with columns in `weights` key order, a
+        structured array or a dictionary of per-key columns.
+    :param activity_means: Dictionary of means per activity, or an array
+        broadcastable to N x K in `weights` key order.
+    :param activity_stds: Standard deviations, in the same forms as activity_means.
+    :param weights: Dictionary of weights for each activity metric.
+    :return: N-vector of User Risk Scores.
+    """
+    keys = list(weights.keys())
+    activities = factor_matrix(user_activities, keys)
+    means = factor_vector(activity_means, keys)
+    stds = factor_vector(activity_stds, keys)
+    # |z| weighted by w is |x - mean| weighted by w / |std|; a zero std contributes 0
+    with np.errstate(divide='ignore'):
+        scaled_weights = np.where(stds == 0, 0.0, factor_vector(weights, keys) / np.abs(stds))
+    if scaled_weights.ndim == 1:
+        return np.abs(activities - means) @ scaled_weights
+    return (np.abs(activities - means) * scaled_weights).sum(axis=-1)
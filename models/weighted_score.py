@@ -1,5 +1,7 @@
 # models/weighted_score.py
 
+from models.factor_arrays import factor_matrix, factor_vector
+
 def calculate_weighted_score(alert_factors, weights):
     """
     Calculate the weighted score for alert prioritization.
@@ -14,3 +16,15 @@ def calculate_weighted_score(alert_factors, weights):
     weighted_score = sum(weights[key] * alert_factors[key] for key in alert_factors.keys())
 
     return weighted_score
+
+def calculate_weighted_score_batch(alert_factors, weights):
+    """
+    Calculate weighted scores for N alerts or devices at once.
+
+    :param alert_factors: N x K array with columns in `weights` key order, a
+        structured array or a dictionary of per-key columns (normalized between 0 and 1).
+    :param weights: Dictionary of weights corresponding to each alert factor.
+    :return: N-vector of weighted scores.
+    """
+    keys = list(weights.keys())
+    return factor_matrix(alert_factors, keys) @ factor_vector(weights, keys)
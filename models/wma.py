@@ -1,3 +1,5 @@
+import numpy as np
+
 def calculate_wma(metrics, weights):
     """
     Calculate the Weighted Moving Average (WMA) for a given list of metrics and weights.
@@ -10,3 +12,17 @@ def calculate_wma(metrics, weights):
         raise ValueError("Metrics and weights must be of the same length")
 
     return sum(w * m for w, m in zip(weights, metrics)) / sum(weights)
+
+def calculate_wma_batch(metrics, weights):
+    """
+    Calculate the WMA of many windows at once; matches calculate_wma per row.
+
+    :param metrics: N x W array, one window of metric values per row.
+    :param weights: W weights corresponding to each position in the window.
+    :return: N-vector of Weighted Moving Averages.
+    """
+    metrics = np.asarray(metrics, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    if metrics.shape[-1] != len(weights):
+        raise ValueError("Metrics and weights must be of the same length")
+    return metrics @ weights / weights.sum()
@@ -1,3 +1,5 @@
+import numpy as np
+
 def calculate_zscore(current_value, mean, std_dev):
     """
     Calculate the Z-score for a given value.
@@ -8,3 +10,19 @@ def calculate_zscore(current_value, mean, std_dev):
     :return: Calculated Z-score.
     """
     return (current_value - mean) / std_dev
+
+def calculate_zscore_batch(current_values, means, std_devs):
+    """
+    Calculate Z-scores for many values at once; matches calculate_zscore elementwise.
+
+    A zero standard deviation gives inf or nan where the scalar version
+    raises ZeroDivisionError.
+
+    :param current_values: Array of values (e.g. N devices x K metrics).
+    :param means: Means, broadcastable to current_values (e.g. one per metric).
+    :param std_devs: Standard deviations, broadcastable to current_values.
+    :return: Array of Z-scores.
+    """
+    current_values = np.asarray(current_values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (current_values - np.asarray(means, dtype=float)) / np.asarray(std_devs, dtype=float)
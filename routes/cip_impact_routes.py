@@ -1,11 +1,16 @@
 # routes/cip_impact_routes.py
 
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, request
+from models.decay_engine import decay_engine
 from models.device_zscore import DeviceZScore
 
 cip_impact_bp = Blueprint('cip_impact', __name__)
 zscore_analyzer = DeviceZScore()
 
+# Upper bounds on a decay timeline request
+MAX_DECAY_STEPS = 10000
+MAX_DECAY_CELLS = 1000000
+
 @cip_impact_bp.route('/')
 def index():
     """Render the CIP Impact page."""
@@ -51,4 +56,63 @@ def get_device_zscores(device_id):
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@cip_impact_bp.route('/cip_impact/decay', methods=['POST'])
+def get_decay_curves():
+    """
+    Decay curves of CIP influences over a timeline.
+
+    Body: {"influences": {name: {"value": v, "rate": r}}, "hours": 24,
+    "step_hours": 1, "start_hours": 0}, plus optional "devices":
+    {device_id: {name: value}} to decay per-device initial values instead.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        influences = data.get('influences')
+        if not isinstance(influences, dict) or not influences:
+            return jsonify({'success': False, 'error': 'influences must be a non-empty object'}), 400
+        step = float(data.get('step_hours', 1))
+        hours = float(data.get('hours', 24))
+        start = float(data.get('start_hours', 0))
+        if step <= 0 or hours < 0 or start < 0:
+            return jsonify({'success': False, 'error': 'hours, step_hours and start_hours must be positive'}), 400
+        count = int(hours // step) + 1
+        devices = data.get('devices')
+        rows = len(devices) if isinstance(devices, dict) else 1
+        if count > MAX_DECAY_STEPS or count * len(influences) * rows > MAX_DECAY_CELLS:
+            return jsonify({'success': False, 'error': f'Timeline exceeds {MAX_DECAY_STEPS} steps '
+                                                       f'or {MAX_DECAY_CELLS} values'}), 400
+
+        rates = {name: float(influence['rate']) for name, influence in influences.items()}
+        timestamps = [start + i * step for i in range(count)]
+        if isinstance(devices, dict):
+            device_ids = list(devices)
+            values = {name: [float(devices[d].get(name, 0.0)) for d in device_ids] for name in rates}
+            curves = decay_engine.curves(values, rates, start, step, count)
+            return jsonify({
+                'success': True,
+                'timestamps_hours': timestamps,
+                'devices': {
+                    device_id: {name: curve[i].tolist() for name, curve in curves.items()}
+                    for i, device_id in enumerate(device_ids)
+                }
+            })
+
+        values = {name: float(influence['value']) for name, influence in influences.items()}
+        curves = decay_engine.curves(values, rates, start, step, count)
+        return jsonify({
+            'success': True,
+            'timestamps_hours': timestamps,
+            'curves': {name: curve.tolist() for name, curve in curves.items()}
+        })
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid decay request: {e}'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -1,10 +1,15 @@
+import numpy as np
 from flask import Blueprint, request, jsonify
 from models.sigmoid_modified import sigmoid_modified
 from models.state_transition_adjusted import state_transition_adjusted
-from models.ema import calculate_ema
+from models.ema_state import ema_state
+from models.risk_profile import RISK_SCORE_METHODS, risk_profiles
 from models.zscore import calculate_zscore
-from utils.validation import validate_request_data, format_error
-from database import add_cip_control, update_cip_control, get_cip_control, recalculate_for_all_devices
+from utils.validation import (
+    validate_request_data, format_error, parse_device_id, is_number, is_number_map
+)
+from utils.recalculation_jobs import load_stored_scores, recalculation_jobs
+from database import add_cip_control, update_cip_control, get_cip_control
 
 cip_routes = Blueprint('cip_routes', __name__)
 
@@ -38,20 +43,31 @@ def add_cip_control_route():
     if not is_valid:
         return jsonify(format_error(error_message)), 400
 
-    add_cip_control(data['control_name'], data['settings'])
-    return jsonify(message="CIP control added successfully"), 201
+    control_id = add_cip_control(data['control_name'], data['settings'])
+    return jsonify(message="CIP control added successfully", id=control_id), 201
 
 @cip_routes.route('/controls/<int:control_id>', methods=['PUT'])
 def update_cip_control_route(control_id):
+    """
+    Update a control and queue a fleet-wide recalculation of its risk scores.
+
+    Returns 202 with the recalculation job id; poll /jobs/<job_id> for progress.
+    """
     data = request.json
     required_fields = ['control_name', 'settings']
     is_valid, error_message = validate_request_data(required_fields, data)
     if not is_valid:
         return jsonify(format_error(error_message)), 400
 
-    update_cip_control(control_id, data['control_name'], data['settings'])
-    recalculate_for_all_devices()  # Trigger recalculation for all devices
-    return jsonify(message="CIP control updated successfully and recalculations triggered"), 200
+    if update_cip_control(control_id, data['control_name'], data['settings']) is None:
+        return jsonify(format_error("CIP control not found")), 404
+    risk_profiles.invalidate(control_id)
+    job = recalculation_jobs.submit(control_id)
+    return jsonify(
+        message="CIP control updated successfully and recalculation queued",
+        job_id=job.id,
+        status=job.status
+    ), 202
 
 @cip_routes.route('/controls/<int:control_id>', methods=['GET'])
 def get_cip_control_route(control_id):
@@ -61,16 +77,130 @@ def get_cip_control_route(control_id):
 
     return jsonify(dict(control)), 200
 
+@cip_routes.route('/controls/<int:control_id>/scores', methods=['GET'])
+def score_cip_control_route(control_id):
+    """
+    Score every device against a control's compiled risk profile.
+
+    Scores stored by the last completed recalculation job are served while
+    they are of the control's current version (source 'stored', with their
+    computed_at); otherwise, or with live=1, the fleet's current metrics are
+    scored (source 'live').
+
+    Query parameters: method (sigmoid or weighted), project_id, live, and
+    limit on the number of highest-scoring devices returned (default 100).
+    """
+    method = request.args.get('method', 'sigmoid')
+    if method not in RISK_SCORE_METHODS:
+        return jsonify(format_error(f"method must be one of {', '.join(RISK_SCORE_METHODS)}")), 400
+    limit = request.args.get('limit', 100, type=int)
+    if limit < 1:
+        return jsonify(format_error("limit must be positive")), 400
+    project_id = request.args.get('project_id', type=int)
+
+    try:
+        profile = risk_profiles.get(control_id)
+    except ValueError as e:
+        return jsonify(format_error(str(e))), 400
+    if profile is None:
+        return jsonify(format_error("CIP control not found")), 404
+
+    if request.args.get('live') not in ('1', 'true'):
+        stored = load_stored_scores(control_id, profile.version, method, limit, project_id)
+        if stored is not None:
+            devices, computed_at, top = stored
+            return jsonify(
+                profile=profile.to_dict(),
+                method=method,
+                source='stored',
+                computed_at=computed_at,
+                devices=devices,
+                scores=[{'device_id': device_id, 'score': score} for device_id, score in top]
+            )
+
+    try:
+        scored = risk_profiles.score_fleet(control_id, method, project_id)
+    except ValueError as e:
+        return jsonify(format_error(str(e))), 400
+    if scored is None:
+        return jsonify(format_error("CIP control not found")), 404
+
+    profile, device_ids, scores = scored
+    top = np.argsort(-scores, kind='stable')[:limit]
+    return jsonify(
+        profile=profile.to_dict(),
+        method=method,
+        source='live',
+        devices=len(device_ids),
+        scores=[{'device_id': int(device_ids[i]), 'score': float(scores[i])} for i in top]
+    )
+
+@cip_routes.route('/jobs', methods=['GET'])
+def list_recalculation_jobs_route():
+    """List recent recalculation jobs, optionally of one ?control_id=."""
+    jobs = recalculation_jobs.list(request.args.get('control_id', type=int))
+    return jsonify(jobs=[job.to_dict() for job in jobs]), 200
+
+@cip_routes.route('/jobs/<job_id>', methods=['GET'])
+def get_recalculation_job_route(job_id):
+    job = recalculation_jobs.get(job_id)
+    if job is None:
+        return jsonify(format_error("Recalculation job not found")), 404
+    return jsonify(job.to_dict()), 200
+
+@cip_routes.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_recalculation_job_route(job_id):
+    job = recalculation_jobs.cancel(job_id)
+    if job is None:
+        return jsonify(format_error("Recalculation job not found")), 404
+    return jsonify(job.to_dict()), 200
+
 @cip_routes.route('/process_cip_parameters', methods=['POST'])
 def process_cip_parameters():
+    """
+    Score one device's CIP values.
+
+    EMAs come from the server-side state of the device: the values are
+    folded into its EMAs at `alpha` (default 0.2, one of EMA_STATE_ALPHAS)
+    and the updated EMAs are returned. previous_ema is optional and only
+    seeds keys of cip_values the server has no state for yet.
+    """
     data = request.json
-    required_fields = ['cip_values', 'weights', 'mean', 'std_dev', 'previous_ema']
+    required_fields = ['device_id', 'cip_values', 'weights', 'mean', 'std_dev']
     is_valid, error_message = validate_request_data(required_fields, data)
     if not is_valid:
         return jsonify(format_error(error_message)), 400
+    try:
+        device_id = parse_device_id(data['device_id'])
+    except ValueError as e:
+        return jsonify(format_error(str(e))), 400
+    # observe() persists into the device's EMA state, so everything the
+    # scoring below needs is checked before it runs
+    alpha = data.get('alpha', 0.2)
+    if not is_number(alpha) or float(alpha) not in ema_state.alphas:
+        allowed = ', '.join(str(a) for a in ema_state.alphas)
+        return jsonify(format_error(f"alpha must be one of {allowed}")), 400
+    alpha = float(alpha)
+    cip_values = data['cip_values']
+    if not is_number_map(cip_values, allow_none=False) or not cip_values:
+        return jsonify(format_error("cip_values must be a non-empty object of numbers")), 400
+    for field in ('weights', 'mean', 'std_dev'):
+        if not is_number_map(data[field], allow_none=False):
+            return jsonify(format_error(f"{field} must be an object of numbers")), 400
+        missing = [key for key in cip_values if key not in data[field]]
+        if missing:
+            return jsonify(format_error(f"{field} is missing keys: {', '.join(missing)}")), 400
+    if data['weights'].keys() != cip_values.keys():
+        return jsonify(format_error("weights must have the same keys as cip_values")), 400
+    if any(data['std_dev'][key] == 0 for key in cip_values):
+        return jsonify(format_error("std_dev must be non-zero")), 400
+    if data.get('previous_ema') is not None and not is_number_map(data['previous_ema']):
+        return jsonify(format_error("previous_ema must be an object of numbers")), 400
+
+    seeds = {key: value for key, value in (data.get('previous_ema') or {}).items() if key in cip_values}
 
     # Calculate EMA
-    ema_results = {key: calculate_ema(value, data['previous_ema'][key]) for key, value in data['cip_values'].items()}
+    ema_results = ema_state.observe(device_id, cip_values, alpha, seeds)
 
     # Calculate Sigmoid
     sigmoid_result = sigmoid_modified(data['cip_values'], data['weights'])
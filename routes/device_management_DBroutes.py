@@ -1,72 +1,155 @@
 # device_management_DBroutes.py
 
 from flask import Blueprint, request, jsonify
-import sqlite3
+import json
 import os
+import time
+from datetime import datetime, timezone
+from database import (
+    read_connection, write_connection, get_metrics_history, format_timestamp,
+    HISTORY_METRICS
+)
+from utils.metrics_ingest import (
+    MAX_BATCH_SAMPLES, normalize_sample, device_exists, ingest_metric_samples, ingest_stats,
+    get_metrics_writer
+)
+from utils.analysis_pipeline import get_analysis_pipeline
+from utils.change_versions import VersionedListing, parse_since_version
+from models.ema_state import ema_state
 
 # Define Blueprint
 device_management_db_bp = Blueprint('device_management_db', __name__)
 
-# Define database path - relative to the routes directory
-ROUTES_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.dirname(ROUTES_DIR)
-DATABASE_PATH = os.path.join(PROJECT_ROOT, 'app.db')
+# Upper bound on devices per EMA batch read
+MAX_EMA_DEVICES = 10000
+
+def parse_time_arg(value, default):
+    """Parse an epoch-seconds or ISO-8601 (UTC) query argument into epoch seconds."""
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
 
 def query_db(query, args=(), one=False):
-    """Execute a database query and return results."""
-    with sqlite3.connect(DATABASE_PATH) as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        rv = cursor.fetchall()
-        conn.commit()
+    """Execute a read-only query on a pooled connection and return results."""
+    with read_connection() as conn:
+        rv = conn.execute(query, args).fetchall()
         return (rv[0] if rv else None) if one else rv
 
+def execute_db(query, args=()):
+    """Execute a write statement on the shared write connection and commit it."""
+    with write_connection() as conn:
+        return conn.execute(query, args).rowcount
+
+DEVICE_LISTING_QUERY = '''
+    SELECT id, name, type, x, y, cpu_usage, memory_usage, disk_usage,
+           vulnerability_score, ip_address, subnet_mask
+    FROM devices
+'''
+
+CONNECTION_LISTING_QUERY = '''
+    SELECT id, source_device_id, target_device_id, connection_type,
+           bandwidth, latency, packet_loss
+    FROM connections
+'''
+
+def device_entry(device):
+    """Build the /get_devices entry of one DEVICE_LISTING_QUERY row."""
+    return {
+        'id': device[0],
+        'name': device[1],
+        'type': device[2],
+        'x': device[3],
+        'y': device[4],
+        'metrics': {
+            'cpu_usage': device[5],
+            'memory_usage': device[6],
+            'disk_usage': device[7],
+            'vulnerability_score': device[8]
+        },
+        'subnet': device[10],
+        'layer': {"physical": True, "logical": True, "application": device[2] in ['server', 'client']}
+    }
+
+def connection_entry(conn):
+    """Build the /get_connections entry of one CONNECTION_LISTING_QUERY row."""
+    return {
+        'id': conn[0],
+        'start_device': conn[1],
+        'end_device': conn[2],
+        'type': conn[3],
+        'bandwidth': conn[4],
+        'layer': {
+            "physical": True,
+            "logical": conn[3] in ['ethernet', 'fiber'],
+            "application": conn[3] in ['tcp', 'udp']
+        }
+    }
+
+def versioned_listing_response(name, table, query, build_entry):
+    """
+    Serve a listing of one versioned table, optionally of one project.
+
+    Without since_version the response is the list of entries. With it, the
+    response is an object holding the entries changed since that version
+    under `name` and the ids of removed rows; 'full' is set when the
+    version could not be served as a delta and every entry is included.
+    A matching If-None-Match is answered 304 without reading the table.
+    """
+    try:
+        project_id = request.args.get('project_id', type=int)
+        since_version = parse_since_version()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    listing = VersionedListing(name, [table], project_id, since_version)
+    not_modified = listing.not_modified()
+    if not_modified is not None:
+        return not_modified
+
+    filters, params = [], []
+    if project_id is not None:
+        filters.append('project_id = ?')
+        params.append(project_id)
+    removed = []
+    with read_connection() as conn:
+        if listing.is_delta:
+            changed, removed = listing.changed_rows(conn, table)
+            filters.append('id IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(changed))
+        where = f"WHERE {' AND '.join(filters)}" if filters else ''
+        rows = conn.execute(f'{query} {where}', params).fetchall() if not listing.unchanged else []
+    entries = [build_entry(row) for row in rows]
+
+    if since_version is None:
+        return listing.apply(jsonify(entries))
+    return listing.apply(jsonify({
+        'version': listing.version,
+        'since_version': since_version,
+        'full': not listing.is_delta,
+        name: entries,
+        'removed': removed
+    }))
+
 @device_management_db_bp.route('/get_devices', methods=['GET'])
 def get_devices():
+    """List devices; see versioned_listing_response for project_id and since_version."""
     try:
-        devices = query_db('''
-            SELECT id, name, type, x, y, cpu_usage, memory_usage, disk_usage,
-                   vulnerability_score, ip_address, subnet_mask
-            FROM devices
-        ''')
-        return jsonify([{
-            'id': device[0],
-            'name': device[1],
-            'type': device[2],
-            'x': device[3],
-            'y': device[4],
-            'metrics': {
-                'cpu_usage': device[5],
-                'memory_usage': device[6],
-                'disk_usage': device[7],
-                'vulnerability_score': device[8]
-            },
-            'subnet': device[10],
-            'layer': {"physical": True, "logical": True, "application": device[2] in ['server', 'client']}
-        } for device in devices]), 200
+        return versioned_listing_response('devices', 'devices', DEVICE_LISTING_QUERY, device_entry)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @device_management_db_bp.route('/get_connections', methods=['GET'])
 def get_connections():
+    """List connections; see versioned_listing_response for project_id and since_version."""
     try:
-        connections = query_db('''
-            SELECT id, source_device_id, target_device_id, connection_type,
-                   bandwidth, latency, packet_loss
-            FROM connections
-        ''')
-        return jsonify([{
-            'id': conn[0],
-            'start_device': conn[1],
-            'end_device': conn[2],
-            'type': conn[3],
-            'bandwidth': conn[4],
-            'layer': {
-                "physical": True,
-                "logical": conn[3] in ['ethernet', 'fiber'],
-                "application": conn[3] in ['tcp', 'udp']
-            }
-        } for conn in connections]), 200
+        return versioned_listing_response('connections', 'connections', CONNECTION_LISTING_QUERY,
+                                          connection_entry)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -83,7 +166,7 @@ def add_device():
             if field not in data:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
 
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with write_connection() as conn:
             cursor = conn.cursor()
             
             # Insert device
@@ -137,56 +220,156 @@ def update_device_metrics(device_id):
     if request.method == "OPTIONS":
         return jsonify({"message": "OK"}), 200
         
+    try:
+        device_id = int(device_id)
+    except ValueError:
+        return jsonify({'error': f'Invalid device id {device_id!r}: expected an integer'}), 400
+
     try:
         data = request.get_json()
-        print(f"DEBUG: Received metrics update for device {device_id}:", data)
+        row = normalize_sample(device_id, data or {})
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid metrics payload: {e}'}), 400
 
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # Update current metrics in devices table
-            cursor.execute('''
-                UPDATE devices 
-                SET cpu_usage = ?,
-                    memory_usage = ?,
-                    disk_usage = ?,
-                    vulnerability_score = ?
-                WHERE id = ?
-            ''', (
-                data.get('cpu', 0),
-                data.get('memory', 0),
-                data.get('disk', 0),
-                data.get('vulnerability', 0),
-                device_id
-            ))
+    try:
+        # Unknown devices are rejected here; the writer would drop their samples
+        if not device_exists(device_id):
+            return jsonify({'error': 'Device not found'}), 404
 
-            # Insert into history table
-            cursor.execute('''
-                INSERT INTO device_metrics_history (
-                    device_id, cpu_usage, memory_usage, disk_usage,
-                    vulnerability_score, network_usage, temperature
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                device_id,
-                data.get('cpu', 0),
-                data.get('memory', 0),
-                data.get('disk', 0),
-                data.get('vulnerability', 0),
-                data.get('network', 0),
-                data.get('temperature', 40)
-            ))
-            
-            conn.commit()
-            return jsonify({'message': 'Metrics updated successfully'}), 200
+        # Hand the sample to the background writer, which group-commits
+        # queued samples instead of taking the write lock per request.
+        if not get_metrics_writer().submit(row):
+            return jsonify({'error': 'Metrics ingest queue is full, retry later'}), 503
+
+        return jsonify({'message': 'Metrics accepted', 'queued': True}), 202
             
     except Exception as e:
         print(f"Error updating metrics: {e}")  # Debug log
+        return jsonify({'error': str(e)}), 500
+
+@device_management_db_bp.route('/device_metrics/batch', methods=['POST', 'OPTIONS'])
+def update_device_metrics_batch():
+    """Write metric samples for many devices in one transaction."""
+    if request.method == "OPTIONS":
+        return jsonify({"message": "OK"}), 200
+
+    try:
+        data = request.get_json()
+        samples = data.get('samples') if isinstance(data, dict) else data
+        if not isinstance(samples, list) or not samples:
+            return jsonify({'error': 'Expected a non-empty list of samples'}), 400
+        if len(samples) > MAX_BATCH_SAMPLES:
+            return jsonify({'error': f'Batch exceeds {MAX_BATCH_SAMPLES} samples'}), 413
+
+        results = []
+        rows = []
+        for index, sample in enumerate(samples):
+            try:
+                rows.append(normalize_sample(sample['device_id'], sample))
+                results.append({'device_id': sample['device_id'], 'success': True})
+            except (KeyError, TypeError, ValueError) as e:
+                device_id = sample.get('device_id') if isinstance(sample, dict) else None
+                results.append({'device_id': device_id, 'success': False,
+                                'error': f'Invalid sample at index {index}: {e}'})
+
+        started = time.perf_counter()
+        written = ingest_metric_samples(rows)
+        elapsed = time.perf_counter() - started
+
+        for result in results:
+            if result['success'] and int(result['device_id']) not in written:
+                result['success'] = False
+                result['error'] = 'Device not found'
+
+        accepted = sum(1 for result in results if result['success'])
+        ingest_stats.record('batch', accepted, elapsed)
+        return jsonify({
+            'accepted': accepted,
+            'rejected': len(results) - accepted,
+            'elapsed_ms': elapsed * 1000,
+            'results': results
+        }), 200
+
+    except Exception as e:
+        print(f"Error updating metrics batch: {e}")  # Debug log
         return jsonify({'error': str(e)}), 400
 
+@device_management_db_bp.route('/device_metrics/throughput', methods=['GET'])
+def get_ingest_throughput():
+    """Report samples/second for the single-device and batch ingestion paths."""
+    return jsonify(ingest_stats.snapshot()), 200
+
+@device_management_db_bp.route('/device_metrics/writer', methods=['GET'])
+def get_metrics_writer_stats():
+    """Report queue depth, batch size and commit latency of the metrics writer."""
+    return jsonify(get_metrics_writer().stats()), 200
+
+@device_management_db_bp.route('/device_metrics/analysis_pipeline', methods=['GET'])
+def get_analysis_pipeline_stats():
+    """Report queue depth, batch size and commit latency of the analysis pipeline."""
+    return jsonify(get_analysis_pipeline().stats()), 200
+
+@device_management_db_bp.route('/device_metrics/ema', methods=['GET', 'POST'])
+def get_device_emas():
+    """
+    Read the server-side streaming EMAs of many devices in one query.
+
+    GET takes ?device_ids=1,2,3 with optional repeated ?metric= and ?alpha=;
+    POST takes {"device_ids": [...], "metrics": [...], "alphas": [...]}.
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            device_ids = data.get('device_ids') or []
+            metrics = data.get('metrics')
+            alphas = data.get('alphas')
+        else:
+            raw_ids = request.args.get('device_ids', '')
+            device_ids = [part for part in raw_ids.split(',') if part.strip()]
+            metrics = request.args.getlist('metric') or None
+            alphas = request.args.getlist('alpha', type=float) or None
+        device_ids = [int(device_id) for device_id in device_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'device_ids must be integers'}), 400
+
+    if not device_ids:
+        return jsonify({'error': 'device_ids is required'}), 400
+    if len(device_ids) > MAX_EMA_DEVICES:
+        return jsonify({'error': f'At most {MAX_EMA_DEVICES} devices per request'}), 400
+
+    emas = ema_state.get_emas(device_ids, metrics, alphas)
+    return jsonify({
+        'tracked_alphas': list(ema_state.alphas),
+        'devices': {str(device_id): metrics for device_id, metrics in emas.items()}
+    }), 200
+
 # Add this route alongside the other device management routes
 @device_management_db_bp.route('/device_metrics/<int:device_id>', methods=['GET'])
 def get_device_metrics_history(device_id):
     try:
+        # With a time range, serve from the resolution that fits the range
+        if 'start' in request.args or 'end' in request.args:
+            end = parse_time_arg(request.args.get('end'), time.time())
+            start = parse_time_arg(request.args.get('start'), end - 3600)
+            max_points = int(request.args.get('max_points', 100))
+            resolution, rows = get_metrics_history(device_id, start, end, max_points)
+            if resolution == 'raw':
+                return jsonify([{
+                    'device_id': m['device_id'],
+                    'timestamp': m['timestamp'],
+                    'resolution': resolution,
+                    'metrics': {metric: m[metric] for metric in HISTORY_METRICS}
+                } for m in rows]), 200
+            return jsonify([{
+                'device_id': m['device_id'],
+                'timestamp': format_timestamp(m['bucket_start']),
+                'resolution': resolution,
+                'sample_count': m['sample_count'],
+                'metrics': {metric: m[f'{metric}_mean'] for metric in HISTORY_METRICS},
+                'min': {metric: m[f'{metric}_min'] for metric in HISTORY_METRICS},
+                'max': {metric: m[f'{metric}_max'] for metric in HISTORY_METRICS}
+            } for m in rows]), 200
+
         metrics = query_db('''
             SELECT 
                 device_id,
@@ -222,14 +405,16 @@ def get_device_metrics_history(device_id):
 @device_management_db_bp.route('/remove_device/<int:device_id>', methods=['DELETE'])
 def remove_device(device_id):
     try:
-        # First delete associated connections
-        query_db('''
-            DELETE FROM connections 
-            WHERE source_device_id = ? OR target_device_id = ?
-        ''', (device_id, device_id))
-        
-        # Then delete the device
-        query_db('DELETE FROM devices WHERE id = ?', (device_id,))
+        with write_connection() as conn:
+            # First delete associated connections
+            conn.execute('''
+                DELETE FROM connections 
+                WHERE source_device_id = ? OR target_device_id = ?
+            ''', (device_id, device_id))
+            
+            # Then delete the device and its materialized latest state
+            conn.execute('DELETE FROM devices WHERE id = ?', (device_id,))
+            conn.execute('DELETE FROM device_latest WHERE device_id = ?', (device_id,))
         
         return jsonify({'message': 'Device and related connections deleted successfully'}), 200
     except Exception as e:
@@ -239,7 +424,7 @@ def remove_device(device_id):
 def add_connection():
     data = request.json
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with write_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO connections (
@@ -285,7 +470,7 @@ def save_network():
             
         project_name = data.get('project_name', f"Project_{os.urandom(4).hex()}")
         
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with write_connection() as conn:
             cursor = conn.cursor()
             # Insert project
             cursor.execute('''
@@ -410,7 +595,7 @@ def remove_connection(connection_id):
         return '', 200
         
     try:
-        query_db('DELETE FROM connections WHERE id = ?', (connection_id,))
+        execute_db('DELETE FROM connections WHERE id = ?', (connection_id,))
         return jsonify({'message': 'Connection deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -419,7 +604,7 @@ def remove_connection(connection_id):
 def update_connection(connection_id):
     data = request.json
     try:
-        query_db('''
+        execute_db('''
             UPDATE connections
             SET source_device_id = ?, target_device_id = ?, connection_type = ?,
                 bandwidth = ?, latency = ?, packet_loss = ?
@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
 from models.ema import calculate_ema
+from models.ema_state import ema_state
 from models.sigmoid_modified import sigmoid_modified
-from utils.validation import validate_request_data, format_error
-from database import get_db_connection
+from utils.validation import validate_request_data, format_error, parse_device_id
+from database import read_connection, write_connection
 from datetime import datetime
 import pytz
 import os
@@ -31,10 +32,21 @@ def adjusted_metrics():
     if not is_valid:
         return jsonify(format_error(error_message)), 400
 
-    adjusted_cpu_usage = calculate_ema(data['cpu_usage'], data['cpu_usage'], 0.1)
-    adjusted_memory_usage = sigmoid_modified([data['memory_usage']], [1], 10, 0.5)
+    # Smooth against the device's server-side CPU EMA; without a device_id
+    # (or before its first sample) the value is its own previous EMA
+    previous_cpu_ema = None
+    if data.get('device_id') is not None:
+        try:
+            device_id = parse_device_id(data['device_id'])
+        except ValueError as e:
+            return jsonify(format_error(str(e))), 400
+        previous_cpu_ema = ema_state.get_ema(device_id, 'cpu_usage', 0.1)
+    if previous_cpu_ema is None:
+        previous_cpu_ema = data['cpu_usage']
+    adjusted_cpu_usage = calculate_ema(data['cpu_usage'], previous_cpu_ema, 0.1)
+    adjusted_memory_usage = sigmoid_modified({'memory_usage': data['memory_usage']}, {'memory_usage': 1}, 10, 0.5)
     risk_adjusted_cpu = adjusted_cpu_usage * data['risk_level']
-    risk_adjusted_memory = adjusted_memory_usage[0] * data['risk_level']
+    risk_adjusted_memory = adjusted_memory_usage * data['risk_level']
 
     return jsonify({
         'adjusted_cpu_usage': risk_adjusted_cpu,
@@ -43,11 +55,8 @@ def adjusted_metrics():
 
 @network_viz_bp.route('/pins', methods=['GET'])
 def get_pins():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT id, name FROM pins')
-    rows = cur.fetchall()
-    conn.close()
+    with read_connection() as conn:
+        rows = conn.execute('SELECT id, name FROM pins').fetchall()
 
     pins = [{'id': row['id'], 'name': row['name']} for row in rows]
     return jsonify(pins), 200
@@ -79,21 +88,18 @@ def create_pin():
 
     pin_type = f"{category} - {subcategory} - {status_classification} - {priority_level}"
 
-    conn = get_db_connection()
-    cur = conn.cursor()
-    # Ensure unique pin name
-    cur.execute('SELECT COUNT(*) as cnt FROM pins WHERE name = ?', (pin_name,))
-    row = cur.fetchone()
-    if row and row['cnt'] > 0:
-        conn.close()
-        return jsonify({'error': 'Pin name already exists. Please choose a different name.'}), 400
-
-    cur.execute('''
-        INSERT INTO pins (name, latitude, longitude, network_assoc, pin_type, timestamp_utc)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (pin_name, latitude, longitude, network_assoc, pin_type, utc_now.isoformat()))
-    conn.commit()
-    conn.close()
+    with write_connection() as conn:
+        cur = conn.cursor()
+        # Ensure unique pin name
+        cur.execute('SELECT COUNT(*) as cnt FROM pins WHERE name = ?', (pin_name,))
+        row = cur.fetchone()
+        if row and row['cnt'] > 0:
+            return jsonify({'error': 'Pin name already exists. Please choose a different name.'}), 400
+
+        cur.execute('''
+            INSERT INTO pins (name, latitude, longitude, network_assoc, pin_type, timestamp_utc)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (pin_name, latitude, longitude, network_assoc, pin_type, utc_now.isoformat()))
 
     return jsonify({'message': 'Pin created successfully'}), 201
 
@@ -141,33 +147,27 @@ def associate_pin_json():
     json_file = data['json_file']
 
     # Make sure your database table and logic are correct
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT COUNT(*) as cnt FROM pin_json_associations WHERE pin_id=? AND json_filename=?', (pin_id, json_file))
-    row = cur.fetchone()
-    if row['cnt'] > 0:
-        # Already associated
-        conn.close()
-        return jsonify({'message': 'Pin already associated with this JSON file'}), 200
-    else:
-        # Insert new association
-        cur.execute('INSERT INTO pin_json_associations (pin_id, json_filename) VALUES (?, ?)', (pin_id, json_file))
-        conn.commit()
-        conn.close()
-        return jsonify({'message': 'Pin associated with JSON file successfully'}), 201
+    with write_connection() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT COUNT(*) as cnt FROM pin_json_associations WHERE pin_id=? AND json_filename=?', (pin_id, json_file))
+        row = cur.fetchone()
+        if row['cnt'] > 0:
+            # Already associated
+            return jsonify({'message': 'Pin already associated with this JSON file'}), 200
+        else:
+            # Insert new association
+            cur.execute('INSERT INTO pin_json_associations (pin_id, json_filename) VALUES (?, ?)', (pin_id, json_file))
+            return jsonify({'message': 'Pin associated with JSON file successfully'}), 201
 
 @network_viz_bp.route('/pins/by_json/<json_file>', methods=['GET'])
 def get_pin_by_json(json_file):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute('''
-        SELECT p.id, p.name, p.latitude, p.longitude, p.pin_type
-        FROM pins p
-        JOIN pin_json_associations pa ON p.id = pa.pin_id
-        WHERE pa.json_filename = ?
-    ''', (json_file,))
-    row = cur.fetchone()
-    conn.close()
+    with read_connection() as conn:
+        row = conn.execute('''
+            SELECT p.id, p.name, p.latitude, p.longitude, p.pin_type
+            FROM pins p
+            JOIN pin_json_associations pa ON p.id = pa.pin_id
+            WHERE pa.json_filename = ?
+        ''', (json_file,)).fetchone()
 
     if not row:
         return jsonify({'error': 'No pin associated with this JSON file'}), 404
@@ -1,48 +1,42 @@
-from flask import Flask, send_from_directory, render_template, jsonify, request
+from flask import Flask, send_from_directory, render_template, jsonify, request, current_app
 import os
+import sys
+import signal
 import logging
-from database import init_db
+import time
+from database import DEVICE_METRICS, init_db, get_connection_pool, read_connection
+from models.robust_zscore import population_sketches
+from utils.metrics_ingest import get_metrics_writer
+from utils.recalculation_jobs import recalculation_jobs
 
 # Import Blueprints
 from routes.device_management_DBroutes import device_management_db_bp
 from routes.cip_impact_routes import cip_impact_bp
 from routes.network_routes import network_viz_bp
+from routes.cip_routes import cip_routes
 from blueprints.network_visualization import bp as network_visualization_bp
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Create Flask app
-app = Flask(__name__,
-            static_url_path='',
-            static_folder='static',
-            template_folder='templates')
+# Root log level, e.g. DEBUG, INFO or WARNING
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 
-# Log when registering blueprints
-logger.debug("Registering blueprints...")
-
-# Register blueprints
-app.register_blueprint(device_management_db_bp, url_prefix='/api')
-app.register_blueprint(cip_impact_bp, url_prefix='/api')
-app.register_blueprint(network_viz_bp, url_prefix='/api')
-app.register_blueprint(network_visualization_bp, url_prefix='/api')
-
-# Verify registration
-logger.debug("Registered routes:")
-for rule in app.url_map.iter_rules():
-    logger.debug(f"{rule.endpoint}: {rule.rule}")
-
-# Database and exports setup
-DATABASE = os.path.join(os.path.dirname(__file__), 'app.db')
+# Exports setup
 EXPORTS_DIR = os.path.join(os.path.dirname(__file__), 'json_exports')
 
+def configure_logging(level=LOG_LEVEL):
+    """Set the root log level and format, replacing any earlier configuration."""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s',
+        force=True
+    )
+
 # Debug route to list all registered routes
-@app.route('/debug/routes')
 def debug_routes():
     """List all registered routes."""
     routes = []
-    for rule in app.url_map.iter_rules():
+    for rule in current_app.url_map.iter_rules():
         routes.append({
             'endpoint': rule.endpoint,
             'methods': list(rule.methods),
@@ -51,7 +45,6 @@ def debug_routes():
     return jsonify(routes)
 
 # After request handler
-@app.after_request
 def after_request(response):
     # CORS headers
     response.headers.add('Access-Control-Allow-Origin', '*')
@@ -78,14 +71,12 @@ def after_request(response):
     return response
 
 # Error handlers that return JSON if the path starts with /api/
-@app.errorhandler(404)
 def not_found(e):
     if request.path.startswith('/api'):
         return jsonify({'error': 'Not Found'}), 404
     else:
         return render_template('frontend/404.html.jinja2'), 404
 
-@app.errorhandler(500)
 def internal_error(e):
     if request.path.startswith('/api'):
         return jsonify({'error': 'Internal Server Error'}), 500
@@ -93,51 +84,118 @@ def internal_error(e):
         return render_template('frontend/500.html.jinja2'), 500
 
 # Main page routes
-@app.route('/')
 def home():
     return render_template('frontend/index.html.jinja2', active_page='home')
 
-@app.route('/cip_control')
 def cip_control():
     return render_template('frontend/cip_control.html.jinja2', active_page='cip_control')
 
-@app.route('/cip_impact')
 def cip_impact():
     return render_template('frontend/cip_impact.html.jinja2', active_page='cip_impact')
 
-@app.route('/cip_val')
 def cip_val():
     return render_template('frontend/cip_val.html.jinja2', active_page='cip_val')
 
-@app.route('/control_panel')
 def control_panel():
     return render_template('frontend/control_panel.html.jinja2', active_page='control_panel')
 
-@app.route('/device_management')
 def device_management():
     return render_template('frontend/device_management.html.jinja2', active_page='device_management')
 
-@app.route('/visualization')
 def visualization():
     return render_template('frontend/visualization.html.jinja2', active_page='visualization')
 
-@app.route('/help')
 def help_page():
     return render_template('frontend/help.html.jinja2', active_page='help')
 
 # Static file routes
-@app.route('/static/<path:path>')
 def send_static(path):
     return send_from_directory('static', path)
 
-@app.route('/frontend/<path:path>')
 def send_frontend(path):
     if os.path.exists(os.path.join('frontend', path)):
         return send_from_directory('frontend', path)
     return send_from_directory('templates/frontend', path)
 
-# Initialize the database using the `init_db` from `database.py`
-init_db()
+# Page routes: (rule, view); endpoints keep the view names used by url_for in templates
+PAGE_ROUTES = [
+    ('/debug/routes', debug_routes),
+    ('/', home),
+    ('/cip_control', cip_control),
+    ('/cip_impact', cip_impact),
+    ('/cip_val', cip_val),
+    ('/control_panel', control_panel),
+    ('/device_management', device_management),
+    ('/visualization', visualization),
+    ('/help', help_page),
+    ('/static/<path:path>', send_static),
+    ('/frontend/<path:path>', send_frontend),
+]
+
+def create_app(init_database=True):
+    """
+    Build the Flask application.
+
+    :param init_database: Create and migrate the schema; the production
+        server does this once in the master process instead.
+    :return: Flask app.
+    """
+    app = Flask(__name__,
+                static_url_path='',
+                static_folder='static',
+                template_folder='templates')
+
+    # Register blueprints
+    app.register_blueprint(device_management_db_bp, url_prefix='/api')
+    app.register_blueprint(cip_impact_bp, url_prefix='/api')
+    app.register_blueprint(network_viz_bp, url_prefix='/api')
+    app.register_blueprint(network_visualization_bp, url_prefix='/api')
+    app.register_blueprint(cip_routes, url_prefix='/api/cip')
+
+    for rule, view in PAGE_ROUTES:
+        app.add_url_rule(rule, view_func=view)
+    app.after_request(after_request)
+    app.register_error_handler(404, not_found)
+    app.register_error_handler(500, internal_error)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Registered routes:")
+        for rule in app.url_map.iter_rules():
+            logger.debug(f"{rule.endpoint}: {rule.rule}")
+
+    if init_database:
+        init_db()
+    return app
+
+def warm_up():
+    """
+    Prepare a freshly started worker process before it takes traffic.
+
+    Opens every pooled read connection, pulls the hot tables into the page
+    cache, loads the population sketches and starts the metrics writer and
+    analysis pipeline threads, so the first requests do not pay for them.
+    Every worker also starts a recalculation job dispatcher, so queued jobs
+    and jobs of a crashed worker are picked up without a new submit.
+    """
+    started = time.perf_counter()
+    get_connection_pool().prefill()
+    with read_connection() as conn:
+        for table in ('devices', 'connections', 'device_latest'):
+            conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()
+    for metric in DEVICE_METRICS:
+        population_sketches.get_stats(metric)
+    get_metrics_writer()
+    recalculation_jobs.start()
+    logger.info("Worker %d warmed up in %.3fs", os.getpid(), time.perf_counter() - started)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001, host='0.0.0.0', threaded=True)
+    # Development server; use gunicorn with gunicorn.conf.py in production
+    configure_logging(os.environ.get('LOG_LEVEL', 'DEBUG').upper())
+    debug = os.environ.get('FLASK_DEBUG', '1') == '1'
+    app = create_app()
+    # With the reloader, only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warm_up()
+    # Exit normally on SIGTERM so atexit handlers flush the metrics writer queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    app.run(debug=debug, port=int(os.environ.get('PORT', 5001)), host='0.0.0.0', threaded=True)
@@ -14,8 +14,10 @@ export class ZScoreVisualizer {
         this.initialized = false;
         this.setupEventListeners();
 
-        // Periodically refresh the visualization to reflect changes as new data arrives
-        this.setupPeriodicRefresh();
+        // Latest topology entry of every device, kept current by the stream
+        this.topologyDevices = new Map();
+        // Receive a snapshot and then only the devices that change
+        this.setupTopologyStream();
     }
 
     setupEventListeners() {
@@ -50,30 +52,75 @@ export class ZScoreVisualizer {
         }
     }
 
-    setupPeriodicRefresh() {
-        // Refresh every 10 seconds to pull new data and update visuals
-        setInterval(() => {
-            this.updateVisualization();
-        }, 10000);
+    setupTopologyStream() {
+        if (typeof EventSource === 'undefined') {
+            // No Server-Sent Events support: fall back to polling every 10 seconds
+            setInterval(() => {
+                this.fetchTopology();
+            }, 10000);
+            return;
+        }
+
+        const source = new EventSource('/api/network/topology/stream');
+        source.addEventListener('snapshot', (event) => {
+            const snapshot = JSON.parse(event.data);
+            this.topologyDevices = new Map(snapshot.devices.map(device => [device.id, device]));
+            this.applyTopology(snapshot.devices);
+        });
+        source.addEventListener('delta', (event) => {
+            const delta = JSON.parse(event.data);
+            delta.devices.forEach(device => this.topologyDevices.set(device.id, device));
+            delta.removed.forEach(id => this.topologyDevices.delete(id));
+            this.applyTopology(delta.devices);
+        });
+        // EventSource reconnects by itself and the server starts again with a snapshot
+        source.onerror = () => console.warn('Topology stream interrupted, reconnecting');
+        this.topologySource = source;
+
+        // Apply what arrived before the canvas state was ready
+        subscribeToState([EVENTS.STATE_CHANGE], (eventName, detail) => {
+            if (detail && detail.type === 'initialized') {
+                this.applyTopology([...this.topologyDevices.values()]);
+            }
+        });
     }
 
     async updateVisualization() {
-        try {
-            const state = getState();
-            if (!state.initialized) return;
+        // Re-color from the streamed topology; fetch it only if nothing has arrived yet
+        if (this.topologyDevices.size) {
+            this.applyTopology([...this.topologyDevices.values()]);
+        } else {
+            await this.fetchTopology();
+        }
+    }
 
-            const response = await fetch('/api/network/topology/details');
+    async fetchTopology() {
+        try {
+            // Same per-device baseline Z-scores as the topology stream
+            const response = await fetch('/api/network/topology/details?mode=temporal');
             if (!response.ok) {
                 throw new Error('Failed to fetch network topology');
             }
-            
+
             const topology = await response.json();
-            
+
             // Debug log to inspect the topology data and verify if zscore_mean is present
             console.log('Topology data:', topology);
-    
+
+            this.topologyDevices = new Map(topology.devices.map(device => [device.id, device]));
+            this.applyTopology(topology.devices);
+        } catch (error) {
+            console.error('Error updating Z-score visualization:', error);
+        }
+    }
+
+    applyTopology(devices) {
+        try {
+            const state = getState();
+            if (!state.initialized) return;
+
             // Update device colors based on selected metric
-            topology.devices.forEach(deviceData => {
+            devices.forEach(deviceData => {
                 const device = state.devices.find(d => d.id === deviceData.id);
                 if (device && deviceData.zscores) {
                     let metricData = deviceData.zscores[this.selectedMetric];
@@ -0,0 +1,57 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never touch app.db: anything that runs outside the db fixture gets a scratch file
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='hm2-tests-'), 'default.db')
+
+import database
+import utils.analysis_pipeline as analysis_pipeline
+import utils.metrics_ingest as metrics_ingest
+import utils.recalculation_jobs as recalculation_jobs
+
+
+def drain_workers():
+    """Wait for the metrics writer and then the analysis pipeline to go idle."""
+    for worker in (metrics_ingest._writer, analysis_pipeline._pipeline):
+        if worker is not None:
+            worker.flush(10)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Fresh schema in a scratch database, with the connection pool pointed at it."""
+    monkeypatch.setattr(database, 'DATABASE_NAME', str(tmp_path / 'test.db'))
+    database.reset_connection_pool()
+    database.init_db()
+    yield database
+    drain_workers()
+    recalculation_jobs.recalculation_jobs.stop(10)
+    database.reset_connection_pool()
+
+
+@pytest.fixture
+def add_devices(db):
+    """Insert devices with ids 1..count, optionally into one project."""
+    def add(count, project_id=None, start=1):
+        with db.write_connection() as conn:
+            if project_id is not None:
+                conn.execute('INSERT OR IGNORE INTO projects (id, name) VALUES (?, ?)',
+                             (project_id, f'project-{project_id}'))
+            conn.executemany(
+                'INSERT INTO devices (id, project_id, name, type, x, y) VALUES (?, ?, ?, ?, 0, 0)',
+                [(i, project_id, f'device-{i}', 'server') for i in range(start, start + count)]
+            )
+    return add
+
+
+@pytest.fixture
+def client(db):
+    import server
+    return server.create_app(init_database=False).test_client()
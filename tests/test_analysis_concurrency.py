@@ -0,0 +1,61 @@
+# tests/test_analysis_concurrency.py
+
+import os
+import subprocess
+import sys
+
+from models.device_baseline import device_baseline
+from models.ema_state import ema_state
+from utils.analysis_pipeline import analyze_metric_samples
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES_PER_PROCESS = 60
+
+# One gunicorn worker's pipeline: every sample of device 1 in its own batch
+WORKER = f'''
+import sys
+from database import write_connection
+from utils.analysis_pipeline import analyze_metric_samples
+sys.stdin.readline()
+for i in range({SAMPLES_PER_PROCESS}):
+    with write_connection() as conn:
+        analyze_metric_samples(conn, [(1, 50.0 + i % 7, 40.0, 30.0, 20.0, 10.0, 45.0, 1000)])
+'''
+
+
+def test_two_processes_do_not_lose_each_others_updates(db, add_devices):
+    add_devices(1)
+    env = dict(os.environ, DATABASE_PATH=db.DATABASE_NAME)
+    workers = [
+        subprocess.Popen([sys.executable, '-c', WORKER], cwd=REPO, env=env, text=True,
+                         stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        for _ in range(2)
+    ]
+    # Release both once they are started, so their batches interleave
+    for worker in workers:
+        worker.stdin.write('go\n')
+        worker.stdin.flush()
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=120)
+        assert worker.returncode == 0, stderr
+
+    total = 2 * SAMPLES_PER_PROCESS
+    emas = ema_state.get_emas([1])[1]['cpu_usage']
+    assert {alpha: state['samples'] for alpha, state in emas.items()} == {
+        repr(alpha): total for alpha in ema_state.alphas
+    }
+    assert device_baseline.get_baseline(1)['cpu_usage']['count'] == total
+
+
+def test_samples_older_than_the_last_analysis_are_skipped(db, add_devices):
+    add_devices(1)
+    row = (50.0, 40.0, 30.0, 20.0, 10.0, 45.0)
+    with db.write_connection() as conn:
+        assert analyze_metric_samples(conn, [(1, *row, 2000), (1, *row, 1500)]) == 1
+    with db.write_connection() as conn:
+        assert analyze_metric_samples(conn, [(1, *row, 1000)]) == 0
+    with db.write_connection() as conn:
+        assert analyze_metric_samples(conn, [(1, *row, 2000)]) == 1
+
+    assert ema_state.get_emas([1])[1]['cpu_usage'][repr(ema_state.alphas[0])]['samples'] == 2
+    assert device_baseline.get_baseline(1)['cpu_usage']['count'] == 2
@@ -0,0 +1,178 @@
+# tests/test_change_versions.py
+
+from conftest import drain_workers
+
+
+def version(response):
+    return int(response.headers['X-Change-Version'])
+
+
+def ids(entries):
+    return sorted(entry['id'] for entry in entries)
+
+
+def test_devices_etag_answers_304_until_a_served_column_changes(client, add_devices, db):
+    add_devices(3)
+    first = client.get('/api/get_devices')
+    assert first.status_code == 200
+    assert ids(first.get_json()) == [1, 2, 3]
+    assert first.headers['Cache-Control'] == 'no-cache'
+    etag = first.headers['ETag']
+
+    cached = client.get('/api/get_devices', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+    assert cached.headers['ETag'] == etag
+    assert version(cached) == version(first)
+
+    # Columns the listing does not serve do not move the version
+    with db.write_connection() as conn:
+        conn.execute("UPDATE devices SET mac_address = '00:11:22:33:44:55' WHERE id = 1")
+    assert client.get('/api/get_devices', headers={'If-None-Match': etag}).status_code == 304
+
+    with db.write_connection() as conn:
+        conn.execute("UPDATE devices SET name = 'renamed' WHERE id = 1")
+    changed = client.get('/api/get_devices', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert version(changed) > version(first)
+
+
+def test_devices_since_version_returns_changed_and_removed_rows(client, add_devices, db):
+    add_devices(4)
+    since = version(client.get('/api/get_devices'))
+
+    with db.write_connection() as conn:
+        conn.execute("UPDATE devices SET name = 'renamed' WHERE id = 2")
+    assert client.delete('/api/remove_device/3').status_code == 200
+
+    delta = client.get(f'/api/get_devices?since_version={since}')
+    body = delta.get_json()
+    assert delta.status_code == 200
+    assert body['full'] is False
+    assert body['since_version'] == since
+    assert body['version'] == version(delta) > since
+    assert [device['name'] for device in body['devices']] == ['renamed']
+    assert body['removed'] == [3]
+
+    # The delta has its own ETag
+    assert delta.headers['ETag'] != client.get('/api/get_devices').headers['ETag']
+    cached = client.get(f'/api/get_devices?since_version={since}',
+                        headers={'If-None-Match': delta.headers['ETag']})
+    assert cached.status_code == 304
+
+    current = body['version']
+    empty = client.get(f'/api/get_devices?since_version={current}').get_json()
+    assert (empty['full'], empty['devices'], empty['removed']) == (False, [], [])
+
+
+def test_devices_since_version_falls_back_to_the_full_listing(client, add_devices):
+    add_devices(2)
+    current = version(client.get('/api/get_devices'))
+    for since in (0, current + 100):
+        body = client.get(f'/api/get_devices?since_version={since}').get_json()
+        assert body['full'] is True
+        assert ids(body['devices']) == [1, 2]
+        assert body['removed'] == []
+
+
+def test_bad_since_version_is_rejected(client):
+    for since in ('abc', '-1', '1.5'):
+        for path in ('/api/get_devices', '/api/get_connections',
+                     '/api/network/topology/details?mode=temporal&'):
+            separator = '' if path.endswith('&') else '?'
+            response = client.get(f'{path}{separator}since_version={since}')
+            assert response.status_code == 400, (path, since)
+
+
+def test_project_moves_are_removals_and_additions(client, add_devices, db):
+    add_devices(2, project_id=1)
+    add_devices(2, project_id=2, start=3)
+    since_1 = version(client.get('/api/get_devices?project_id=1'))
+    since_2 = version(client.get('/api/get_devices?project_id=2'))
+    assert ids(client.get('/api/get_devices?project_id=1').get_json()) == [1, 2]
+
+    with db.write_connection() as conn:
+        conn.execute('UPDATE devices SET project_id = 2 WHERE id = 1')
+
+    left = client.get(f'/api/get_devices?project_id=1&since_version={since_1}').get_json()
+    assert (left['full'], left['devices'], left['removed']) == (False, [], [1])
+    joined = client.get(f'/api/get_devices?project_id=2&since_version={since_2}').get_json()
+    assert joined['full'] is False
+    assert ids(joined['devices']) == [1]
+    assert joined['removed'] == []
+    assert ids(client.get('/api/get_devices?project_id=2').get_json()) == [1, 3, 4]
+
+
+def test_connections_since_version(client, add_devices):
+    add_devices(3)
+    response = client.post('/api/add_connection', json={
+        'start_device': 1, 'end_device': 2, 'type': 'ethernet', 'bandwidth': 100
+    })
+    assert response.status_code == 201
+    first_id = response.get_json()['connection_id']
+    listing = client.get('/api/get_connections')
+    assert [c['id'] for c in listing.get_json()] == [first_id]
+    since = version(listing)
+    etag = listing.headers['ETag']
+
+    second_id = client.post('/api/add_connection', json={
+        'start_device': 2, 'end_device': 3, 'type': 'fiber', 'bandwidth': 1000
+    }).get_json()['connection_id']
+    assert client.get('/api/get_connections', headers={'If-None-Match': etag}).status_code == 200
+
+    delta = client.get(f'/api/get_connections?since_version={since}').get_json()
+    assert [c['id'] for c in delta['connections']] == [second_id]
+    assert delta['removed'] == []
+
+    # Removing a device removes its connections
+    assert client.delete('/api/remove_device/1').status_code == 200
+    delta = client.get(f'/api/get_connections?since_version={since}').get_json()
+    assert [c['id'] for c in delta['connections']] == [second_id]
+    assert delta['removed'] == [first_id]
+
+
+def test_topology_etag_and_temporal_delta(client, add_devices):
+    add_devices(3)
+    for mode in ('population', 'temporal'):
+        path = f'/api/network/topology/details?mode={mode}'
+        first = client.get(path)
+        assert first.status_code == 200
+        assert client.get(path, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    path = '/api/network/topology/details?mode=temporal'
+    first = client.get(path)
+    since = first.get_json()['version']
+    assert since == version(first)
+
+    response = client.post('/api/device_metrics/batch', json={'samples': [
+        {'device_id': 2, 'cpu': 75, 'memory': 50, 'disk': 50, 'vulnerability': 50}
+    ]})
+    assert response.get_json()['accepted'] == 1
+    drain_workers()
+    assert client.get(path, headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+    assert client.delete('/api/remove_device/3').status_code == 200
+    delta = client.get(f'{path}&since_version={since}').get_json()
+    assert delta['full'] is False
+    assert ids(delta['devices']) == [2]
+    assert delta['devices'][0]['metrics']['cpu_usage'] == 75
+    assert delta['removed'] == [3]
+
+    full = client.get(f'{path}&since_version={delta["version"] + 100}').get_json()
+    assert full['full'] is True
+    assert ids(full['devices']) == [1, 2]
+
+
+def test_population_etag_changes_with_device_state(client, add_devices):
+    add_devices(2)
+    path = '/api/network/topology/details?mode=population'
+    first = client.get(path)
+    assert {device['state'] for device in first.get_json()['devices']} == {None}
+
+    response = client.post('/api/devices/state/evaluate', json={'risks': {'1': 0.95, '2': 0.95}})
+    assert response.get_json()['changed'] == 2
+    second = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert {device['state'] for device in second.get_json()['devices']} != {None}
@@ -0,0 +1,34 @@
+# tests/test_database_pool.py
+
+import pytest
+
+import database
+from database import read_connection, write_connection
+
+
+def device_names():
+    with read_connection() as conn:
+        return [row[0] for row in conn.execute('SELECT name FROM network_devices ORDER BY id')]
+
+
+def test_nested_helpers_share_the_callers_transaction(db):
+    with pytest.raises(RuntimeError):
+        with write_connection():
+            assert database.add_device('inner', '10.0.0.1', 'nested') is not None
+            assert database.update_device(1, 'renamed', '10.0.0.2', 'nested')
+            raise RuntimeError('caller fails after the helpers ran')
+    # Nothing the helpers wrote was committed ahead of the caller
+    assert device_names() == []
+
+
+def test_helpers_commit_on_their_own(db):
+    device_id = database.add_device('solo', '10.0.0.1', 'standalone')
+    assert device_names() == ['solo']
+    assert database.delete_device(device_id)
+    assert device_names() == []
+
+
+def test_get_or_create_numeric_id_reuses_mapping(db):
+    first = database.get_or_create_numeric_id('sensor-a')
+    assert database.get_or_create_numeric_id('sensor-a') == first
+    assert database.get_or_create_numeric_id('sensor-b') != first
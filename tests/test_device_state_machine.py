@@ -0,0 +1,83 @@
+# tests/test_device_state_machine.py
+
+from models.device_state_machine import DeviceStateMachine
+
+
+def states(db):
+    with db.read_connection() as conn:
+        return dict(conn.execute('SELECT device_id, device_state FROM device_latest').fetchall())
+
+
+def test_transition_follows_the_thresholds():
+    machine = DeviceStateMachine()
+    new_states = machine.transition(
+        ['normal', 'normal', 'warning', 'warning', 'warning', 'critical', 'critical', None],
+        [0.5, 0.8, 0.95, 0.95, 0.5, 0.95, 0.95, 0.75],
+        ['none', 'none', 'none', 'mitigated', 'none', 'none', 'mitigated', 'none']
+    )
+    assert new_states.tolist() == [
+        'normal', 'warning', 'critical', 'warning', 'normal', 'critical', 'warning', 'warning'
+    ]
+
+
+def test_evaluate_covers_devices_without_analysis(db, add_devices):
+    add_devices(4)
+    machine = DeviceStateMachine()
+
+    # No analysis anywhere: every device is evaluated, none has a signal
+    assert machine.evaluate(now=100) == {'devices': 4, 'changed': 0, 'transitions': {}}
+
+    result = machine.evaluate(risks={2: 0.8, 3: 0.95}, now=200)
+    assert result == {'devices': 4, 'changed': 2, 'transitions': {'normal->warning': 2}}
+    assert states(db) == {2: 'warning', 3: 'warning'}
+
+    result = machine.evaluate(risks={2: 0.95, 3: 0.95}, admin_actions={3: 'investigating'}, now=300)
+    assert result == {'devices': 4, 'changed': 1, 'transitions': {'warning->critical': 1}}
+    assert states(db) == {2: 'critical', 3: 'warning'}
+
+    result = machine.evaluate(admin_actions={2: 'mitigated'}, device_ids=[2], now=400)
+    assert result == {'devices': 1, 'changed': 1, 'transitions': {'critical->warning': 1}}
+
+    # Without a risk override device 3 has no signal and recovers
+    result = machine.evaluate(now=500)
+    assert result['transitions'] == {'warning->normal': 2}
+    assert states(db) == {2: 'normal', 3: 'normal'}
+
+    with db.read_connection() as conn:
+        log = conn.execute('SELECT device_id, from_state, to_state, changed_at '
+                           'FROM device_state_transitions ORDER BY id').fetchall()
+    assert [tuple(row) for row in log] == [
+        (2, 0, 1, 200), (3, 0, 1, 200), (2, 1, 2, 300), (2, 2, 1, 400), (2, 1, 0, 500), (3, 1, 0, 500)
+    ]
+
+
+def test_changed_since_aggregates_per_device_and_limits_in_order(db, add_devices):
+    add_devices(3)
+    machine = DeviceStateMachine()
+    machine.evaluate(risks={3: 0.8}, now=100)
+    machine.evaluate(risks={1: 0.8, 3: 0.95}, now=200)
+    machine.evaluate(risks={1: 0.95, 2: 0.8, 3: 0.95}, now=300)
+
+    assert machine.changed_since(0) == [
+        {'device_id': 3, 'from_state': 'normal', 'state': 'critical', 'transitions': 2, 'changed_at': 200},
+        {'device_id': 1, 'from_state': 'normal', 'state': 'critical', 'transitions': 2, 'changed_at': 300},
+        {'device_id': 2, 'from_state': 'normal', 'state': 'warning', 'transitions': 1, 'changed_at': 300},
+    ]
+    assert [d['device_id'] for d in machine.changed_since(0, limit=2)] == [3, 1]
+    assert machine.changed_since(250) == [
+        {'device_id': 1, 'from_state': 'warning', 'state': 'critical', 'transitions': 1, 'changed_at': 300},
+        {'device_id': 2, 'from_state': 'normal', 'state': 'warning', 'transitions': 1, 'changed_at': 300},
+    ]
+    assert machine.changed_since(301) == []
+
+
+def test_state_routes(client, add_devices):
+    add_devices(2)
+    response = client.post('/api/devices/state/evaluate', json={'risks': {'1': 0.8}})
+    assert response.status_code == 200
+    assert response.get_json()['transitions'] == {'normal->warning': 1}
+
+    changes = client.get('/api/devices/state_changes?since=0').get_json()
+    assert [d['device_id'] for d in changes['devices']] == [1]
+    assert client.get('/api/devices/state_changes').status_code == 400
+    assert client.post('/api/devices/state/evaluate', json={'risks': {'x': 1}}).status_code == 400
@@ -0,0 +1,63 @@
+# tests/test_ema_routes.py
+
+from models.ema_state import ema_state
+
+CIP_REQUEST = {
+    'cip_values': {'cpu': 0.5}, 'weights': {'cpu': 1.0},
+    'mean': {'cpu': 0.4}, 'std_dev': {'cpu': 0.1}
+}
+
+
+def test_process_cip_parameters_coerces_device_id(client):
+    response = client.post('/api/cip/process_cip_parameters', json=dict(CIP_REQUEST, device_id='7'))
+    assert response.status_code == 200
+    assert ema_state.get_emas([7])[7]['cpu']
+
+
+def test_process_cip_parameters_rejects_bad_input_without_touching_state(client):
+    for device_id in ('abc', 1.5, None, True, [1]):
+        response = client.post('/api/cip/process_cip_parameters', json=dict(CIP_REQUEST, device_id=device_id))
+        assert response.status_code == 400, device_id
+    response = client.post('/api/cip/process_cip_parameters',
+                           json=dict(CIP_REQUEST, device_id=7, cip_values={'cpu': 'high'}))
+    assert response.status_code == 400
+    response = client.post('/api/cip/process_cip_parameters',
+                           json=dict(CIP_REQUEST, device_id=7, previous_ema={'cpu': 'x'}))
+    assert response.status_code == 400
+    assert ema_state.get_emas([7]) == {}
+
+
+def test_adjusted_metrics_validates_device_id(client):
+    body = {'cpu_usage': 50, 'memory_usage': 0.5, 'risk_level': 1}
+    assert client.post('/api/adjusted_metrics', json=dict(body, device_id='x')).status_code == 400
+    assert client.post('/api/adjusted_metrics', json=dict(body, device_id='3')).status_code == 200
+    assert client.post('/api/adjusted_metrics', json=body).status_code == 200
+
+
+def test_process_cip_parameters_validates_everything_before_saving_state(client):
+    two_keys = {
+        'device_id': 7, 'cip_values': {'a': 0.5, 'b': 0.6}, 'weights': {'a': 1.0, 'b': 1.0},
+        'mean': {'a': 0.4, 'b': 0.5}, 'std_dev': {'a': 0.1, 'b': 0.1}
+    }
+    bad_requests = [
+        dict(two_keys, alpha='x'),
+        dict(two_keys, alpha=True),
+        dict(two_keys, alpha=0.37),
+        dict(two_keys, mean={'a': 0.4}),
+        dict(two_keys, std_dev={'a': 0.1, 'b': 'wide'}),
+        dict(two_keys, std_dev={'a': 0.1, 'b': 0}),
+        dict(two_keys, weights={'a': 1.0}),
+        dict(two_keys, weights={'a': 1.0, 'b': 1.0, 'c': 1.0}),
+        dict(two_keys, cip_values={'a': 0.5, 'b': None}),
+        dict(two_keys, cip_values={}),
+    ]
+    for body in bad_requests:
+        response = client.post('/api/cip/process_cip_parameters', json=body)
+        assert response.status_code == 400, body
+    assert ema_state.get_emas([7]) == {}
+
+    response = client.post('/api/cip/process_cip_parameters',
+                           json=dict(two_keys, alpha=0.1, previous_ema={'a': 0.3, 'other': 1.0}))
+    assert response.status_code == 200
+    assert response.get_json()['ema'] == {'a': 0.3 + 0.1 * (0.5 - 0.3), 'b': 0.6}
+    assert set(ema_state.get_emas([7])[7]) == {'a', 'b'}
@@ -0,0 +1,106 @@
+# tests/test_metric_rollups.py
+
+import time
+
+import pytest
+
+import database
+from database import (
+    HISTORY_METRICS, format_timestamp, prune_metrics_history, read_connection,
+    rebuild_metric_rollups, update_metric_rollups, write_connection
+)
+from utils.metrics_ingest import write_metric_samples
+
+DAY = 86400
+
+
+def row(device_id, cpu, epoch):
+    return (device_id, cpu, *[1.0] * (len(HISTORY_METRICS) - 1), epoch)
+
+
+def rollup_rows(table):
+    with read_connection() as conn:
+        return [tuple(r) for r in conn.execute(f'''
+            SELECT device_id, bucket_start, sample_count, cpu_usage_min, cpu_usage_max, cpu_usage_mean
+            FROM {table} ORDER BY device_id, bucket_start
+        ''')]
+
+
+def history_count():
+    with read_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM device_metrics_history').fetchone()[0]
+
+
+def test_rollups_merge_samples_across_calls(db):
+    with write_connection() as conn:
+        update_metric_rollups(conn, [row(1, 10.0, 3600), row(1, 30.0, 3610)])
+        update_metric_rollups(conn, [row(1, 50.0, 3620)])
+    assert rollup_rows('device_metrics_rollup_1h') == [(1, 3600, 3, 10.0, 50.0, 30.0)]
+    assert rollup_rows('device_metrics_rollup_1m') == [(1, 3600, 3, 10.0, 50.0, 30.0)]
+
+
+def test_incremental_rollups_match_rebuild_from_history(db, add_devices):
+    add_devices(2)
+    base = time.time() - 2 * DAY
+    rows = [row(device_id, float(i * device_id % 97), base + i * 37)
+            for i in range(400) for device_id in (1, 2)]
+    with write_connection() as conn:
+        write_metric_samples(conn, rows)
+    incremental = {table: rollup_rows(table) for _, _, table, _ in database.ROLLUP_RESOLUTIONS}
+
+    with write_connection() as conn:
+        rebuild_metric_rollups(conn)
+    for table, expected in incremental.items():
+        rebuilt = rollup_rows(table)
+        assert [r[:5] for r in rebuilt] == [r[:5] for r in expected]
+        assert [r[5] for r in rebuilt] == pytest.approx([r[5] for r in expected])
+
+
+def insert_history(epochs):
+    with write_connection() as conn:
+        conn.executemany('''
+            INSERT INTO device_metrics_history (device_id, cpu_usage, timestamp) VALUES (1, 1, ?)
+        ''', [(format_timestamp(epoch),) for epoch in epochs])
+        rebuild_metric_rollups(conn)
+
+
+def test_raw_history_is_kept_without_configured_retention(db, monkeypatch):
+    monkeypatch.setattr(database, 'RAW_RETENTION_DAYS', None)
+    now = time.time()
+    insert_history([now - 400 * DAY, now - 10 * DAY, now])
+    with write_connection() as conn:
+        assert prune_metrics_history(conn, now=now, force=True) == 0
+    assert history_count() == 3
+
+
+def test_configured_retention_prunes_only_expired_raw_rows(db, monkeypatch):
+    monkeypatch.setattr(database, 'RAW_RETENTION_DAYS', 7)
+    now = time.time()
+    insert_history([now - 400 * DAY, now - 10 * DAY, now - DAY, now])
+    with write_connection() as conn:
+        assert prune_metrics_history(conn, now=now, force=True) == 2
+    assert history_count() == 2
+    # The hourly and daily rollups keep the pruned samples' aggregates
+    assert sum(r[2] for r in rollup_rows('device_metrics_rollup_1d')) == 4
+
+
+def test_retention_waits_for_rollup_backfill(db, monkeypatch):
+    monkeypatch.setattr(database, 'RAW_RETENTION_DAYS', 7)
+    now = time.time()
+    with write_connection() as conn:
+        conn.execute('INSERT INTO device_metrics_history (device_id, cpu_usage, timestamp) VALUES (1, 1, ?)',
+                     (format_timestamp(now - 30 * DAY),))
+        assert prune_metrics_history(conn, now=now, force=True) == 0
+    assert history_count() == 1
+
+
+def test_prune_is_rate_limited_unless_forced(db, monkeypatch):
+    monkeypatch.setattr(database, 'RAW_RETENTION_DAYS', 7)
+    now = time.time()
+    insert_history([now - 30 * DAY])
+    with write_connection() as conn:
+        prune_metrics_history(conn, now=now, force=True)
+    insert_history([now - 30 * DAY])
+    with write_connection() as conn:
+        assert prune_metrics_history(conn, now=now) == 0
+        assert prune_metrics_history(conn, now=now, force=True) == 1
@@ -0,0 +1,35 @@
+# tests/test_metrics_ingest.py
+
+from database import read_connection
+
+
+def sample(device_id, cpu=10):
+    return {'device_id': device_id, 'cpu': cpu, 'memory': 20, 'disk': 30,
+            'vulnerability': 40, 'network': 5, 'temperature': 50}
+
+
+def test_batch_writes_known_devices_and_rejects_unknown(client, add_devices):
+    add_devices(3)
+    response = client.post('/api/device_metrics/batch', json={
+        'samples': [sample(1), sample(2, cpu=70), sample(99), {'cpu': 1}]
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['accepted'] == 2
+    assert body['rejected'] == 2
+    assert [result['success'] for result in body['results']] == [True, True, False, False]
+    assert body['results'][2]['error'] == 'Device not found'
+
+    with read_connection() as conn:
+        history = conn.execute('SELECT device_id, cpu_usage FROM device_metrics_history ORDER BY device_id').fetchall()
+        current = conn.execute('SELECT cpu_usage FROM devices WHERE id = 2').fetchone()[0]
+    assert [tuple(row) for row in history] == [(1, 10.0), (2, 70.0)]
+    assert current == 70
+
+
+def test_batch_rejects_empty_and_oversized_requests(client):
+    assert client.post('/api/device_metrics/batch', json={'samples': []}).status_code == 400
+    from utils.metrics_ingest import MAX_BATCH_SAMPLES
+    response = client.post('/api/device_metrics/batch',
+                           json={'samples': [sample(1)] * (MAX_BATCH_SAMPLES + 1)})
+    assert response.status_code == 413
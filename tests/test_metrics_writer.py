@@ -0,0 +1,66 @@
+# tests/test_metrics_writer.py
+
+from database import read_connection, write_connection
+from utils.metrics_ingest import MetricsWriter, get_metrics_writer, normalize_sample
+
+
+def history_count(device_id=None):
+    with read_connection() as conn:
+        if device_id is None:
+            return conn.execute('SELECT COUNT(*) FROM device_metrics_history').fetchone()[0]
+        return conn.execute('SELECT COUNT(*) FROM device_metrics_history WHERE device_id = ?',
+                            (device_id,)).fetchone()[0]
+
+
+def test_stop_flushes_queued_samples(add_devices):
+    add_devices(5)
+    # A flush interval far longer than the test: only stop() can write the batch
+    writer = MetricsWriter(flush_ms=60000, batch_rows=1000)
+    writer.start()
+    for device_id in range(1, 6):
+        assert writer.submit(normalize_sample(device_id, {'cpu': device_id}))
+    writer.stop()
+
+    assert history_count() == 5
+    stats = writer.stats()
+    assert stats['written'] == 5
+    assert stats['queue_depth'] == 0
+    assert not stats['running']
+
+
+def test_samples_of_devices_deleted_while_queued_are_counted_as_dropped(add_devices):
+    add_devices(2)
+    writer = MetricsWriter(flush_ms=60000, batch_rows=1000)
+    writer.start()
+    writer.submit(normalize_sample(1, {}))
+    writer.submit(normalize_sample(2, {}))
+    with write_connection() as conn:
+        conn.execute('DELETE FROM devices WHERE id = 2')
+    writer.stop()
+
+    assert history_count(1) == 1
+    assert history_count(2) == 0
+    assert writer.stats()['dropped'] == 1
+
+
+def test_put_queues_sample_of_known_device(client, add_devices):
+    add_devices(1)
+    response = client.put('/api/device_metrics/1', json={'cpu': 55})
+    assert response.status_code == 202
+    get_metrics_writer().flush(10)
+    assert history_count(1) == 1
+
+
+def test_put_rejects_unknown_and_malformed_devices(client, add_devices):
+    add_devices(1)
+    submitted = get_metrics_writer().stats()['submitted']
+
+    response = client.put('/api/device_metrics/42', json={'cpu': 1})
+    assert response.status_code == 404
+    response = client.put('/api/device_metrics/abc', json={'cpu': 1})
+    assert response.status_code == 400
+    assert 'expected an integer' in response.get_json()['error']
+    response = client.put('/api/device_metrics/1', json={'cpu': 'high'})
+    assert response.status_code == 400
+
+    assert get_metrics_writer().stats()['submitted'] == submitted
@@ -0,0 +1,72 @@
+# tests/test_model_registry.py
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from models.logistic_regression import (
+    incremental_threshold_adaptation, logistic_regression_threshold_adaptation
+)
+from models.model_registry import ModelRegistry, model_registry, training_fingerprint
+
+X_TEST = np.array([[2.0, -1.0, 0.0], [-2.0, 1.0, 0.0]])
+
+
+def events(count, seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(count, 3))
+    y = (X @ [2.0, -1.0, 0.5] + rng.normal(size=count) > 0).astype(int)
+    return X, y
+
+
+@pytest.fixture
+def registry(db):
+    model_registry._cache.clear()
+    yield model_registry
+    model_registry._cache.clear()
+
+
+def test_incremental_update_continues_from_the_batch_model(registry):
+    X, y = events(2000, 0)
+    batch = logistic_regression_threshold_adaptation(X, y, X_TEST)
+    assert batch[0] > 0.99 and batch[1] < 0.01
+
+    X_new, _ = events(5, 1)
+    updated = incremental_threshold_adaptation(X_new, np.ones(5, dtype=int), X_TEST)
+    assert updated == pytest.approx(batch, abs=1e-3)
+
+    versions = registry.versions('threshold_adaptation')
+    assert [(v['version'], v['estimator']) for v in versions] == [
+        (2, 'SGDClassifier'), (1, 'LogisticRegression')
+    ]
+    assert versions[0]['samples_seen'] == 2005
+
+    # Refitting on the same history reuses version 1 instead of registering a copy
+    assert logistic_regression_threshold_adaptation(X, y, X_TEST) == pytest.approx(batch)
+    assert len(registry.versions('threshold_adaptation')) == 2
+
+
+def test_incremental_model_without_a_batch_fit(registry):
+    X, y = events(500, 2)
+    for start in range(0, 500, 100):
+        incremental_threshold_adaptation(X[start:start + 100], y[start:start + 100], X_TEST,
+                                         feature_set='incremental')
+    versions = registry.versions('incremental')
+    assert [(v['version'], v['samples_seen']) for v in versions] == [(1, 500)]
+    assert registry.predict_proba('incremental', X_TEST)[0] > 0.5
+
+
+def test_fit_reuses_any_kept_version_with_the_same_data(db):
+    registry = ModelRegistry(keep=3)
+    fits = [events(50, seed) for seed in range(5)]
+    for X, y in fits:
+        registry.fit('kept', X, y, LogisticRegression)
+    versions = registry.versions('kept')
+    assert [v['version'] for v in versions] == [5, 4, 3]
+    assert versions[-1]['training_hash'] == training_fingerprint(*fits[2])
+
+    assert registry.fit('kept', *fits[2], lambda: None)['version'] == 3
+    # Pruned data is fitted again as a new version
+    assert registry.fit('kept', *fits[0], LogisticRegression)['version'] == 6
+    assert [v['version'] for v in registry.versions('kept')] == [6, 5, 4]
+    assert registry.get('kept', 3) is None
@@ -0,0 +1,29 @@
+# tests/test_models_batch.py
+
+import numpy as np
+
+from benchmarks.bench_models_batch import FACTORS, check, make_fleet
+from models.factor_arrays import factor_matrix
+from models.user_risk_score import calculate_user_risk_score, calculate_user_risk_score_batch
+
+
+def test_batch_models_match_scalar_models():
+    check(make_fleet(500, seed=3), 500)
+
+
+def test_factor_matrix_reorders_structured_fields():
+    fleet = make_fleet(10)['factors']
+    keys = FACTORS[::-1]
+    expected = np.column_stack([fleet[key] for key in keys])
+    assert np.array_equal(factor_matrix(fleet, keys), expected)
+
+
+def test_user_risk_batch_with_per_device_stds():
+    weights = {'a': 0.5, 'b': -2.0}
+    activities = np.array([[1.0, 4.0], [3.0, 2.0]])
+    stds = np.array([[2.0, 0.0], [0.5, 1.0]])
+    expected = [calculate_user_risk_score(dict(zip(weights, row)), {'a': 1.0, 'b': 1.0},
+                                          dict(zip(weights, std)), weights)
+                for row, std in zip(activities, stds)]
+    result = calculate_user_risk_score_batch(activities, {'a': 1.0, 'b': 1.0}, stds, weights)
+    assert np.allclose(result, expected)
@@ -0,0 +1,74 @@
+# tests/test_rankings_pagination.py
+
+import random
+
+import pytest
+
+from database import DEVICE_METRICS, write_connection
+from models.device_zscore import DeviceZScore
+from models.robust_zscore import RobustDeviceZScore
+
+
+@pytest.fixture
+def fleet(add_devices):
+    add_devices(240)
+    rng = random.Random(7)
+    with write_connection() as conn:
+        # Distinct values so the |z| order has no ties; a few devices without metrics
+        values = rng.sample(range(100000), 240 * len(DEVICE_METRICS))
+        conn.executemany(f'''
+            UPDATE devices SET {', '.join(f'{m} = ?' for m in DEVICE_METRICS)} WHERE id = ?
+        ''', [(*[v / 1000 for v in values[i * 4:i * 4 + 4]], i + 1) for i in range(230)])
+
+
+def walk(fetch_page):
+    pages, cursor = [], None
+    while True:
+        page, cursor = fetch_page(cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.parametrize('analyzer_class', [DeviceZScore, RobustDeviceZScore])
+def test_ranking_pages_reproduce_the_full_ranking(fleet, analyzer_class):
+    analyzer = analyzer_class()
+    full = analyzer.get_metric_rankings()
+    pages = walk(lambda cursor: analyzer.get_metric_rankings_page(17, cursor))
+
+    for metric in DEVICE_METRICS:
+        paged = [entry for page in pages for entry in page.get(metric, [])]
+        assert [e['device_id'] for e in paged] == [e['device_id'] for e in full[metric]]
+        assert [e['zscore'] for e in paged] == pytest.approx([e['zscore'] for e in full[metric]], abs=1e-9)
+        assert all(len(page.get(metric, [])) <= 17 for page in pages)
+
+
+def test_ranking_cursor_pins_the_baseline(fleet):
+    analyzer = DeviceZScore()
+    first, cursor = analyzer.get_metric_rankings_page(10)
+    full = analyzer.get_metric_rankings()
+    # A write between pages does not shift the rest of the walk
+    with write_connection() as conn:
+        conn.execute('UPDATE devices SET cpu_usage = 1000 WHERE id = 230')
+    second, _ = analyzer.get_metric_rankings_page(10, cursor)
+    assert [e['device_id'] for e in first['cpu_usage'] + second['cpu_usage']] == \
+        [e['device_id'] for e in full['cpu_usage'][:20]]
+
+
+def test_anomaly_pages_reproduce_the_full_list(fleet):
+    analyzer = DeviceZScore()
+    full = analyzer.get_anomalous_devices(threshold=1.5)
+    assert full
+    pages = walk(lambda cursor: analyzer.get_anomalous_devices_page(1.5, 5, cursor))
+    paged = [entry for page in pages for entry in page]
+    assert flatten(paged) == flatten(full)
+
+
+def flatten(anomalies):
+    return sorted((entry['device_id'], a['metric'], a['value'], round(a['zscore'], 9), a['status'])
+                  for entry in anomalies for a in entry['anomalies'])
+
+
+def test_invalid_cursor_is_rejected(fleet):
+    with pytest.raises(ValueError):
+        DeviceZScore().get_metric_rankings_page(10, cursor='not-a-cursor')
@@ -0,0 +1,276 @@
+# tests/test_recalculation_jobs.py
+
+import threading
+import time
+
+import pytest
+
+import utils.recalculation_jobs as recalculation_jobs
+from models.risk_profile import risk_profiles
+
+
+@pytest.fixture
+def gate(db, monkeypatch):
+    """Hold every chunk of a running job until the gate is opened."""
+    gate = threading.Event()
+    started = threading.Event()
+    score_device_chunk = recalculation_jobs.score_device_chunk
+
+    def gated(profile, id_range):
+        started.set()
+        gate.wait(10)
+        return score_device_chunk(profile, id_range)
+
+    monkeypatch.setattr(recalculation_jobs, 'score_device_chunk', gated)
+    risk_profiles.invalidate()
+    gate.started = started
+    gate.score_device_chunk = score_device_chunk
+    yield gate
+    gate.set()
+    risk_profiles.invalidate()
+
+
+@pytest.fixture
+def make_manager(db):
+    """Build managers sharing the test database, stopped at teardown."""
+    managers = []
+
+    def make(**settings):
+        settings = {'workers': 2, 'chunk_devices': 2, 'write_chunks': 1, 'poll_seconds': 0.05, **settings}
+        managers.append(recalculation_jobs.RecalculationJobManager(**settings))
+        return managers[-1]
+    yield make
+    for manager in managers:
+        manager.stop(10)
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
+
+
+def add_control(db, name):
+    return db.add_cip_control(name, '{"cpu_usage": 0.5, "memory_usage": 0.5}')
+
+
+def scores(db, control_id):
+    with db.read_connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM device_risk_scores WHERE control_id = ?',
+                            (control_id,)).fetchone()[0]
+
+
+def test_job_scores_every_device(db, add_devices, gate, manager):
+    add_devices(5)
+    control_id = add_control(db, 'access')
+    gate.set()
+    job = manager.wait(manager.submit(control_id).id, 10)
+    assert job.to_dict()['status'] == 'completed'
+    assert (job.devices, job.processed, job.chunks, job.chunks_done) == (5, 5, 3, 3)
+    assert scores(db, control_id) == 5
+
+
+def test_cancel_queued_job(db, add_devices, gate, manager):
+    add_devices(4)
+    first, second = add_control(db, 'first'), add_control(db, 'second')
+    running = manager.submit(first)
+    assert gate.started.wait(10)
+    queued = manager.submit(second)
+    assert queued.status == 'queued'
+
+    cancelled = manager.cancel(queued.id)
+    assert cancelled.id == queued.id
+    assert cancelled.status == 'cancelled' and cancelled.finished_at is not None
+
+    gate.set()
+    assert manager.wait(running.id, 10).status == 'completed'
+    assert manager.wait(queued.id, 1).started_at is None
+    assert scores(db, second) == 0
+
+
+def test_cancel_running_job_writes_nothing(db, add_devices, gate, manager):
+    add_devices(4)
+    control_id = add_control(db, 'access')
+    job = manager.submit(control_id)
+    assert gate.started.wait(10)
+    assert manager.get(job.id).status == 'running'
+
+    manager.cancel(job.id)
+    gate.set()
+    job = manager.wait(job.id, 10)
+    assert job.status == 'cancelled'
+    assert job.processed == 0
+    assert scores(db, control_id) == 0
+
+    # Cancelling a finished job leaves it unchanged; unknown ids return None
+    assert manager.cancel(job.id).status == 'cancelled'
+    assert manager.cancel('unknown') is None
+
+
+def test_edits_supersede_the_running_job_and_coalesce_while_queued(db, add_devices, gate, manager):
+    add_devices(4)
+    control_id = add_control(db, 'access')
+    running = manager.submit(control_id)
+    assert gate.started.wait(10)
+
+    queued = manager.submit(control_id)
+    assert queued.id != running.id
+    coalesced = manager.submit(control_id)
+    assert coalesced.id == queued.id and coalesced.edits == 2
+
+    gate.set()
+    assert manager.wait(running.id, 10).status == 'superseded'
+    assert manager.wait(queued.id, 10).status == 'completed'
+    assert [job.id for job in manager.list(control_id)] == [queued.id, running.id]
+    assert scores(db, control_id) == 4
+
+
+def test_cancel_route_returns_404_for_unknown_jobs(client):
+    response = client.delete('/api/cip/jobs/unknown')
+    assert response.status_code == 404
+
+
+def stored_versions(db, control_id):
+    with db.read_connection() as conn:
+        return conn.execute('''
+            SELECT version, COUNT(*) FROM device_risk_scores WHERE control_id = ? GROUP BY version
+        ''', (control_id,)).fetchall()
+
+
+def test_cancel_after_partial_writes_keeps_the_previous_scores(db, add_devices, gate, make_manager, monkeypatch):
+    add_devices(4)
+    control_id = add_control(db, 'access')
+    manager = make_manager(workers=1, chunk_devices=1)
+    gate.set()
+    assert manager.wait(manager.submit(control_id).id, 10).status == 'completed'
+    assert [tuple(row) for row in stored_versions(db, control_id)] == [(1, 4)]
+
+    # Chunks of devices 1 and 2 are written, device 3 holds the job
+    def hold_from_device_3(profile, id_range):
+        if id_range[0] >= 3:
+            gate.wait(10)
+        return gate.score_device_chunk(profile, id_range)
+
+    monkeypatch.setattr(recalculation_jobs, 'score_device_chunk', hold_from_device_3)
+    gate.clear()
+    db.update_cip_control(control_id, 'access', '{"cpu_usage": 1.0}')
+    job = manager.submit(control_id)
+    deadline = time.monotonic() + 10
+    while manager.get(job.id).processed < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.get(job.id).processed == 2
+
+    manager.cancel(job.id)
+    gate.set()
+    assert manager.wait(job.id, 10).status == 'cancelled'
+    assert [tuple(row) for row in stored_versions(db, control_id)] == [(1, 4)]
+    with db.read_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM device_risk_scores_staging').fetchone()[0] == 0
+
+
+def test_scores_route_serves_stored_scores_of_the_current_version(client, db, add_devices, gate, manager):
+    add_devices(3)
+    with db.write_connection() as conn:
+        conn.executemany('UPDATE devices SET cpu_usage = ?, memory_usage = ? WHERE id = ?',
+                         [(10, 10, 1), (90, 90, 2), (50, 50, 3)])
+    control_id = add_control(db, 'access')
+    path = f'/api/cip/controls/{control_id}/scores'
+    live = client.get(path).get_json()
+    assert live['source'] == 'live'
+
+    gate.set()
+    assert manager.wait(manager.submit(control_id).id, 10).status == 'completed'
+    stored = client.get(path).get_json()
+    assert stored['source'] == 'stored'
+    assert stored['devices'] == 3
+    assert [s['device_id'] for s in stored['scores']] == [2, 3, 1]
+    assert stored['scores'] == pytest.approx(live['scores'])
+    assert client.get(f'{path}?live=1').get_json()['source'] == 'live'
+    assert client.get(f'{path}?project_id=99').get_json()['devices'] == 0
+
+    # A newer version of the control is scored live until its job completes
+    db.update_cip_control(control_id, 'access', '{"cpu_usage": 1.0}')
+    assert client.get(path).get_json()['source'] == 'live'
+
+
+def test_wait_survives_the_job_being_trimmed(db, add_devices, gate, make_manager):
+    add_devices(2)
+    control_id = add_control(db, 'access')
+    manager = make_manager(workers=1, history=0)
+    job = manager.submit(control_id)
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(manager.wait(job.id, 10)))
+    waiter.start()
+    gate.set()
+    waiter.join(10)
+    assert [(w.id, w.status) for w in waited] == [(job.id, 'completed')]
+
+    # The next submit trims the finished job from the history
+    assert manager.wait(manager.submit(control_id).id, 10).status == 'completed'
+    assert manager.get(job.id) is None
+    assert manager.wait(job.id, 1) is None
+
+
+def test_workers_share_jobs_and_never_run_a_control_twice(db, add_devices, gate, make_manager):
+    add_devices(4)
+    control_id = add_control(db, 'access')
+    first, second = make_manager(), make_manager()
+    second.start()
+    running = first.submit(control_id)
+    assert gate.started.wait(10)
+    assert second.get(running.id).status == 'running'
+
+    # The edit lands on the other worker: it supersedes the run and queues
+    # a job no dispatcher claims while the control is still running
+    queued = second.submit(control_id)
+    assert first.submit(control_id).id == queued.id
+    assert [job.status for job in second.list(control_id)] == ['queued', 'running']
+
+    gate.set()
+    assert second.wait(running.id, 10).status == 'superseded'
+    assert first.wait(queued.id, 10).status == 'completed'
+    assert scores(db, control_id) == 4
+
+
+def test_cancel_from_another_worker_stops_the_run(db, add_devices, gate, make_manager):
+    add_devices(4)
+    control_id = add_control(db, 'access')
+    runner, other = make_manager(), make_manager()
+    job = runner.submit(control_id)
+    assert gate.started.wait(10)
+
+    assert other.cancel(job.id).status == 'running'
+    gate.set()
+    assert other.wait(job.id, 10).status == 'cancelled'
+    assert scores(db, control_id) == 0
+    with db.read_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM device_risk_scores_staging').fetchone()[0] == 0
+
+
+def test_jobs_of_a_dead_worker_run_again_once_their_lease_expires(db, add_devices, gate, make_manager):
+    add_devices(4)
+    first, second = add_control(db, 'first'), add_control(db, 'second')
+    now = time.time()
+    with db.write_connection() as conn:
+        conn.executemany('''
+            INSERT INTO recalculation_jobs (id, control_id, status, processed, lease_id, lease_expires,
+                                            created_at, started_at)
+            VALUES (?, ?, 'running', 2, ?, ?, ?, ?)
+        ''', [('orphan', first, 'dead-1', now - 1, now - 10, now - 10),
+              ('stale', second, 'dead-2', now - 1, now - 10, now - 10)])
+        conn.execute('''
+            INSERT INTO recalculation_jobs (id, control_id, status, created_at) VALUES ('newer', ?, 'queued', ?)
+        ''', (second, now - 5))
+        conn.execute('''
+            INSERT INTO device_risk_scores_staging (run_id, device_id, sigmoid_risk, weighted_score)
+            VALUES ('dead-1', 1, 0.5, 0.5)
+        ''')
+
+    manager = make_manager()
+    gate.set()
+    manager.start()
+    assert manager.wait('orphan', 10).status == 'completed'
+    assert manager.wait('stale', 10).status == 'superseded'
+    assert manager.wait('newer', 10).status == 'completed'
+    assert scores(db, first) == 4 and scores(db, second) == 4
+    with db.read_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM device_risk_scores_staging').fetchone()[0] == 0
@@ -0,0 +1,51 @@
+# tests/test_topology_modes.py
+
+from conftest import drain_workers
+from models.device_baseline import BASELINE_MIN_SAMPLES
+
+
+def ingest(client, device_id, cpu):
+    response = client.post('/api/device_metrics/batch', json={'samples': [
+        {'device_id': device_id, 'cpu': cpu, 'memory': 50, 'disk': 50, 'vulnerability': 50}
+    ]})
+    assert response.get_json()['accepted'] == 1
+    drain_workers()
+
+
+def devices_by_id(response):
+    assert response.status_code == 200
+    return {device['id']: device for device in response.get_json()['devices']}
+
+
+def test_population_mode_is_the_default(client, add_devices):
+    add_devices(3)
+    for device_id, cpu in ((1, 10), (2, 20), (3, 90)):
+        ingest(client, device_id, cpu)
+
+    default = client.get('/api/network/topology/details').get_json()
+    assert default['mode'] == 'population'
+    assert all('analysis' in device for device in default['devices'])
+    assert default == client.get('/api/network/topology/details?mode=population').get_json()
+
+    temporal = client.get('/api/network/topology/details?mode=temporal').get_json()
+    assert temporal['mode'] == 'temporal'
+    assert not any('analysis' in device for device in temporal['devices'])
+
+
+def test_temporal_mode_scores_against_the_devices_own_baseline(client, add_devices):
+    add_devices(2)
+    # Device 2 runs hot all along; against its own baseline it is not anomalous
+    for cpu in (10, 12, 9, 11, 10, 12, 9, 11)[:BASELINE_MIN_SAMPLES + 2]:
+        ingest(client, 1, cpu)
+        ingest(client, 2, cpu + 80)
+    ingest(client, 1, 95)
+    ingest(client, 2, 91)
+
+    devices = devices_by_id(client.get('/api/network/topology/details?mode=temporal'))
+    assert devices[1]['zscores']['cpu_usage']['zscore'] > 3
+    assert abs(devices[2]['zscores']['cpu_usage']['zscore']) < 2
+
+
+def test_invalid_mode_and_population_delta_are_rejected(client):
+    assert client.get('/api/network/topology/details?mode=fleet').status_code == 400
+    assert client.get('/api/network/topology/details?since_version=1').status_code == 400
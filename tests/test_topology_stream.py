@@ -0,0 +1,133 @@
+# tests/test_topology_stream.py
+
+import json
+
+import blueprints.network_visualization as network_visualization
+from conftest import drain_workers
+from utils.topology_stream import TopologyStream
+
+
+def parse_event(message):
+    """Split one serialized event into (event, id, data)."""
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    return fields['event'], int(fields['id']), json.loads(fields['data'])
+
+
+class FakeTopology:
+    """Topology and version the tests change by hand."""
+
+    def __init__(self, devices):
+        self.devices = dict(devices)
+        self.version = 1
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return dict(self.devices)
+
+    def load_version(self):
+        return self.version
+
+
+def test_snapshot_then_deltas_of_changed_and_removed_devices():
+    topology = FakeTopology({1: {'id': 1, 'cpu': 10}, 2: {'id': 2, 'cpu': 20}, 3: {'id': 3, 'cpu': 30}})
+    stream = TopologyStream(topology.load, topology.load_version, interval=3600)
+    viewer = stream.subscribe()
+
+    event, event_id, data = parse_event(viewer.next(0))
+    assert (event, event_id) == ('snapshot', 0)
+    assert data['devices'] == [{'id': 1, 'cpu': 10}, {'id': 2, 'cpu': 20}, {'id': 3, 'cpu': 30}]
+
+    topology.devices[2] = {'id': 2, 'cpu': 90}
+    del topology.devices[3]
+    topology.version = 2
+    assert stream.publish() == 2
+    event, event_id, data = parse_event(viewer.next(0))
+    assert (event, event_id) == ('delta', 1)
+    assert data == {'devices': [{'id': 2, 'cpu': 90}], 'removed': [3]}
+
+    # A later viewer starts from the current snapshot
+    late = stream.subscribe()
+    assert parse_event(late.next(0))[2]['devices'] == [{'id': 1, 'cpu': 10}, {'id': 2, 'cpu': 90}]
+    assert viewer.next(0) is None
+
+
+def test_unchanged_version_skips_the_reload():
+    topology = FakeTopology({1: {'id': 1, 'cpu': 10}})
+    stream = TopologyStream(topology.load, topology.load_version, interval=3600)
+    viewer = stream.subscribe()
+    viewer.next(0)
+
+    assert stream.publish() == 0
+    assert topology.loads == 1
+    assert stream.stats()['skipped'] == 1
+
+    # A version bump without a visible change reloads but sends nothing
+    topology.version = 2
+    assert stream.publish() == 0
+    assert topology.loads == 2
+    assert viewer.next(0) is None
+    assert stream.stats()['deltas'] == 0
+
+
+def test_viewer_that_falls_behind_is_resynchronized_with_a_snapshot():
+    topology = FakeTopology({1: {'id': 1, 'cpu': 0}})
+    stream = TopologyStream(topology.load, topology.load_version, interval=3600, backlog=2)
+    viewer = stream.subscribe()
+    for cpu in range(1, 4):
+        topology.devices[1] = {'id': 1, 'cpu': cpu}
+        topology.version += 1
+        stream.publish()
+
+    event, event_id, data = parse_event(viewer.next(0))
+    assert (event, event_id) == ('snapshot', 3)
+    assert data['devices'] == [{'id': 1, 'cpu': 3}]
+    assert viewer.next(0) is None
+    assert stream.stats()['resyncs'] == 1
+
+
+def test_stream_follows_ingest_and_device_deletion(client, add_devices):
+    add_devices(3)
+    stream = TopologyStream(network_visualization.load_temporal_topology,
+                            network_visualization.load_temporal_topology_version, interval=3600)
+    viewer = stream.subscribe()
+    assert [device['id'] for device in parse_event(viewer.next(0))[2]['devices']] == [1, 2, 3]
+
+    response = client.post('/api/device_metrics/batch', json={'samples': [
+        {'device_id': 2, 'cpu': 75, 'memory': 50, 'disk': 50, 'vulnerability': 50}
+    ]})
+    assert response.get_json()['accepted'] == 1
+    drain_workers()
+    assert stream.publish() == 1
+    event, _, data = parse_event(viewer.next(0))
+    assert event == 'delta'
+    assert [device['id'] for device in data['devices']] == [2]
+    assert data['devices'][0]['metrics']['cpu_usage'] == 75
+    assert data['removed'] == []
+
+    assert stream.publish() == 0
+    assert stream.stats()['skipped'] == 1
+
+    assert client.delete('/api/remove_device/3').status_code == 200
+    assert stream.publish() == 1
+    assert parse_event(viewer.next(0))[2] == {'devices': [], 'removed': [3]}
+
+
+def test_stream_route_sends_retry_then_snapshot(client, add_devices, monkeypatch):
+    add_devices(2)
+    stream = TopologyStream(network_visualization.load_temporal_topology,
+                            network_visualization.load_temporal_topology_version, interval=3600)
+    monkeypatch.setattr(network_visualization, 'topology_stream', stream)
+
+    response = client.get('/api/network/topology/stream', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = (chunk.decode() for chunk in response.response)
+    assert next(chunks).startswith('retry: ')
+    event, _, data = parse_event(next(chunks))
+    assert event == 'snapshot'
+    assert [device['id'] for device in data['devices']] == [1, 2]
+    assert stream.stats()['subscribers'] == 1
+
+    response.close()
+    assert stream.stats()['subscribers'] == 0
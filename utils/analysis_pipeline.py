@@ -0,0 +1,227 @@
+# utils/analysis_pipeline.py
+
+import atexit
+import calendar
+import logging
+import os
+import threading
+import time
+
+from database import (
+    HISTORY_METRICS, ANALYSIS_COLUMNS, write_connection, insert_analysis_results
+)
+from models.decay_engine import decay_engine
+from models.device_baseline import device_baseline
+from models.device_forecast import device_forecaster
+from models.device_state_machine import STATE_THRESHOLDS, device_state_machine
+from models.ema_state import ema_state
+from models.ema import calculate_ema
+from models.sigmoid_modified import sigmoid_modified
+from models.state_transition_adjusted import state_transition_adjusted
+from models.time_decay import calculate_time_decay
+from utils.batch_worker import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+# Pipeline queue settings, overridable from the environment
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('ANALYSIS_QUEUE_SIZE', 100000))
+ANALYSIS_FLUSH_MS = int(os.environ.get('ANALYSIS_FLUSH_MS', 200))
+ANALYSIS_BATCH_ROWS = int(os.environ.get('ANALYSIS_BATCH_ROWS', 2000))
+
+# Smoothing factor of the per-metric EMA
+ANALYSIS_EMA_ALPHA = float(os.environ.get('ANALYSIS_EMA_ALPHA', 0.2))
+# Decay rate (per hour) of the risk carried over from earlier samples
+ANALYSIS_DECAY_RATE = float(os.environ.get('ANALYSIS_DECAY_RATE', 0.5))
+
+# Sigmoid risk inputs: device metric -> (EMA column or None for the raw value, weight)
+RISK_INPUTS = {
+    'cpu_usage': ('ema_cpu', 0.3),
+    'memory_usage': ('ema_memory', 0.2),
+    'disk_usage': ('ema_disk', 0.2),
+    'vulnerability_score': (None, 0.3)
+}
+RISK_WEIGHTS = {metric: weight for metric, (_, weight) in RISK_INPUTS.items()}
+
+# Analysis columns filled from the rolling baseline Z-scores
+ZSCORE_COLUMNS = {
+    'cpu_usage': 'zscore_cpu',
+    'memory_usage': 'zscore_memory',
+    'disk_usage': 'zscore_disk',
+    'vulnerability_score': 'zscore_vulnerability'
+}
+
+
+def parse_timestamp(value):
+    """Parse a format_timestamp string back to epoch seconds; None stays None."""
+    if value is None:
+        return None
+    return calendar.timegm(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+
+def analyze_sample(previous, zscores, values, epoch, decay_factor=None):
+    """
+    Compute the analysis of one sample from the device's previous analysis.
+
+    :param previous: Dict of ANALYSIS_COLUMNS plus 'analysis_epoch' for the
+        device's last analysis; values are None for a new device.
+    :param zscores: Rolling-baseline Z-scores of the sample, by metric.
+    :param values: Sample values by metric.
+    :param epoch: Sample time in epoch seconds.
+    :param decay_factor: Precomputed decay of the carried risk since the
+        previous analysis; computed here when None.
+    :return: Dict of ANALYSIS_COLUMNS plus 'analysis_epoch'.
+    """
+    analysis = {}
+    for metric, (column, _) in RISK_INPUTS.items():
+        if column is None:
+            continue
+        value = values[metric]
+        analysis[column] = value if previous[column] is None else calculate_ema(
+            value, previous[column], ANALYSIS_EMA_ALPHA
+        )
+
+    risk_inputs = {
+        metric: min(max((analysis[column] if column else values[metric]) / 100.0, 0.0), 1.0)
+        for metric, (column, _) in RISK_INPUTS.items()
+    }
+    analysis['sigmoid_risk'] = sigmoid_modified(risk_inputs, RISK_WEIGHTS)
+
+    for metric, column in ZSCORE_COLUMNS.items():
+        analysis[column] = zscores.get(metric)
+
+    # Risk carried from earlier samples fades with the time since the last one
+    if previous['analysis_epoch'] is None:
+        analysis['time_decay_factor'] = 1.0
+        carried_risk = 0.0
+    else:
+        if decay_factor is None:
+            hours = max(epoch - previous['analysis_epoch'], 0) / 3600.0
+            decay_factor = calculate_time_decay(1.0, ANALYSIS_DECAY_RATE, hours)
+        analysis['time_decay_factor'] = decay_factor
+        carried_risk = (previous['sigmoid_risk'] or 0.0) * analysis['time_decay_factor']
+
+    analysis['device_state'] = state_transition_adjusted(
+        previous['device_state'] or 'normal',
+        'none',
+        {'risk': max(analysis['sigmoid_risk'], carried_risk)},
+        STATE_THRESHOLDS
+    )
+    analysis['analysis_epoch'] = epoch
+    return analysis
+
+
+def analyze_metric_samples(conn, rows):
+    """
+    Analyze committed metric rows inside the caller's write transaction.
+
+    Every row is folded in arrival order into its device's analysis EMA,
+    rolling baseline, forecast state, streaming EMAs and device state; one
+    device_analysis_results row per device, for its newest sample, is
+    written through insert_analysis_results, and every state change is
+    appended to the transition log. A row older than its device's last
+    analysis (to the second stored in device_latest) arrived late, e.g.
+    through another worker process, and is skipped rather than folded in
+    out of order.
+
+    :param conn: Write connection from database.write_connection().
+    :param rows: Tuples (device_id, <HISTORY_METRICS...>, epoch_seconds).
+    :return: Number of devices analyzed.
+    """
+    if not rows:
+        return 0
+
+    device_ids = sorted({row[0] for row in rows})
+    baselines = device_baseline.load(conn, device_ids)
+    forecasts = device_forecaster.load(conn, device_ids)
+    emas = ema_state.load(conn, device_ids)
+    previous = {}
+    for start in range(0, len(device_ids), 500):
+        chunk = device_ids[start:start + 500]
+        for row in conn.execute(f'''
+            SELECT device_id, {', '.join(ANALYSIS_COLUMNS)}, analysis_timestamp
+            FROM device_latest
+            WHERE device_id IN ({','.join('?' * len(chunk))})
+        ''', chunk):
+            state = dict(zip(ANALYSIS_COLUMNS, row[1:-1]))
+            state['analysis_epoch'] = parse_timestamp(row[-1])
+            previous[row[0]] = state
+
+    # Hours since each row's previous analysis, decayed in one vectorized call
+    last_epoch = {device_id: state['analysis_epoch'] for device_id, state in previous.items()}
+    in_order = []
+    elapsed_hours = []
+    for row in rows:
+        last = last_epoch.get(row[0])
+        if last is not None and row[-1] < last:
+            continue
+        in_order.append(row)
+        elapsed_hours.append(0.0 if last is None else (row[-1] - last) / 3600.0)
+        last_epoch[row[0]] = row[-1]
+    if len(in_order) < len(rows):
+        logger.warning("Skipped %d metric samples older than their device's last analysis",
+                       len(rows) - len(in_order))
+        rows = in_order
+        device_ids = sorted({row[0] for row in rows})
+        if not rows:
+            return 0
+    decay_factors = decay_engine.decay_factors(ANALYSIS_DECAY_RATE, elapsed_hours).tolist()
+
+    empty = dict(dict.fromkeys(ANALYSIS_COLUMNS), analysis_epoch=None)
+    transitions = []
+    for row, decay_factor in zip(rows, decay_factors):
+        device_id = row[0]
+        values = dict(zip(HISTORY_METRICS, row[1:1 + len(HISTORY_METRICS)]))
+        zscores = device_baseline.score(baselines, device_id, values)
+        device_forecaster.update(forecasts, device_id, values)
+        ema_state.update(emas, device_id, values)
+        before = previous.get(device_id, empty)
+        analysis = analyze_sample(before, zscores, values, row[-1], decay_factor)
+        if analysis['device_state'] != (before['device_state'] or 'normal'):
+            transitions.append((device_id, before['device_state'] or 'normal',
+                                analysis['device_state'], analysis['sigmoid_risk'], row[-1]))
+        previous[device_id] = analysis
+
+    latest = {device_id: previous[device_id] for device_id in device_ids}
+    updated_at = {device_id: analysis['analysis_epoch'] for device_id, analysis in latest.items()}
+    device_baseline.save(conn, baselines, updated_at)
+    device_forecaster.save(conn, forecasts, updated_at)
+    ema_state.save(conn, emas, updated_at)
+    device_state_machine.log_transitions(conn, transitions)
+    insert_analysis_results(conn, [
+        (device_id, *[analysis[c] for c in ANALYSIS_COLUMNS], analysis['analysis_epoch'])
+        for device_id, analysis in latest.items()
+    ])
+    return len(latest)
+
+
+class AnalysisPipeline(BatchWorker):
+    """
+    Worker that analyzes committed metric samples in batches.
+
+    The ingest path submits rows after they are committed; each batch is
+    analyzed and written in one write transaction, so read endpoints serve
+    stored results instead of recomputing them.
+    """
+
+    def __init__(self, queue_size=ANALYSIS_QUEUE_SIZE, flush_ms=ANALYSIS_FLUSH_MS,
+                 batch_rows=ANALYSIS_BATCH_ROWS):
+        super().__init__('analysis-pipeline', queue_size, flush_ms, batch_rows)
+
+    def process_batch(self, batch):
+        with write_connection() as conn:
+            analyze_metric_samples(conn, batch)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_analysis_pipeline():
+    """Return the process-wide AnalysisPipeline, starting it on first use."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = AnalysisPipeline()
+            atexit.register(_pipeline.stop)
+        _pipeline.start()
+        return _pipeline
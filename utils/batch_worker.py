@@ -0,0 +1,142 @@
+# utils/batch_worker.py
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BatchWorker:
+    """
+    Background thread that drains a bounded queue in batches.
+
+    Producers submit items and return immediately. The worker thread collects
+    items for up to `flush_ms` milliseconds or `batch_rows` items, whichever
+    comes first, and hands each batch to process_batch().
+    """
+
+    _STOP = object()
+
+    def __init__(self, name, queue_size, flush_ms, batch_rows):
+        self.name = name
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_rows = batch_rows
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'written': 0,
+            'commits': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_commit_ms': 0.0,
+            'max_commit_ms': 0.0,
+            'total_commit_ms': 0.0
+        }
+
+    def process_batch(self, batch):
+        """Handle one batch of submitted items; implemented by subclasses."""
+        raise NotImplementedError
+
+    def start(self):
+        """Start the worker thread if it is not already running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """Queue an item. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            self._stats['submitted'] += 1
+        return True
+
+    def flush(self, timeout=None):
+        """Block until every queued item has been processed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stop(self, timeout=10):
+        """Process outstanding items and stop the worker thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        """Return queue depth, batch sizes and commit latencies."""
+        with self._lock:
+            stats = dict(self._stats)
+        total_commit_ms = stats.pop('total_commit_ms')
+        stats['avg_batch_size'] = stats['written'] / stats['commits'] if stats['commits'] else 0
+        stats['avg_commit_ms'] = total_commit_ms / stats['commits'] if stats['commits'] else 0.0
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['flush_ms'] = self.flush_interval * 1000
+        stats['batch_rows'] = self.batch_rows
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        try:
+            self.process_batch(batch)
+        except Exception:
+            logger.exception("%s failed to process %d items", self.name, len(batch))
+            with self._lock:
+                self._stats['errors'] += 1
+            return
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['written'] += len(batch)
+            self._stats['commits'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['last_commit_ms'] = elapsed_ms
+            self._stats['max_commit_ms'] = max(self._stats['max_commit_ms'], elapsed_ms)
+            self._stats['total_commit_ms'] += elapsed_ms
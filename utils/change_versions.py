@@ -0,0 +1,92 @@
+# utils/change_versions.py
+"""
+Conditional and delta responses for listing endpoints.
+
+Every change to a versioned table advances the change version kept in
+database.change_versions by triggers. A listing endpoint reads that one
+integer first: responses carry it as ETag and X-Change-Version, a request
+whose If-None-Match still matches is answered 304 without reading the
+listing, and ?since_version= limits the listing to rows changed since a
+version the client already holds.
+"""
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+from database import get_change_version, get_changed_rows, read_connection
+
+
+def parse_since_version():
+    """
+    Read the since_version query argument.
+
+    :return: Non-negative integer, or None if absent.
+    :raises ValueError: If it is not a non-negative integer.
+    """
+    value = request.args.get('since_version')
+    if value is None or value == '':
+        return None
+    since_version = int(value)
+    if since_version < 0:
+        raise ValueError("since_version must be a non-negative integer")
+    return since_version
+
+
+class VersionedListing:
+    """Change version of one request to a versioned listing endpoint."""
+
+    def __init__(self, name, tables, project_id=None, since_version=None):
+        """
+        :param name: Listing name, the ETag prefix.
+        :param tables: Versioned tables the listing is built from.
+        :param project_id: Project scope, or None for the whole fleet.
+        :param since_version: Version the client holds, or None for a full listing.
+        """
+        self.tables = tables
+        self.project_id = project_id
+        self.since_version = since_version
+        # Read before the listing: rows changed in between are sent again
+        # with the next delta rather than missed
+        with read_connection() as conn:
+            self.version, self.updated_at = get_change_version(conn, tables, project_id)
+        scope = 'fleet' if project_id is None else f'project-{project_id}'
+        self.etag = f'{name}-{scope}-{self.version}'
+        if since_version is not None:
+            self.etag += f'-since-{since_version}'
+
+    @property
+    def is_delta(self):
+        """
+        Whether only changed rows are served.
+
+        A version ahead of the current one (from a recreated database) or 0
+        gets the full listing instead.
+        """
+        return self.since_version is not None and 0 < self.since_version <= self.version
+
+    @property
+    def unchanged(self):
+        """Whether the client already holds the current version."""
+        return self.since_version == self.version
+
+    def not_modified(self):
+        """Return a 304 response if If-None-Match matches the current ETag, else None."""
+        if not request.if_none_match.contains(self.etag):
+            return None
+        return self.apply(Response(status=304))
+
+    def changed_rows(self, conn, table):
+        """Ids of the rows of `table` changed and removed since since_version."""
+        if self.unchanged:
+            return [], []
+        return get_changed_rows(conn, table, self.since_version, self.project_id)
+
+    def apply(self, response):
+        """Add the version headers to a response."""
+        response.set_etag(self.etag)
+        if self.updated_at is not None:
+            response.headers['Last-Modified'] = http_date(self.updated_at)
+        response.headers['X-Change-Version'] = str(self.version)
+        # Clients may cache, but must revalidate with If-None-Match
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
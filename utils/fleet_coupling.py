@@ -0,0 +1,176 @@
+# utils/fleet_coupling.py
+"""
+Find co-moving devices across the fleet.
+
+Raw device_metrics_history samples of one metric are averaged onto a common
+time grid, then every pair of devices is scored at once with a blockwise
+Pearson correlation or binned mutual information matrix. Only the strongest
+pairs are kept, so the N x N matrix is never materialized.
+
+Usage: python -m utils.fleet_coupling [--metric cpu_usage] [--method pearson] [--top-k 50]
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from database import HISTORY_METRICS, read_connection, format_timestamp
+from models.mutual_information import discretize_rows, iter_mutual_information_blocks
+from models.pearson_correlation import iter_correlation_blocks
+from utils.series_grid import fill_gaps
+
+# Fraction of grid slots a device must have samples in to be scored
+COUPLING_MIN_COVERAGE = float(os.environ.get('COUPLING_MIN_COVERAGE', 0.5))
+# Seconds a result is served again for the same parameters
+COUPLING_CACHE_SECONDS = float(os.environ.get('COUPLING_CACHE_SECONDS', 60))
+
+COUPLING_METHODS = ('pearson', 'mi')
+MI_BINS = 16
+
+
+def load_metric_grid(conn, metric, start, end, step_seconds, project_id=None):
+    """
+    Average the raw samples of `metric` into `step_seconds` slots over [start, end).
+
+    :return: Tuple (device id list, N x slots array with NaN for empty slots).
+    """
+    slots = math.ceil((end - start) / step_seconds)
+    project_filter = 'AND d.project_id = ?' if project_id is not None else ''
+    params = [start, step_seconds, format_timestamp(start), format_timestamp(end)]
+    if project_id is not None:
+        params.append(project_id)
+    rows = conn.execute(f'''
+        SELECT h.device_id,
+               (CAST(strftime('%s', h.timestamp) AS INTEGER) - ?) / ? AS slot,
+               AVG(h.{metric})
+        FROM device_metrics_history h
+        JOIN devices d ON d.id = h.device_id
+        WHERE h.timestamp >= ? AND h.timestamp < ? {project_filter}
+        GROUP BY h.device_id, slot
+    ''', params).fetchall()
+
+    device_ids = sorted({row[0] for row in rows})
+    index = {device_id: i for i, device_id in enumerate(device_ids)}
+    grid = np.full((len(device_ids), slots), np.nan)
+    for device_id, slot, value in rows:
+        if 0 <= slot < slots and value is not None:
+            grid[index[device_id], slot] = value
+    return device_ids, grid
+
+
+def top_pairs(blocks, threshold=None, top_k=50, signed=False):
+    """
+    Select the strongest pairs from upper-triangle score blocks.
+
+    :param blocks: Iterator of (row offset, column offset, block) as yielded
+        by iter_correlation_blocks or iter_mutual_information_blocks.
+    :param threshold: Minimum strength; None keeps every pair.
+    :param signed: Rank by absolute value (correlations) instead of the score.
+    :return: List of (row, column, score), strongest first, at most top_k long.
+    """
+    candidates = []
+    for i, j, block in blocks:
+        strength = np.abs(block) if signed else block.copy()
+        if i == j:
+            # Drop the diagonal and the mirrored lower triangle
+            strength[np.tril_indices(len(block), m=block.shape[1])] = -np.inf
+        if threshold is not None:
+            strength[strength < threshold] = -np.inf
+        flat = strength.ravel()
+        keep = min(top_k, int(np.isfinite(flat).sum()))
+        if keep == 0:
+            continue
+        best = np.argpartition(flat, -keep)[-keep:]
+        rows, cols = np.unravel_index(best, block.shape)
+        candidates.extend(zip(flat[best].tolist(), (rows + i).tolist(), (cols + j).tolist(),
+                              block[rows, cols].tolist()))
+    candidates.sort(reverse=True)
+    return [(row, col, score) for _, row, col, score in candidates[:top_k]]
+
+
+def analyze_coupling(metric='cpu_usage', method='pearson', hours=6, step_seconds=60,
+                     threshold=None, top_k=50, project_id=None, now=None):
+    """
+    Score every pair of devices on one metric and return the most strongly coupled.
+
+    :param method: 'pearson' ranks pairs by |r|; 'mi' by binned mutual information (nats).
+    :param hours: Window of raw history aligned, ending now.
+    :param step_seconds: Width of the time grid slots.
+    :param threshold: Minimum |r| or MI of a returned pair.
+    :param top_k: Maximum number of pairs returned.
+    :return: Dict with the grid description and 'pairs' of
+        {'device_a', 'device_b', 'score'}, strongest first.
+    """
+    if method not in COUPLING_METHODS:
+        raise ValueError(f"Unknown coupling method: {method}")
+    if metric not in HISTORY_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+
+    started = time.perf_counter()
+    end = int(time.time() if now is None else now) // step_seconds * step_seconds
+    start = end - hours * 3600
+    with read_connection() as conn:
+        device_ids, grid = load_metric_grid(conn, metric, start, end, step_seconds, project_id)
+    keep, series = fill_gaps(grid, math.ceil(grid.shape[1] * COUPLING_MIN_COVERAGE))
+    device_ids = np.asarray(device_ids, dtype=np.int64)[keep] if len(device_ids) else []
+
+    if method == 'pearson':
+        blocks = iter_correlation_blocks(series)
+    else:
+        blocks = iter_mutual_information_blocks(discretize_rows(series, MI_BINS), MI_BINS)
+    pairs = top_pairs(blocks, threshold, top_k, signed=method == 'pearson') if len(series) > 1 else []
+
+    return {
+        'metric': metric,
+        'method': method,
+        'start': format_timestamp(start),
+        'end': format_timestamp(end),
+        'step_seconds': step_seconds,
+        'points': grid.shape[1],
+        'devices': len(series),
+        'pairs': [
+            {'device_a': int(device_ids[a]), 'device_b': int(device_ids[b]), 'score': score}
+            for a, b, score in pairs
+        ],
+        'seconds': time.perf_counter() - started
+    }
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_coupling(**params):
+    """analyze_coupling, reusing a result computed with the same parameters within COUPLING_CACHE_SECONDS."""
+    key = tuple(sorted(params.items()))
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and now - cached[0] < COUPLING_CACHE_SECONDS:
+            return cached[1]
+    result = analyze_coupling(**params)
+    with _cache_lock:
+        for stale in [k for k, (at, _) in _cache.items() if now - at >= COUPLING_CACHE_SECONDS]:
+            del _cache[stale]
+        _cache[key] = (now, result)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--metric', default='cpu_usage', choices=HISTORY_METRICS)
+    parser.add_argument('--method', default='pearson', choices=COUPLING_METHODS)
+    parser.add_argument('--hours', type=int, default=6)
+    parser.add_argument('--step', type=int, default=60)
+    parser.add_argument('--threshold', type=float)
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--project-id', type=int)
+    args = parser.parse_args()
+    print(json.dumps(analyze_coupling(
+        args.metric, args.method, args.hours, args.step, args.threshold, args.top_k, args.project_id
+    ), indent=2))
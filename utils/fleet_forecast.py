@@ -0,0 +1,181 @@
+# utils/fleet_forecast.py
+"""
+Nightly capacity forecasts for every device.
+
+Hourly rollups of every history metric are fitted with Holt-Winters over a
+grid of smoothing parameters. Devices are sharded into chunks that run on a
+process pool; each worker reads and fits its own chunk, and the parent writes
+the best forecast and fit error of every series to device_forecasts.
+
+Usage: python -m utils.fleet_forecast [--workers 4]
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import database
+from database import HISTORY_METRICS, read_connection, write_connection, format_timestamp
+from models.holt_winters import holt_winters_grid_search
+from utils.series_grid import fill_gaps
+
+logger = logging.getLogger(__name__)
+
+# Job settings, overridable from the environment
+FLEET_FORECAST_WORKERS = int(os.environ.get('FLEET_FORECAST_WORKERS', os.cpu_count() or 1))
+FLEET_FORECAST_CHUNK_DEVICES = int(os.environ.get('FLEET_FORECAST_CHUNK_DEVICES', 250))
+FLEET_FORECAST_HISTORY_HOURS = int(os.environ.get('FLEET_FORECAST_HISTORY_HOURS', 14 * 24))
+FLEET_FORECAST_HORIZON_HOURS = int(os.environ.get('FLEET_FORECAST_HORIZON_HOURS', 24))
+# Daily seasonality of the hourly series
+FLEET_FORECAST_SEASON_LENGTH = int(os.environ.get('FLEET_FORECAST_SEASON_LENGTH', 24))
+
+# Smoothing parameter grid searched for every series
+FORECAST_GRID = {
+    'alpha': (0.1, 0.3, 0.5, 0.7, 0.9),
+    'beta': (0.01, 0.05, 0.1, 0.2),
+    'gamma': (0.05, 0.1, 0.3, 0.5)
+}
+
+# Rollup resolution the job fits
+SERIES_TABLE = 'device_metrics_rollup_1h'
+SERIES_STEP_SECONDS = 3600
+
+
+def load_hourly_series(conn, device_ids, start, hours, min_samples):
+    """
+    Read the hourly means of `device_ids` onto a common grid of `hours` buckets.
+
+    Hours without a rollup row are filled from the nearest earlier hour, or
+    the first observed hour for leading gaps.
+
+    :param start: Epoch seconds of the first bucket.
+    :param min_samples: Series with fewer observed hours are dropped.
+    :return: Dict metric -> (device id array, S x hours array).
+    """
+    index = {device_id: i for i, device_id in enumerate(device_ids)}
+    values = np.full((len(device_ids), hours, len(HISTORY_METRICS)), np.nan)
+    columns = ', '.join(f'{m}_mean' for m in HISTORY_METRICS)
+    end = start + hours * SERIES_STEP_SECONDS
+    for offset in range(0, len(device_ids), 500):
+        chunk = device_ids[offset:offset + 500]
+        for row in conn.execute(f'''
+            SELECT device_id, bucket_start, {columns} FROM {SERIES_TABLE}
+            WHERE device_id IN ({','.join('?' * len(chunk))})
+              AND bucket_start >= ? AND bucket_start < ?
+        ''', (*chunk, start, end)):
+            values[index[row[0]], (row[1] - start) // SERIES_STEP_SECONDS] = row[2:]
+
+    ids = np.asarray(device_ids)
+    series = {}
+    for m, metric in enumerate(HISTORY_METRICS):
+        keep, filled = fill_gaps(values[:, :, m], min_samples)
+        if len(filled):
+            series[metric] = (ids[keep], filled)
+    return series
+
+
+def fit_device_chunk(device_ids, start, hours, horizon, season_length, grid):
+    """
+    Fit every series of a chunk of devices; runs in a pool worker.
+
+    :return: List of device_forecasts rows without fitted_at.
+    """
+    with read_connection() as conn:
+        series = load_hourly_series(conn, device_ids, start, hours, 2 * season_length)
+
+    results = []
+    forecast_start = start + hours * SERIES_STEP_SECONDS
+    for metric, (ids, matrix) in series.items():
+        params, rmse, forecasts = holt_winters_grid_search(
+            matrix, grid['alpha'], grid['beta'], grid['gamma'], season_length, horizon
+        )
+        for i, device_id in enumerate(ids.tolist()):
+            results.append((
+                device_id, metric, forecast_start, SERIES_STEP_SECONDS,
+                json.dumps(forecasts[i].round(4).tolist()),
+                *params[i].tolist(), season_length, float(rmse[i]), hours
+            ))
+    return results
+
+
+def _init_worker(database_path):
+    """Point a pool worker at the parent's database."""
+    database.DATABASE_NAME = database_path
+    database.reset_connection_pool()
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def run_fleet_forecast(workers=FLEET_FORECAST_WORKERS, chunk_devices=FLEET_FORECAST_CHUNK_DEVICES,
+                       hours=FLEET_FORECAST_HISTORY_HOURS, horizon=FLEET_FORECAST_HORIZON_HOURS,
+                       season_length=FLEET_FORECAST_SEASON_LENGTH, grid=FORECAST_GRID, now=None):
+    """
+    Forecast every device metric and replace the contents of device_forecasts.
+
+    :param workers: Worker processes; 0 fits in the calling process.
+    :param hours: Hourly buckets of history fitted, ending at the last complete hour.
+    :param horizon: Hours forecast.
+    :param now: Epoch seconds the run is anchored at; defaults to the current time.
+    :return: Dict with device, series and chunk counts and the wall-clock seconds.
+    """
+    started = time.perf_counter()
+    now = time.time() if now is None else now
+    start = int(now) // SERIES_STEP_SECONDS * SERIES_STEP_SECONDS - hours * SERIES_STEP_SECONDS
+    fitted_at = format_timestamp(now)
+
+    with read_connection() as conn:
+        device_ids = [row[0] for row in conn.execute(f'''
+            SELECT DISTINCT device_id FROM {SERIES_TABLE}
+            WHERE bucket_start >= ? ORDER BY device_id
+        ''', (start,))]
+    chunks = [device_ids[i:i + chunk_devices] for i in range(0, len(device_ids), chunk_devices)]
+    args = (start, hours, horizon, season_length, grid)
+
+    written = 0
+
+    def write(rows):
+        with write_connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO device_forecasts (
+                    device_id, metric, forecast_start, step_seconds, forecast,
+                    alpha, beta, gamma, season_length, rmse, samples, fitted_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(*row, fitted_at) for row in rows])
+        return len(rows)
+
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(database.DATABASE_NAME,)) as pool:
+            futures = [pool.submit(fit_device_chunk, chunk, *args) for chunk in chunks]
+            for future in futures:
+                written += write(future.result())
+    else:
+        for chunk in chunks:
+            written += write(fit_device_chunk(chunk, *args))
+
+    # Drop forecasts of devices that no longer have enough history
+    with write_connection() as conn:
+        conn.execute('DELETE FROM device_forecasts WHERE fitted_at < ?', (fitted_at,))
+
+    summary = {
+        'devices': len(device_ids),
+        'series': written,
+        'chunks': len(chunks),
+        'workers': workers,
+        'grid_size': len(grid['alpha']) * len(grid['beta']) * len(grid['gamma']),
+        'seconds': time.perf_counter() - started
+    }
+    logger.info("Fleet forecast: %s", summary)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=FLEET_FORECAST_WORKERS)
+    parser.add_argument('--chunk-devices', type=int, default=FLEET_FORECAST_CHUNK_DEVICES)
+    args = parser.parse_args()
+    print(run_fleet_forecast(args.workers, args.chunk_devices))
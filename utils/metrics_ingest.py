@@ -0,0 +1,209 @@
+# utils/metrics_ingest.py
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from database import (
+    read_connection, write_connection, update_metric_rollups, upsert_latest_metrics,
+    prune_metrics_history, format_timestamp
+)
+from utils.analysis_pipeline import get_analysis_pipeline
+from utils.batch_worker import BatchWorker
+
+logger = logging.getLogger(__name__)
+
+# Metric payload keys as sent by the device simulator, with the defaults
+# used by the single-device PUT handler.
+SAMPLE_FIELDS = [
+    ('cpu', 0),
+    ('memory', 0),
+    ('disk', 0),
+    ('vulnerability', 0),
+    ('network', 0),
+    ('temperature', 40),
+]
+
+MAX_BATCH_SAMPLES = 5000
+
+# Write-behind queue settings, overridable from the environment
+WRITER_QUEUE_SIZE = int(os.environ.get('METRICS_WRITER_QUEUE_SIZE', 10000))
+WRITER_FLUSH_MS = int(os.environ.get('METRICS_WRITER_FLUSH_MS', 50))
+WRITER_BATCH_ROWS = int(os.environ.get('METRICS_WRITER_BATCH_ROWS', 500))
+
+
+def normalize_sample(device_id, data, received_at=None):
+    """
+    Convert a metrics payload into a row tuple.
+
+    :return: Tuple (device_id, cpu, memory, disk, vulnerability, network,
+        temperature, received_at) with received_at in epoch seconds.
+    """
+    values = []
+    for key, default in SAMPLE_FIELDS:
+        value = data.get(key, default)
+        if value is None:
+            value = default
+        values.append(float(value))
+    return (int(device_id), *values, time.time() if received_at is None else received_at)
+
+
+def device_exists(device_id):
+    """Whether `device_id` is a row of the devices table."""
+    with read_connection() as conn:
+        return conn.execute('SELECT 1 FROM devices WHERE id = ?', (device_id,)).fetchone() is not None
+
+
+def write_metric_samples(conn, rows):
+    """
+    Write normalized metric rows inside the caller's write transaction.
+
+    Updates the current metrics in the devices table, appends every row to
+    device_metrics_history, refreshes device_latest and folds the rows into
+    the rollup tables. Rows for unknown devices are skipped.
+
+    :param conn: Write connection from database.write_connection().
+    :param rows: List of tuples produced by normalize_sample.
+    :return: Set of device ids that were written.
+    """
+    if not rows:
+        return set()
+
+    device_ids = sorted({row[0] for row in rows})
+    known_ids = set()
+    cursor = conn.cursor()
+    # Chunk the lookup to stay under SQLite's bound-parameter limit
+    for start in range(0, len(device_ids), 500):
+        chunk = device_ids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT id FROM devices WHERE id IN ({placeholders})', chunk)
+        known_ids.update(row[0] for row in cursor.fetchall())
+
+    rows = [row for row in rows if row[0] in known_ids]
+    if not rows:
+        return known_ids
+
+    cursor.executemany('''
+        UPDATE devices
+        SET cpu_usage = ?,
+            memory_usage = ?,
+            disk_usage = ?,
+            vulnerability_score = ?
+        WHERE id = ?
+    ''', [(row[1], row[2], row[3], row[4], row[0]) for row in rows])
+
+    cursor.executemany('''
+        INSERT INTO device_metrics_history (
+            device_id, cpu_usage, memory_usage, disk_usage,
+            vulnerability_score, network_usage, temperature, timestamp
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(*row[:7], format_timestamp(row[7])) for row in rows])
+
+    upsert_latest_metrics(conn, rows)
+    update_metric_rollups(conn, rows)
+    prune_metrics_history(conn)
+
+    return known_ids
+
+
+def ingest_metric_samples(rows):
+    """
+    Commit normalized rows and queue them for analysis.
+
+    :param rows: List of tuples produced by normalize_sample.
+    :return: Set of device ids that were written.
+    """
+    with write_connection() as conn:
+        written = write_metric_samples(conn, rows)
+    # Analysis runs after the commit, off the request and writer threads
+    pipeline = get_analysis_pipeline()
+    for row in rows:
+        if row[0] in written and not pipeline.submit(row):
+            logger.warning("Analysis queue full, dropped sample for device %s", row[0])
+    return written
+
+
+class IngestStats:
+    """Thread-safe throughput counters for the metric ingestion endpoints."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths = {}
+
+    def record(self, path, samples, elapsed):
+        """Record one request on `path` that wrote `samples` rows in `elapsed` seconds."""
+        with self._lock:
+            stats = self._paths.setdefault(path, {'requests': 0, 'samples': 0, 'seconds': 0.0})
+            stats['requests'] += 1
+            stats['samples'] += samples
+            stats['seconds'] += elapsed
+
+    def snapshot(self):
+        """Return per-path totals with samples/second and the batch speedup."""
+        with self._lock:
+            result = {}
+            for path, stats in self._paths.items():
+                rate = stats['samples'] / stats['seconds'] if stats['seconds'] > 0 else None
+                result[path] = dict(stats, samples_per_second=rate)
+
+        single = result.get('single', {}).get('samples_per_second')
+        batch = result.get('batch', {}).get('samples_per_second')
+        return {
+            'paths': result,
+            'batch_speedup': batch / single if single and batch else None
+        }
+
+    def reset(self):
+        with self._lock:
+            self._paths.clear()
+
+
+ingest_stats = IngestStats()
+
+
+
+class MetricsWriter(BatchWorker):
+    """
+    Background writer that batches single-sample metric writes.
+
+    Request handlers submit normalized rows onto a bounded queue and return
+    immediately. The writer thread drains the queue and group-commits every
+    `flush_ms` milliseconds or every `batch_rows` rows, whichever comes first.
+    Samples of devices deleted after they were queued are counted as dropped.
+    """
+
+    def __init__(self, queue_size=WRITER_QUEUE_SIZE, flush_ms=WRITER_FLUSH_MS,
+                 batch_rows=WRITER_BATCH_ROWS):
+        super().__init__('metrics-writer', queue_size, flush_ms, batch_rows)
+        self._stats['dropped'] = 0
+
+    def process_batch(self, batch):
+        started = time.perf_counter()
+        written = ingest_metric_samples(batch)
+        elapsed = time.perf_counter() - started
+        dropped = sum(1 for row in batch if row[0] not in written)
+        if dropped:
+            logger.warning("Metrics writer dropped %d samples of unknown devices", dropped)
+            with self._lock:
+                self._stats['dropped'] += dropped
+        ingest_stats.record('single', len(batch) - dropped, elapsed)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_metrics_writer():
+    """Return the process-wide MetricsWriter, starting it on first use."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            # Create the pipeline first so its atexit stop runs after the
+            # writer has flushed its last rows into it
+            get_analysis_pipeline()
+            _writer = MetricsWriter()
+            atexit.register(_writer.stop)
+        _writer.start()
+        return _writer
@@ -0,0 +1,525 @@
+# utils/recalculation_jobs.py
+"""
+Fleet-wide risk recalculation after CIP control edits.
+
+Editing a control submits a job instead of rescoring inline. Jobs live in
+the recalculation_jobs table, so every gunicorn worker sees, coalesces and
+cancels the same jobs. Each worker runs a dispatcher thread that claims
+queued jobs under a lease, one job per control at a time: the control's
+compiled risk profile is applied to every device in chunks spread across a
+thread pool, and scores are staged in batched transactions, then swapped
+into device_risk_scores in one transaction when the job completes. A
+cancelled, superseded or failed job leaves the previous complete set of
+scores in place. The running worker renews its lease as the job
+progresses; a job whose lease expires (its worker died) is queued again.
+Jobs report progress, can be cancelled, and repeated edits of a control
+coalesce into a single queued run that picks up its latest version.
+
+/cip/controls/<id>/scores serves the stored scores while they are of the
+control's current version, instead of rescoring the fleet per request.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from database import read_connection, write_connection
+from models.risk_profile import load_device_factors, risk_profiles
+
+logger = logging.getLogger(__name__)
+
+# Job settings, overridable from the environment
+RECALC_WORKERS = int(os.environ.get('RECALC_WORKERS', min(4, os.cpu_count() or 1)))
+RECALC_CHUNK_DEVICES = int(os.environ.get('RECALC_CHUNK_DEVICES', 5000))
+# Chunks of scores written per write transaction
+RECALC_WRITE_CHUNKS = int(os.environ.get('RECALC_WRITE_CHUNKS', 4))
+# Finished jobs kept for status queries
+RECALC_JOB_HISTORY = int(os.environ.get('RECALC_JOB_HISTORY', 100))
+# Seconds a running job's lease lasts without renewal before another worker
+# takes the job over
+RECALC_LEASE_SECONDS = float(os.environ.get('RECALC_LEASE_SECONDS', 60))
+# Seconds between dispatcher polls for jobs queued by other workers
+RECALC_POLL_SECONDS = float(os.environ.get('RECALC_POLL_SECONDS', 1))
+
+FINISHED_STATUSES = ('completed', 'cancelled', 'superseded', 'failed')
+JOB_COLUMNS = (
+    'id', 'control_id', 'status', 'version', 'edits', 'devices', 'processed', 'chunks',
+    'chunks_done', 'error', 'created_at', 'started_at', 'finished_at'
+)
+
+
+def score_device_chunk(profile, id_range):
+    """
+    Score the devices in an inclusive id range against a compiled profile.
+
+    :return: List of (device_id, sigmoid_risk, weighted_score).
+    """
+    with read_connection() as conn:
+        device_ids, values = load_device_factors(conn, profile.keys, id_range=id_range)
+    return list(zip(device_ids.tolist(), profile.sigmoid(values).tolist(),
+                    profile.weighted_score(values).tolist()))
+
+
+def load_stored_scores(control_id, version, method, limit, project_id=None):
+    """
+    Highest stored scores of a control, if the stored set is of `version`.
+
+    Devices removed since the job ran are left out.
+
+    :param method: 'sigmoid' or 'weighted'.
+    :return: Tuple (number of scored devices, computed_at, list of
+        (device_id, score) in descending score order), or None if no
+        complete set of that version is stored.
+    """
+    column = {'sigmoid': 'sigmoid_risk', 'weighted': 'weighted_score'}[method]
+    project_filter = '' if project_id is None else 'AND d.project_id = ?'
+    params = (control_id,) if project_id is None else (control_id, project_id)
+    with read_connection() as conn:
+        low, high, computed_at = conn.execute('''
+            SELECT MIN(version), MAX(version), MAX(computed_at) FROM device_risk_scores
+            WHERE control_id = ?
+        ''', (control_id,)).fetchone()
+        if low != version or high != version:
+            return None
+        devices = conn.execute(f'''
+            SELECT COUNT(*) FROM device_risk_scores s JOIN devices d ON d.id = s.device_id
+            WHERE s.control_id = ? {project_filter}
+        ''', params).fetchone()[0]
+        rows = conn.execute(f'''
+            SELECT s.device_id, s.{column} FROM device_risk_scores s JOIN devices d ON d.id = s.device_id
+            WHERE s.control_id = ? {project_filter}
+            ORDER BY s.{column} DESC, s.device_id
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+    return devices, computed_at, [tuple(row) for row in rows]
+
+
+class RecalculationJob:
+    """State and progress of one recalculation run."""
+
+    def __init__(self, control_id, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.control_id = control_id
+        self.status = 'queued'
+        self.version = None
+        self.edits = 1
+        self.devices = 0
+        self.processed = 0
+        self.chunks = 0
+        self.chunks_done = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Lease of the run executing this job, which also keys its staged scores
+        self.lease_id = None
+        self.cancelled = threading.Event()
+        self.cancel_reason = 'cancelled'
+
+    @classmethod
+    def from_row(cls, row):
+        """Snapshot of a job from its recalculation_jobs row."""
+        job = cls(row['control_id'], row['id'])
+        for column in JOB_COLUMNS[2:]:
+            setattr(job, column, row[column])
+        job.lease_id = row['lease_id']
+        return job
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'control_id': self.control_id,
+            'status': self.status,
+            'version': self.version,
+            'edits': self.edits,
+            'devices': self.devices,
+            'processed': self.processed,
+            'progress': self.processed / self.devices if self.devices else (1.0 if self.status == 'completed' else 0.0),
+            'chunks': self.chunks,
+            'chunks_done': self.chunks_done,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+def _load_job(conn, job_id):
+    row = conn.execute('SELECT * FROM recalculation_jobs WHERE id = ?', (job_id,)).fetchone()
+    return None if row is None else RecalculationJob.from_row(row)
+
+
+class RecalculationJobManager:
+    """
+    Recalculation jobs run off the request thread, shared across workers.
+
+    Jobs returned by the manager are snapshots of their rows; get() or
+    wait() again for fresh progress.
+    """
+
+    def __init__(self, workers=RECALC_WORKERS, chunk_devices=RECALC_CHUNK_DEVICES,
+                 write_chunks=RECALC_WRITE_CHUNKS, history=RECALC_JOB_HISTORY,
+                 lease_seconds=RECALC_LEASE_SECONDS, poll_seconds=RECALC_POLL_SECONDS):
+        self.workers = workers
+        self.chunk_devices = chunk_devices
+        self.write_chunks = write_chunks
+        self.history = history
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        # Jobs this manager's dispatcher is executing, by id
+        self._running = {}
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = None
+
+    def start(self):
+        """Start the dispatcher thread, if it is not running yet."""
+        with self._cond:
+            self._stopping = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='recalculation-jobs', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the dispatcher once its current job is done.
+
+        Queued jobs stay queued for the dispatchers of other workers.
+        """
+        with self._cond:
+            self._stopping = True
+            for job in self._running.values():
+                job.cancel_reason = None
+                job.cancelled.set()
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def submit(self, control_id):
+        """
+        Queue a recalculation of a control, coalescing with one already queued.
+
+        A running job of the same control, in any worker, is cancelled as
+        superseded, since its scores are for an outdated version.
+
+        :return: The queued RecalculationJob.
+        """
+        with write_connection() as conn:
+            row = conn.execute('''
+                SELECT id FROM recalculation_jobs WHERE control_id = ? AND status = 'queued'
+            ''', (control_id,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE recalculation_jobs SET edits = edits + 1 WHERE id = ?', (row['id'],))
+                job_id = row['id']
+            else:
+                conn.execute('''
+                    UPDATE recalculation_jobs SET cancel_requested = 'superseded'
+                    WHERE control_id = ? AND status = 'running'
+                ''', (control_id,))
+                job = RecalculationJob(control_id)
+                conn.execute('''
+                    INSERT INTO recalculation_jobs (id, control_id, status, created_at)
+                    VALUES (?, ?, 'queued', ?)
+                ''', (job.id, control_id, job.created_at))
+                self._trim(conn)
+                job_id = job.id
+            job = _load_job(conn, job_id)
+
+        self.start()
+        with self._cond:
+            for running in self._running.values():
+                if running.control_id == control_id:
+                    running.cancel_reason = 'superseded'
+                    running.cancelled.set()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id):
+        """Return a snapshot of a job by id, or None."""
+        with read_connection() as conn:
+            return _load_job(conn, job_id)
+
+    def list(self, control_id=None):
+        """Return the known jobs, newest first, optionally of one control."""
+        control_filter = '' if control_id is None else 'WHERE control_id = ?'
+        params = () if control_id is None else (control_id,)
+        with read_connection() as conn:
+            rows = conn.execute(f'''
+                SELECT * FROM recalculation_jobs {control_filter}
+                ORDER BY created_at DESC, rowid DESC
+            ''', params).fetchall()
+        return [RecalculationJob.from_row(row) for row in rows]
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job; finished jobs are left unchanged.
+
+        A running job stops at its next chunk, in whichever worker runs it.
+
+        :return: The job, or None if it is unknown.
+        """
+        with write_connection() as conn:
+            job = _load_job(conn, job_id)
+            if job is None or job.finished:
+                return job
+            if job.status == 'queued':
+                conn.execute('''
+                    UPDATE recalculation_jobs SET status = 'cancelled', finished_at = ? WHERE id = ?
+                ''', (time.time(), job_id))
+            else:
+                conn.execute('''
+                    UPDATE recalculation_jobs SET cancel_requested = COALESCE(cancel_requested, 'cancelled')
+                    WHERE id = ?
+                ''', (job_id,))
+            job = _load_job(conn, job_id)
+
+        with self._cond:
+            running = self._running.get(job_id)
+            if running is not None:
+                running.cancelled.set()
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until a job finishes.
+
+        Jobs run by other workers are polled every poll_seconds.
+
+        :return: The finished job, or None if it is unknown (or was trimmed
+            from the history) or still unfinished after `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.finished:
+                return job
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            with self._cond:
+                self._cond.wait(self.poll_seconds if remaining is None else min(self.poll_seconds, remaining))
+
+    def _trim(self, conn):
+        conn.execute(f'''
+            DELETE FROM recalculation_jobs WHERE id IN (
+                SELECT id FROM recalculation_jobs
+                WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))})
+                ORDER BY finished_at DESC, rowid DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (*FINISHED_STATUSES, self.history))
+
+    def _claim(self):
+        """
+        Take the oldest queued job of a control no worker is running.
+
+        Jobs whose lease expired first go back to the queue, unless they were
+        cancelled or a newer job of their control is queued.
+
+        :return: The claimed RecalculationJob, or None.
+        """
+        now = time.time()
+        with write_connection() as conn:
+            expired = conn.execute('''
+                SELECT * FROM recalculation_jobs WHERE status = 'running' AND lease_expires < ?
+            ''', (now,)).fetchall()
+            for row in expired:
+                logger.warning("Recalculation job %s lost its lease", row['id'])
+                conn.execute('DELETE FROM device_risk_scores_staging WHERE run_id = ?', (row['lease_id'],))
+                newer = conn.execute('''
+                    SELECT 1 FROM recalculation_jobs WHERE control_id = ? AND status = 'queued'
+                ''', (row['control_id'],)).fetchone()
+                status = row['cancel_requested'] or ('superseded' if newer else None)
+                if status is not None:
+                    conn.execute('''
+                        UPDATE recalculation_jobs
+                        SET status = ?, finished_at = ?, lease_id = NULL, lease_expires = NULL
+                        WHERE id = ?
+                    ''', (status, now, row['id']))
+                else:
+                    conn.execute('''
+                        UPDATE recalculation_jobs
+                        SET status = 'queued', version = NULL, devices = 0, processed = 0, chunks = 0,
+                            chunks_done = 0, started_at = NULL, lease_id = NULL, lease_expires = NULL
+                        WHERE id = ?
+                    ''', (row['id'],))
+
+            row = conn.execute('''
+                SELECT id FROM recalculation_jobs q
+                WHERE status = 'queued' AND NOT EXISTS (
+                    SELECT 1 FROM recalculation_jobs r
+                    WHERE r.control_id = q.control_id AND r.status = 'running'
+                )
+                ORDER BY created_at, rowid
+                LIMIT 1
+            ''').fetchone()
+            if row is None:
+                return None
+            conn.execute('''
+                UPDATE recalculation_jobs
+                SET status = 'running', started_at = ?, lease_id = ?, lease_expires = ?
+                WHERE id = ?
+            ''', (now, uuid.uuid4().hex, now + self.lease_seconds, row['id']))
+            return _load_job(conn, row['id'])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("Claiming a recalculation job failed")
+                job = None
+            if job is None:
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(self.poll_seconds)
+                continue
+
+            with self._cond:
+                self._running[job.id] = job
+            try:
+                self._execute(job)
+            except Exception as e:
+                logger.exception("Recalculation job %s failed", job.id)
+                job.status = 'failed'
+                job.error = str(e)
+            try:
+                if job.status != 'completed':
+                    with write_connection() as conn:
+                        conn.execute('DELETE FROM device_risk_scores_staging WHERE run_id = ?', (job.lease_id,))
+                        if job.status is not None:
+                            self._record(conn, job)
+            except Exception:
+                logger.exception("Recording recalculation job %s failed", job.id)
+            with self._cond:
+                del self._running[job.id]
+                self._cond.notify_all()
+
+    def _record(self, conn, job):
+        """Persist a job's final state, unless its lease has passed to another worker."""
+        job.finished_at = time.time()
+        conn.execute('''
+            UPDATE recalculation_jobs
+            SET status = ?, version = ?, devices = ?, processed = ?, chunks = ?, chunks_done = ?,
+                error = ?, finished_at = ?, lease_id = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_id = ?
+        ''', (job.status, job.version, job.devices, job.processed, job.chunks, job.chunks_done,
+              job.error, job.finished_at, job.id, job.lease_id))
+
+    def _check_lease(self, conn, job):
+        """
+        Stop a job whose lease was lost or whose cancellation was requested.
+
+        :return: True if the job may go on.
+        """
+        row = conn.execute('''
+            SELECT lease_id, cancel_requested FROM recalculation_jobs WHERE id = ?
+        ''', (job.id,)).fetchone()
+        if row is None or row['lease_id'] != job.lease_id:
+            # Another worker took the job over; its row is no longer ours to update
+            job.cancel_reason = None
+        elif row['cancel_requested'] is not None:
+            job.cancel_reason = row['cancel_requested']
+        else:
+            return not job.cancelled.is_set()
+        job.cancelled.set()
+        return False
+
+    def _execute(self, job):
+        profile = risk_profiles.get(job.control_id)
+        if profile is None:
+            raise LookupError(f"CIP control {job.control_id} not found")
+        job.version = profile.version
+
+        with read_connection() as conn:
+            device_ids = [row[0] for row in conn.execute('SELECT id FROM devices ORDER BY id')]
+        ranges = [
+            (device_ids[i], device_ids[min(i + self.chunk_devices, len(device_ids)) - 1])
+            for i in range(0, len(device_ids), self.chunk_devices)
+        ]
+        job.devices = len(device_ids)
+        job.chunks = len(ranges)
+        computed_at = int(job.started_at)
+        renew_at = 0
+
+        def score(id_range):
+            return None if job.cancelled.is_set() else score_device_chunk(profile, id_range)
+
+        def checkpoint(rows):
+            # Stage rows, persist progress and renew the lease in one transaction
+            nonlocal renew_at
+            with write_connection() as conn:
+                if not self._check_lease(conn, job):
+                    return
+                conn.executemany('''
+                    INSERT OR REPLACE INTO device_risk_scores_staging (
+                        run_id, device_id, sigmoid_risk, weighted_score
+                    ) VALUES (?, ?, ?, ?)
+                ''', [(job.lease_id, device_id, sigmoid, weighted) for device_id, sigmoid, weighted in rows])
+                job.processed += len(rows)
+                conn.execute('''
+                    UPDATE recalculation_jobs
+                    SET version = ?, devices = ?, processed = ?, chunks = ?, chunks_done = ?, lease_expires = ?
+                    WHERE id = ?
+                ''', (job.version, job.devices, job.processed, job.chunks, job.chunks_done,
+                      time.time() + self.lease_seconds, job.id))
+            renew_at = time.monotonic() + self.lease_seconds / 3
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='recalculation')
+        checkpoint([])
+        futures = [self._pool.submit(score, id_range) for id_range in ranges]
+        pending_rows, pending_chunks = [], 0
+        for future in futures:
+            rows = future.result()
+            if job.cancelled.is_set():
+                break
+            pending_rows.extend(rows)
+            pending_chunks += 1
+            job.chunks_done += 1
+            if pending_chunks == self.write_chunks or time.monotonic() >= renew_at:
+                checkpoint(pending_rows)
+                pending_rows, pending_chunks = [], 0
+
+        if not job.cancelled.is_set():
+            checkpoint(pending_rows)
+        if job.cancelled.is_set():
+            for future in futures:
+                future.cancel()
+            job.status = job.cancel_reason
+            return
+        # Replace every score of the control, dropping devices removed since
+        # the previous run, in one transaction with the job's completion
+        with write_connection() as conn:
+            if not self._check_lease(conn, job):
+                job.status = job.cancel_reason
+                return
+            conn.execute('DELETE FROM device_risk_scores WHERE control_id = ?', (job.control_id,))
+            conn.execute('''
+                INSERT INTO device_risk_scores (
+                    control_id, device_id, version, sigmoid_risk, weighted_score, computed_at
+                )
+                SELECT ?, device_id, ?, sigmoid_risk, weighted_score, ?
+                FROM device_risk_scores_staging WHERE run_id = ?
+            ''', (job.control_id, job.version, computed_at, job.lease_id))
+            conn.execute('DELETE FROM device_risk_scores_staging WHERE run_id = ?', (job.lease_id,))
+            job.status = 'completed'
+            self._record(conn, job)
+        logger.info("Recalculation job %s: %s", job.id, job.to_dict())
+
+recalculation_jobs = RecalculationJobManager()
@@ -0,0 +1,24 @@
+# utils/series_grid.py
+
+import numpy as np
+
+
+def fill_gaps(matrix, min_samples=1):
+    """
+    Fill the NaN gaps of series aligned on a common time grid.
+
+    Each gap takes the nearest earlier observation; leading gaps take the
+    first observation.
+
+    :param matrix: S x T array with NaN where a series has no sample.
+    :param min_samples: Series with fewer observations are dropped.
+    :return: Tuple (boolean mask of the kept rows, filled array of the kept rows).
+    """
+    observed = ~np.isnan(matrix)
+    keep = observed.sum(axis=1) >= max(min_samples, 1)
+    matrix, observed = matrix[keep], observed[keep]
+    rows = np.arange(len(matrix))[:, None]
+    last_seen = np.maximum.accumulate(np.where(observed, np.arange(matrix.shape[1]), 0), axis=1)
+    filled = matrix[rows, last_seen]
+    first = matrix[rows[:, 0], observed.argmax(axis=1)]
+    return keep, np.where(np.isnan(filled), first[:, None], filled)
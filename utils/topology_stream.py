@@ -0,0 +1,171 @@
+# utils/topology_stream.py
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Stream settings, overridable from the environment
+TOPOLOGY_STREAM_INTERVAL_SECONDS = float(os.environ.get('TOPOLOGY_STREAM_INTERVAL_SECONDS', 2))
+TOPOLOGY_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('TOPOLOGY_STREAM_HEARTBEAT_SECONDS', 15))
+# Events buffered per viewer before it is resynchronized with a snapshot
+TOPOLOGY_STREAM_BACKLOG = int(os.environ.get('TOPOLOGY_STREAM_BACKLOG', 100))
+TOPOLOGY_STREAM_RETRY_MS = 5000
+
+
+def format_event(event, event_id, data):
+    """Serialize one Server-Sent Event."""
+    return f'event: {event}\nid: {event_id}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class TopologySubscription:
+    """One viewer's queue of serialized events."""
+
+    def __init__(self, stream, backlog):
+        self._stream = stream
+        self._queue = queue.Queue(maxsize=backlog)
+        self.resync = False
+
+    def put(self, message):
+        """Queue an event; a full queue marks the viewer for a snapshot resync instead."""
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.resync = True
+
+    def next(self, timeout):
+        """
+        Return the next serialized event, or None after `timeout` seconds without one.
+
+        A viewer that fell behind skips its backlog and receives a fresh snapshot.
+        """
+        if self.resync:
+            self.resync = False
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            return self._stream.snapshot_event()
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class TopologyStream:
+    """
+    Single producer of topology snapshots and deltas shared by every viewer.
+
+    While anyone is subscribed, one thread reloads the topology every
+    TOPOLOGY_STREAM_INTERVAL_SECONDS, diffs it against the previous load and
+    serializes each delta once for all viewers, so the work per interval is
+    independent of the number of open streams. With a version callable, an
+    interval in which the version did not move skips the reload. The thread
+    exits when the last viewer leaves.
+    """
+
+    def __init__(self, load_topology, load_version=None, interval=TOPOLOGY_STREAM_INTERVAL_SECONDS,
+                 backlog=TOPOLOGY_STREAM_BACKLOG):
+        """
+        :param load_topology: Callable returning dict device_id -> JSON-serializable entry.
+        :param load_version: Optional callable returning the change version of
+            the data behind the topology.
+        """
+        self.load_topology = load_topology
+        self.load_version = load_version
+        self.interval = interval
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._snapshot = None
+        self._snapshot_message = None
+        self._version = None
+        self._sequence = 0
+        self._thread = None
+        self._stats = {'loads': 0, 'skipped': 0, 'deltas': 0, 'resyncs': 0}
+
+    def _load(self):
+        """Load the topology with the version read before it, so no change is missed."""
+        version = self.load_version() if self.load_version is not None else None
+        return version, self.load_topology()
+
+    def _snapshot_event_locked(self):
+        if self._snapshot_message is None:
+            self._snapshot_message = format_event('snapshot', self._sequence, {
+                'devices': list(self._snapshot.values())
+            })
+        return self._snapshot_message
+
+    def snapshot_event(self):
+        """Serialized snapshot of the current topology."""
+        with self._lock:
+            self._stats['resyncs'] += 1
+            return self._snapshot_event_locked()
+
+    def subscribe(self):
+        """Register a viewer; its first event is a full snapshot."""
+        subscription = TopologySubscription(self, self.backlog)
+        with self._lock:
+            if self._snapshot is None:
+                self._version, self._snapshot = self._load()
+                self._stats['loads'] += 1
+            subscription.put(self._snapshot_event_locked())
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='topology-stream', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self):
+        """Reload the topology and send the changed and removed devices to every viewer."""
+        if self.load_version is not None and self._snapshot is not None:
+            if self.load_version() == self._version:
+                with self._lock:
+                    self._stats['skipped'] += 1
+                return 0
+        version, current = self._load()
+        with self._lock:
+            self._stats['loads'] += 1
+            previous = self._snapshot or {}
+            changed = [entry for device_id, entry in current.items() if previous.get(device_id) != entry]
+            removed = [device_id for device_id in previous if device_id not in current]
+            self._snapshot = current
+            self._version = version
+            if not changed and not removed:
+                return 0
+            self._sequence += 1
+            self._snapshot_message = None
+            self._stats['deltas'] += 1
+            message = format_event('delta', self._sequence, {'devices': changed, 'removed': removed})
+            for subscription in self._subscribers:
+                subscription.put(message)
+            return len(changed) + len(removed)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._subscribers:
+                    # Nobody is watching: drop the snapshot so the next viewer starts fresh
+                    self._snapshot = None
+                    self._snapshot_message = None
+                    self._version = None
+                    self._thread = None
+                    return
+            try:
+                self.publish()
+            except Exception:
+                logger.exception("Topology stream update failed")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, subscribers=len(self._subscribers), sequence=self._sequence)
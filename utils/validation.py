@@ -17,3 +17,37 @@ def format_error(message):
     :return: A dictionary with the error message.
     """
     return {"error": message}
+
+def parse_device_id(value):
+    """
+    Coerce a device id from request data to an int.
+    :param value: The device id as sent, an integer or a numeric string.
+    :return: The device id as an int.
+    :raises ValueError: If the value is not an integer.
+    """
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"device_id must be an integer, got {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"device_id must be an integer, got {value!r}") from None
+
+def is_number(value):
+    """
+    Check that request data is a number.
+    :param value: The value to check.
+    :return: True if it is an int or float (booleans excluded).
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def is_number_map(value, allow_none=True):
+    """
+    Check that request data is an object of numbers.
+    :param value: The value to check.
+    :param allow_none: Whether null values are accepted.
+    :return: True if it is a dict whose values are all int or float (or None if allowed).
+    """
+    return isinstance(value, dict) and all(
+        (allow_none and item is None) or is_number(item)
+        for item in value.values()
+    )
@@ -0,0 +1,14 @@
+# wsgi.py
+"""
+WSGI entry point of the production server.
+
+Usage: gunicorn -c gunicorn.conf.py wsgi:app
+
+The schema is created once by the gunicorn master (see gunicorn.conf.py),
+so workers only build the app.
+"""
+
+from server import configure_logging, create_app
+
+configure_logging()
+app = create_app(init_database=False)